@@ -0,0 +1,439 @@
+# src/archive_extractor.py
+"""
+Archive Extractor Module
+
+Lists the members of archives without downloading them. ZIP-based formats
+(zip, jar, docx/xlsx/pptx, odt, epub) are read through ranged reads of the
+end-of-central-directory record and the central directory only; tar and
+tar.gz are streamed with a bounded buffer. Small members can optionally be
+inspected recursively, with depth, size and compression-ratio caps to guard
+against zip bombs.
+"""
+import mimetypes
+import os
+import struct
+import tarfile
+import zipfile
+
+from loguru import logger
+
+from config_utils import get_env_variable, parse_bool
+from inspection_budget import BudgetExceeded
+from storage import RangedFile
+
+# Maximum number of members listed in the metadata
+ARCHIVE_MAX_MEMBERS = get_env_variable("ARCHIVE_MAX_MEMBERS", 1000, int)
+# Size of the ranged reads used for the ZIP central directory
+ARCHIVE_RANGE_BLOCK_SIZE = get_env_variable("ARCHIVE_RANGE_BLOCK_SIZE", 8192, int)
+# Read buffer used when streaming tar archives
+ARCHIVE_STREAM_BUFFER = get_env_variable("ARCHIVE_STREAM_BUFFER", 256 * 1024, int)
+# Recursive inspection of small members
+ARCHIVE_RECURSE = get_env_variable("ARCHIVE_RECURSE", "false", parse_bool)
+ARCHIVE_MAX_DEPTH = get_env_variable("ARCHIVE_MAX_DEPTH", 2, int)
+ARCHIVE_MEMBER_MAX_BYTES = get_env_variable(
+    "ARCHIVE_MEMBER_MAX_BYTES", 4 * 1024 * 1024, int
+)
+ARCHIVE_MAX_INSPECTED_MEMBERS = get_env_variable(
+    "ARCHIVE_MAX_INSPECTED_MEMBERS", 20, int
+)
+# Members compressed more than this are flagged and never decompressed
+ARCHIVE_MAX_COMPRESSION_RATIO = get_env_variable(
+    "ARCHIVE_MAX_COMPRESSION_RATIO", 100, float
+)
+
+# ZIP-based container formats, identified by a characteristic member
+ZIP_CONTAINER_MARKERS = [
+    ("word/document.xml", "docx"),
+    ("xl/workbook.xml", "xlsx"),
+    ("ppt/presentation.xml", "pptx"),
+    ("META-INF/MANIFEST.MF", "jar"),
+    ("AndroidManifest.xml", "apk"),
+]
+
+ZIP_COMPRESSION_NAMES = {
+    zipfile.ZIP_STORED: "stored",
+    zipfile.ZIP_DEFLATED: "deflate",
+    zipfile.ZIP_BZIP2: "bzip2",
+    zipfile.ZIP_LZMA: "lzma",
+}
+
+
+def detect_archive_format(head):
+    """
+    Detect the archive format from the leading bytes of an object.
+
+    Parameters:
+    - head (bytes): The leading bytes (at least 262 for tar detection).
+
+    Returns:
+    - str or None: 'zip', 'gzip', 'bzip2', 'xz' or 'tar', or None.
+    """
+    if head.startswith((b"PK\x03\x04", b"PK\x05\x06")):
+        return "zip"
+    if head.startswith(b"\x1f\x8b"):
+        return "gzip"
+    if head.startswith(b"BZh"):
+        return "bzip2"
+    if head.startswith(b"\xfd7zXZ\x00"):
+        return "xz"
+    if head[257:262] == b"ustar":
+        return "tar"
+    return None
+
+
+def _member_mime_type(name):
+    mime_type, _ = mimetypes.guess_type(name)
+    return mime_type or "application/octet-stream"
+
+
+def _compression_ratio(uncompressed_size, compressed_size):
+    if not compressed_size:
+        return None
+    return round(uncompressed_size / compressed_size, 2)
+
+
+def _inspect_member(name, content, depth, inspect_depth, budget):
+    # Imported here because inspector imports this module
+    from inspector import InspectObject
+    from storage import MemoryBackend
+
+    # Members are inspected at the depth and within the budget of the archive;
+    # their reads from memory are charged again, which keeps the byte budget
+    # conservative
+    with InspectObject(
+        None,
+        name,
+        backend=MemoryBackend({name: content}),
+        include_content=False,
+        nesting_depth=depth,
+        depth=inspect_depth,
+        budget=budget,
+    ) as inspect_object:
+        return inspect_object.generate_metadata()
+
+
+def _tar_member_type(info):
+    if info.isdir():
+        return "directory"
+    if info.isfile():
+        return "file"
+    if info.issym() or info.islnk():
+        return "link"
+    return "other"
+
+
+def _read_member(file_object, limit):
+    """
+    Read at most limit bytes of a member.
+
+    Returns:
+    - bytes or None: The content, or None if the member exceeds the limit.
+    """
+    content = file_object.read(limit + 1)
+    if len(content) > limit:
+        return None
+    return content
+
+
+def _should_inspect(member, inspected, depth, recurse):
+    return (
+        recurse
+        and depth < ARCHIVE_MAX_DEPTH
+        and inspected < ARCHIVE_MAX_INSPECTED_MEMBERS
+        and member["type"] == "file"
+        and 0 < member["size"] <= ARCHIVE_MEMBER_MAX_BYTES
+        and not member.get("suspicious")
+    )
+
+
+def extract_zip_metadata(
+    backend,
+    key,
+    size,
+    depth=0,
+    recurse=ARCHIVE_RECURSE,
+    inspect_depth=None,
+    budget=None,
+    head=None,
+):
+    """
+    List the members of a ZIP-based archive through ranged reads.
+
+    Only the end-of-central-directory record and the central directory are
+    read unless members are inspected recursively.
+
+    Parameters:
+    - backend (StorageBackend): The backend holding the archive.
+    - key (str): The object key.
+    - size (int): The object size.
+    - depth (int): Nesting depth of this archive.
+    - recurse (bool): Whether to inspect small members.
+    - inspect_depth (str): Inspection depth of the members.
+    - budget (InspectionBudget): Budget the member inspections are charged to.
+    - head (bytes): Leading bytes already read, which are not fetched again.
+
+    Returns:
+    - dict: The archive metadata.
+    """
+    ranged_file = RangedFile(
+        backend, key, size, block_size=ARCHIVE_RANGE_BLOCK_SIZE, head=head
+    )
+    with zipfile.ZipFile(ranged_file) as archive:
+        infos = archive.infolist()
+        names = {info.filename for info in infos}
+
+        container = "zip"
+        if "mimetype" in names:
+            # OpenDocument and EPUB store their MIME type in a 'mimetype' member
+            container = archive.read("mimetype")[:100].decode("ascii", "replace")
+        else:
+            for marker, marker_container in ZIP_CONTAINER_MARKERS:
+                if marker in names:
+                    container = marker_container
+                    break
+
+        members = []
+        total_uncompressed = 0
+        total_compressed = 0
+        suspicious_members = 0
+        inspected = 0
+        for info in infos:
+            total_uncompressed += info.file_size
+            total_compressed += info.compress_size
+            ratio = _compression_ratio(info.file_size, info.compress_size)
+            suspicious = ratio is not None and ratio > ARCHIVE_MAX_COMPRESSION_RATIO
+            suspicious_members += suspicious
+            if len(members) >= ARCHIVE_MAX_MEMBERS:
+                continue
+
+            member = {
+                "name": info.filename,
+                "type": "directory" if info.is_dir() else "file",
+                "size": info.file_size,
+                "compressed_size": info.compress_size,
+                "compression": ZIP_COMPRESSION_NAMES.get(
+                    info.compress_type, str(info.compress_type)
+                ),
+                "compression_ratio": ratio,
+                "mime_type": _member_mime_type(info.filename),
+                "encrypted": bool(info.flag_bits & 0x1),
+            }
+            if suspicious:
+                member["suspicious"] = True
+
+            if (
+                _should_inspect(member, inspected, depth, recurse)
+                and not member["encrypted"]
+            ):
+                try:
+                    with archive.open(info) as member_file:
+                        content = _read_member(member_file, ARCHIVE_MEMBER_MAX_BYTES)
+                except BudgetExceeded:
+                    # Listing needs no more reads; only stop inspecting members
+                    recurse = False
+                else:
+                    if content is None:
+                        # The declared size was wrong
+                        member["suspicious"] = True
+                    else:
+                        member["metadata"] = _inspect_member(
+                            info.filename, content, depth + 1, inspect_depth, budget
+                        )
+                        inspected += 1
+
+            members.append(member)
+
+    return {
+        "archive_format": "zip",
+        "container": container,
+        "size": size,
+        "member_count": len(infos),
+        "members_truncated": len(infos) > len(members),
+        "total_uncompressed_size": total_uncompressed,
+        "total_compressed_size": total_compressed,
+        "compression_ratio": _compression_ratio(total_uncompressed, total_compressed),
+        "suspicious_members": suspicious_members,
+        "members": members,
+        "bytes_read": ranged_file.bytes_read,
+    }
+
+
+def extract_tar_metadata(
+    backend,
+    key,
+    size,
+    depth=0,
+    recurse=ARCHIVE_RECURSE,
+    inspect_depth=None,
+    budget=None,
+):
+    """
+    List the members of a (possibly compressed) tar archive by streaming it.
+
+    Memory use is bounded by ARCHIVE_STREAM_BUFFER regardless of the archive
+    size, but the whole archive is transferred.
+
+    Parameters:
+    - backend (StorageBackend): The backend holding the archive.
+    - key (str): The object key.
+    - size (int): The object size.
+    - depth (int): Nesting depth of this archive.
+    - recurse (bool): Whether to inspect small members.
+    - inspect_depth (str): Inspection depth of the members.
+    - budget (InspectionBudget): Budget the member inspections are charged to.
+
+    Returns:
+    - dict: The archive metadata.
+    """
+    stream = backend.open_stream(key)
+    try:
+        members = []
+        member_count = 0
+        total_size = 0
+        inspected = 0
+        complete = True
+        with tarfile.open(
+            fileobj=stream, mode="r|*", bufsize=ARCHIVE_STREAM_BUFFER
+        ) as archive:
+            compression = getattr(archive.fileobj, "comptype", None)
+            try:
+                for info in archive:
+                    member_count += 1
+                    total_size += info.size
+                    if len(members) >= ARCHIVE_MAX_MEMBERS:
+                        continue
+
+                    member = {
+                        "name": info.name,
+                        "type": _tar_member_type(info),
+                        "size": info.size,
+                        "mime_type": _member_mime_type(info.name),
+                    }
+                    if _should_inspect(member, inspected, depth, recurse):
+                        content = _read_member(
+                            archive.extractfile(info), ARCHIVE_MEMBER_MAX_BYTES
+                        )
+                        if content is not None:
+                            member["metadata"] = _inspect_member(
+                                info.name, content, depth + 1, inspect_depth, budget
+                            )
+                            inspected += 1
+                    members.append(member)
+            except BudgetExceeded:
+                # The stream was cut short: describe the members read so far
+                complete = False
+    finally:
+        stream.close()
+        if hasattr(stream, "release_conn"):
+            stream.release_conn()
+
+    return {
+        "archive_format": "tar",
+        "compression": compression if compression not in (None, "tar") else None,
+        "size": size,
+        "member_count": member_count,
+        "members_truncated": member_count > len(members) or not complete,
+        "total_uncompressed_size": total_size,
+        "compression_ratio": _compression_ratio(total_size, size),
+        "members": members,
+    }
+
+
+def extract_gzip_metadata(backend, key, size, head):
+    """
+    Describe a gzip file that does not contain a tar archive.
+
+    The original name comes from the gzip header and the uncompressed size
+    (modulo 4 GiB) from the trailer, so only the head and the last 4 bytes
+    are read.
+
+    Parameters:
+    - backend (StorageBackend): The backend holding the file.
+    - key (str): The object key.
+    - size (int): The object size.
+    - head (bytes): The leading bytes of the file.
+
+    Returns:
+    - dict: The archive metadata.
+    """
+    original_name = None
+    flags = head[3] if len(head) > 3 else 0
+    if flags & 0x08:
+        # FNAME: zero-terminated name after the 10-byte header and FEXTRA
+        offset = 10
+        if flags & 0x04:
+            offset += 2 + struct.unpack("<H", head[10:12])[0]
+        end = head.find(b"\x00", offset)
+        if end != -1:
+            original_name = head[offset:end].decode("latin-1")
+
+    trailer = backend.read_range(key, max(size - 4, 0), 4)
+    uncompressed_size = struct.unpack("<I", trailer)[0] if len(trailer) == 4 else None
+
+    member = {
+        "name": original_name or os.path.splitext(os.path.basename(key))[0],
+        "type": "file",
+        "size": uncompressed_size,
+        "mime_type": _member_mime_type(original_name or os.path.splitext(key)[0]),
+    }
+    return {
+        "archive_format": "gzip",
+        "size": size,
+        "member_count": 1,
+        "members_truncated": False,
+        "total_uncompressed_size": uncompressed_size,
+        "compression_ratio": _compression_ratio(uncompressed_size or 0, size),
+        "members": [member],
+    }
+
+
+def extract_archive_metadata(
+    backend,
+    key,
+    head,
+    size=None,
+    depth=0,
+    recurse=ARCHIVE_RECURSE,
+    inspect_depth=None,
+    budget=None,
+):
+    """
+    Extract metadata from an archive.
+
+    Parameters:
+    - backend (StorageBackend): The backend holding the archive.
+    - key (str): The object key.
+    - head (bytes): The leading bytes of the archive.
+    - size (int): The object size, fetched from the backend when omitted.
+    - depth (int): Nesting depth of this archive.
+    - recurse (bool): Whether to inspect small members.
+    - inspect_depth (str): Inspection depth of the members.
+    - budget (InspectionBudget): Budget the member inspections are charged to.
+
+    Returns:
+    - dict or None: The archive metadata, or None for unsupported formats.
+    """
+    archive_format = detect_archive_format(head)
+    if size is None:
+        size = backend.stat(key).size
+
+    if archive_format == "zip":
+        return extract_zip_metadata(
+            backend, key, size, depth, recurse, inspect_depth, budget, head
+        )
+    if archive_format in ("gzip", "bzip2", "xz", "tar"):
+        try:
+            return extract_tar_metadata(
+                backend, key, size, depth, recurse, inspect_depth, budget
+            )
+        except tarfile.ReadError:
+            if archive_format == "gzip":
+                return extract_gzip_metadata(backend, key, size, head)
+            logger.debug(f"'{key}' is a compressed file without a tar archive")
+            return {
+                "archive_format": archive_format,
+                "size": size,
+                "member_count": None,
+                "members": [],
+            }
+    return None
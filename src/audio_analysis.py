@@ -0,0 +1,498 @@
+# src/audio_analysis.py
+"""
+Audio Analysis Module
+
+Reads audio stream information (duration, sample rate, bit depth, codec)
+from the container headers with mutagen, and optionally decodes the audio to
+PCM with a piped ffmpeg process to measure levels: RMS, sample peak,
+BS.1770 / EBU R 128 style gated loudness and silent passages.
+
+The PCM is processed in fixed-size chunks with vectorized NumPy and only
+running sums, a loudness histogram and a short overlap are kept, so memory
+use does not depend on the length of the audio. The same path handles the
+audio track of videos.
+"""
+import shutil
+import struct
+import subprocess
+import threading
+import time
+
+import numpy as np
+from loguru import logger
+from mutagen import File, MutagenError
+
+from config_utils import get_env_variable, parse_bool
+
+# Decode the audio and measure levels (headers are always read)
+AUDIO_ANALYSIS = get_env_variable("AUDIO_ANALYSIS", "false", parse_bool)
+# Seconds of PCM processed per chunk
+AUDIO_CHUNK_SECONDS = get_env_variable("AUDIO_CHUNK_SECONDS", 1.0, float)
+# Only the first seconds are analyzed (0 analyzes everything)
+AUDIO_ANALYSIS_MAX_SECONDS = get_env_variable("AUDIO_ANALYSIS_MAX_SECONDS", 0, float)
+# Passages quieter than the threshold for at least the minimum duration
+AUDIO_SILENCE_THRESHOLD_DB = get_env_variable(
+    "AUDIO_SILENCE_THRESHOLD_DB", -60.0, float
+)
+AUDIO_SILENCE_MIN_SECONDS = get_env_variable("AUDIO_SILENCE_MIN_SECONDS", 0.5, float)
+# Maximum number of silent passages listed
+AUDIO_MAX_SILENCES = get_env_variable("AUDIO_MAX_SILENCES", 100, int)
+
+# The audio is decoded at the rate the BS.1770 filter is specified for. Mono
+# and stereo keep their channels (an upmix would lower mono by 3 dB), other
+# layouts are downmixed to stereo
+SAMPLE_RATE = 48000
+CHANNEL_LAYOUTS = "mono|stereo"
+# Loudness blocks of 400 ms overlapping by 75 %
+HOP_FRAMES = SAMPLE_RATE // 10
+BLOCK_HOPS = 4
+BLOCK_FRAMES = HOP_FRAMES * BLOCK_HOPS
+# Absolute and relative gates (LUFS / LU)
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+# Loudness histogram from the absolute gate up, in 0.01 LU bins
+HISTOGRAM_MAX = 10.0
+HISTOGRAM_RESOLUTION = 0.01
+HISTOGRAM_BINS = int((HISTOGRAM_MAX - ABSOLUTE_GATE) / HISTOGRAM_RESOLUTION)
+
+# Codec of the formats whose mutagen info has no codec attribute
+MUTAGEN_CODECS = {
+    "AAC": "aac",
+    "AIFF": "pcm",
+    "ASF": "wma",
+    "FLAC": "flac",
+    "MonkeysAudio": "ape",
+    "OggFLAC": "flac",
+    "OggOpus": "opus",
+    "OggSpeex": "speex",
+    "OggTheora": "theora",
+    "OggVorbis": "vorbis",
+    "TrueAudio": "tta",
+    "WAVE": "pcm",
+    "WavPack": "wavpack",
+}
+
+
+def read_audio_info(file_object):
+    """
+    Read the audio stream information from the container headers.
+
+    Parameters:
+    - file_object: Seekable binary file object (e.g. a RangedFile or a
+      BufferReader); mutagen only reads the headers it needs.
+
+    Returns:
+    - dict or None: The stream information, or None if the format is not
+      recognized.
+    """
+    try:
+        audio = File(file_object)
+    except MutagenError as e:
+        # E.g. an AVI, which the WAVE reader claims for its RIFF header
+        logger.debug(f"Could not read the audio headers: {e}")
+        return None
+    if audio is None:
+        return None
+    info = audio.info
+    codec = getattr(info, "codec", None)
+    if codec is None:
+        name = type(audio).__name__
+        if name in ("MP3", "EasyMP3"):
+            codec = f"mp{getattr(info, 'layer', 3)}"
+        else:
+            codec = MUTAGEN_CODECS.get(name, name.lower())
+    return {
+        "audio_codec": codec,
+        "audio_codec_description": getattr(info, "codec_description", None),
+        "audio_channels": getattr(info, "channels", None),
+        "audio_bitrate": getattr(info, "bitrate", None),
+        "sample_rate": getattr(info, "sample_rate", None),
+        "bit_depth": getattr(info, "bits_per_sample", None),
+        "duration": getattr(info, "length", None),
+    }
+
+
+def _k_weighting_gain(frequencies):
+    # |H(f)|^2 of the BS.1770 K-weighting filter (pre-filter shelf and RLB
+    # high-pass) at 48 kHz
+    z = np.exp(-2j * np.pi * frequencies / SAMPLE_RATE)
+    shelf = (1.53512485958697 - 2.69169618940638 * z + 1.19839281085285 * z**2) / (
+        1 - 1.69065929318241 * z + 0.73248077421585 * z**2
+    )
+    high_pass = (1 - 2 * z + z**2) / (
+        1 - 1.99004745483398 * z + 0.99007225036621 * z**2
+    )
+    return np.abs(shelf * high_pass) ** 2
+
+
+def _block_weights():
+    # Weights turning |rfft|^2 of a block into the mean square of the
+    # K-weighted block (Parseval, counting the mirrored bins twice)
+    weights = _k_weighting_gain(np.fft.rfftfreq(BLOCK_FRAMES, 1 / SAMPLE_RATE))
+    weights[1:-1] *= 2
+    return (weights / BLOCK_FRAMES**2).astype(np.float32)
+
+
+_BLOCK_WEIGHTS = _block_weights()
+
+
+def _to_db(value, floor=-200.0):
+    if value <= 0:
+        return floor
+    return float(10 * np.log10(value))
+
+
+class AudioAnalyzer:
+    """
+    Accumulates level statistics over PCM chunks.
+    """
+
+    def __init__(
+        self,
+        channels,
+        silence_threshold_db=AUDIO_SILENCE_THRESHOLD_DB,
+        silence_min_seconds=AUDIO_SILENCE_MIN_SECONDS,
+        max_silences=AUDIO_MAX_SILENCES,
+    ):
+        self.channels = channels
+        self.silence_threshold = 10 ** (silence_threshold_db / 10)
+        self.silence_min_hops = max(int(round(silence_min_seconds * 10)), 1)
+        self.max_silences = max_silences
+        self.frames = 0
+        self.sum_squares = np.zeros(channels)
+        self.peak = np.zeros(channels)
+        # Block energies per loudness bin
+        self.histogram = (np.zeros(HISTOGRAM_BINS), np.zeros(HISTOGRAM_BINS))
+        self.max_momentary = None
+        self.silences = []
+        self.silent_hops = 0
+        self._silence_start = None
+        self._hops = 0
+        self._pending = np.zeros((0, channels), dtype=np.float32)
+        self._overlap = np.zeros((0, channels), dtype=np.float32)
+
+    def update(self, samples):
+        """
+        Add a chunk of samples.
+
+        Parameters:
+        - samples (ndarray): (frames, channels) float32 samples in [-1, 1].
+        """
+        if len(samples) == 0:
+            return
+        self.frames += len(samples)
+        self.sum_squares += np.einsum("ij,ij->j", samples, samples, dtype=np.float64)
+        self.peak = np.maximum(self.peak, np.abs(samples).max(axis=0))
+
+        # Level analysis works on whole 100 ms hops
+        samples = np.concatenate([self._pending, samples])
+        whole = len(samples) - len(samples) % HOP_FRAMES
+        self._pending = samples[whole:]
+        if whole:
+            self._process_hops(samples[:whole])
+
+    def _process_hops(self, samples):
+        hops = samples.reshape(-1, HOP_FRAMES, self.channels)
+        self._detect_silence((hops**2).mean(axis=(1, 2)))
+
+        # 400 ms blocks starting at every hop, including the last 300 ms of
+        # the previous chunk
+        samples = np.concatenate([self._overlap, samples])
+        self._overlap = samples[-(BLOCK_FRAMES - HOP_FRAMES) :]
+        if len(samples) < BLOCK_FRAMES:
+            return
+        blocks = np.lib.stride_tricks.sliding_window_view(
+            samples, BLOCK_FRAMES, axis=0
+        )[::HOP_FRAMES]
+        spectrum = np.fft.rfft(blocks, axis=-1)
+        # K-weighted mean square per block and channel, summed over the
+        # channels
+        powers = (spectrum.real**2 + spectrum.imag**2) @ _BLOCK_WEIGHTS
+        self._add_blocks(powers.sum(axis=1))
+
+    def _add_blocks(self, energies):
+        loudness = -0.691 + 10 * np.log10(np.maximum(energies, 1e-20))
+        momentary = float(loudness.max())
+        if self.max_momentary is None or momentary > self.max_momentary:
+            self.max_momentary = momentary
+        bins = np.floor((loudness - ABSOLUTE_GATE) / HISTOGRAM_RESOLUTION).astype(int)
+        kept = bins >= 0
+        bins = np.minimum(bins[kept], HISTOGRAM_BINS - 1)
+        counts, sums = self.histogram
+        np.add.at(counts, bins, 1)
+        np.add.at(sums, bins, energies[kept])
+
+    def _detect_silence(self, hop_powers):
+        silent = np.asarray(hop_powers) < self.silence_threshold
+        # Only the hops where silence starts or ends are visited
+        was_silent = np.int8(self._silence_start is not None)
+        for position in np.flatnonzero(
+            np.diff(silent.astype(np.int8), prepend=was_silent)
+        ):
+            if silent[position]:
+                self._silence_start = self._hops + position
+            else:
+                self._close_silence(self._hops + position)
+        self._hops += len(silent)
+
+    def _close_silence(self, end):
+        if self._silence_start is None:
+            return
+        length = end - self._silence_start
+        if length >= self.silence_min_hops:
+            self.silent_hops += int(length)
+            if len(self.silences) < self.max_silences:
+                self.silences.append((self._silence_start / 10, end / 10))
+        self._silence_start = None
+
+    def _integrated_loudness(self):
+        counts, sums = self.histogram
+        if not counts.sum():
+            return None
+        ungated = -0.691 + 10 * np.log10(sums.sum() / counts.sum())
+        relative_gate = ungated + RELATIVE_GATE
+        first_bin = max(
+            int(np.ceil((relative_gate - ABSOLUTE_GATE) / HISTOGRAM_RESOLUTION)), 0
+        )
+        count = counts[first_bin:].sum()
+        if not count:
+            return None
+        return round(-0.691 + _to_db(sums[first_bin:].sum() / count), 2)
+
+    def result(self):
+        """
+        Get the statistics of the samples added so far.
+
+        Returns:
+        - dict: Levels in dBFS, loudness in LUFS and silences in seconds.
+        """
+        if len(self._pending):
+            # The trailing partial hop only counts for silence detection
+            self._detect_silence([float((self._pending**2).mean())])
+        self._pending = self._pending[:0]
+        self._close_silence(self._hops)
+
+        frames = max(self.frames, 1)
+        rms = self.sum_squares / frames
+        max_momentary = self.max_momentary
+        return {
+            "decoded_duration": round(self.frames / SAMPLE_RATE, 3),
+            "analyzed_channels": self.channels,
+            "rms_db": round(_to_db(rms.mean()), 2),
+            "peak_db": round(_to_db(float(self.peak.max()) ** 2), 2),
+            "integrated_loudness_lufs": self._integrated_loudness(),
+            "max_momentary_loudness_lufs": (
+                round(max_momentary, 2) if max_momentary is not None else None
+            ),
+            "silence_duration": round(self.silent_hops / 10, 1),
+            "silences": [
+                {"start": float(start), "end": float(end)}
+                for start, end in self.silences
+            ],
+            "silences_truncated": len(self.silences) >= self.max_silences,
+        }
+
+
+def ffmpeg_executable():
+    """
+    Get the ffmpeg binary: the one bundled with imageio-ffmpeg, else the one
+    on the PATH.
+    """
+    try:
+        import imageio_ffmpeg
+
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except (ImportError, RuntimeError):
+        return shutil.which("ffmpeg")
+
+
+def _chunks(data, chunk_size):
+    # Chunks of a buffer or of a stream, e.g. StorageBackend.open_stream()
+    if hasattr(data, "read"):
+        while True:
+            chunk = data.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    with memoryview(data) as view:
+        for start in range(0, len(view), chunk_size):
+            yield view[start : start + chunk_size]
+
+
+def _feed(stdin, data, chunk_size):
+    chunks = _chunks(data, chunk_size)
+    try:
+        for chunk in chunks:
+            stdin.write(chunk)
+    except (BrokenPipeError, ValueError):
+        # ffmpeg stops reading once it has what it needs
+        pass
+    except Exception as e:
+        # E.g. a stream whose read budget is spent: ffmpeg decodes what it got
+        logger.debug(f"Stopped feeding ffmpeg: {e}")
+    finally:
+        # Releases the view of the buffer
+        chunks.close()
+        try:
+            stdin.close()
+        except BrokenPipeError:
+            pass
+
+
+def _read_wav_header(stream):
+    # Channel count from the header of a piped WAV, whose stream is left at
+    # the start of the samples. None when the stream ends first.
+    if len(stream.read(12)) < 12:
+        return None
+    channels = None
+    while True:
+        header = stream.read(8)
+        if len(header) < 8:
+            return None
+        chunk_id, size = struct.unpack("<4sI", header)
+        if chunk_id == b"data":
+            return channels
+        body = stream.read(size + size % 2)
+        if chunk_id == b"fmt ":
+            channels = struct.unpack("<H", body[2:4])[0]
+
+
+def decode_pcm(
+    source=None,
+    data=None,
+    chunk_seconds=AUDIO_CHUNK_SECONDS,
+    max_seconds=AUDIO_ANALYSIS_MAX_SECONDS,
+):
+    """
+    Decode the first audio track to 48 kHz float PCM, mono or stereo.
+
+    Parameters:
+    - source (str): Path or URL ffmpeg reads from.
+    - data (bytes-like or file object): Content piped to ffmpeg in chunks when
+      no source is given.
+    - chunk_seconds (float): Duration of the yielded chunks.
+    - max_seconds (float): Stop after this duration (0 for no limit).
+
+    Yields:
+    - ndarray: (frames, channels) float32 samples.
+
+    Raises:
+    - RuntimeError: When ffmpeg is not available or decoding fails before
+      any audio was produced.
+    """
+    executable = ffmpeg_executable()
+    if executable is None:
+        raise RuntimeError("ffmpeg is not available")
+
+    command = [executable, "-v", "error"]
+    if source:
+        command += ["-nostdin", "-i", source]
+    else:
+        command += ["-i", "pipe:0"]
+    command += ["-map", "0:a:0", "-vn", "-sn", "-dn"]
+    if max_seconds:
+        command += ["-t", str(max_seconds)]
+    # WAV output, since the header gives the channel count ffmpeg chose
+    command += [
+        "-af",
+        f"aformat=channel_layouts={CHANNEL_LAYOUTS}",
+        "-ar",
+        str(SAMPLE_RATE),
+        "-c:a",
+        "pcm_f32le",
+        "-fflags",
+        "+bitexact",
+        "-f",
+        "wav",
+        "pipe:1",
+    ]
+
+    process = subprocess.Popen(
+        command,
+        stdin=subprocess.PIPE if source is None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    feeder = None
+    if source is None:
+        feeder = threading.Thread(
+            target=_feed, args=(process.stdin, data, 1024 * 1024), daemon=True
+        )
+        feeder.start()
+    # Drain stderr so that ffmpeg never blocks on it
+    errors = []
+    drainer = threading.Thread(
+        target=lambda: errors.append(process.stderr.read()), daemon=True
+    )
+    drainer.start()
+
+    frames = 0
+    try:
+        channels = _read_wav_header(process.stdout)
+        frame_bytes = (channels or 1) * 4
+        chunk_bytes = max(int(chunk_seconds * SAMPLE_RATE), 1) * frame_bytes
+        while channels:
+            chunk = process.stdout.read(chunk_bytes)
+            if not chunk:
+                break
+            # A short read can end mid-frame only at the end of the stream
+            chunk = chunk[: len(chunk) - len(chunk) % frame_bytes]
+            samples = np.frombuffer(chunk, dtype="<f4").reshape(-1, channels)
+            frames += len(samples)
+            yield samples
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        drainer.join()
+        if feeder is not None:
+            feeder.join()
+
+    if frames == 0 and process.returncode:
+        message = errors[0].decode("utf-8", "replace").strip() if errors else ""
+        raise RuntimeError(f"ffmpeg could not decode the audio: {message[-500:]}")
+
+
+def analyze_audio(
+    source=None,
+    data=None,
+    max_seconds=AUDIO_ANALYSIS_MAX_SECONDS,
+    time_limit=None,
+):
+    """
+    Decode the audio and measure its levels in constant memory.
+
+    Parameters:
+    - source (str): Path or URL of the file.
+    - data (bytes-like or file object): Content piped to ffmpeg in chunks when
+      no source is given.
+    - max_seconds (float): Analyze at most this duration (0 for no limit).
+    - time_limit (float): Stop decoding after this many seconds of wall-clock
+      time (None for no limit).
+
+    Returns:
+    - dict or None: The analysis, or None without an audio track. 'complete'
+      is False when the time limit stopped the decoding.
+    """
+    deadline = None if time_limit is None else time.monotonic() + time_limit
+    analyzer = None
+    complete = True
+    chunks = decode_pcm(source, data, max_seconds=max_seconds)
+    try:
+        for samples in chunks:
+            if analyzer is None:
+                analyzer = AudioAnalyzer(samples.shape[1])
+            analyzer.update(samples)
+            if deadline is not None and time.monotonic() >= deadline:
+                complete = False
+                break
+    except RuntimeError as e:
+        logger.debug(f"Audio analysis failed: {e}")
+        return None
+    finally:
+        # Stops ffmpeg when the decoding was cut short
+        chunks.close()
+    if analyzer is None or analyzer.frames == 0:
+        return None
+    return {**analyzer.result(), "complete": complete}
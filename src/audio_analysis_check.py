@@ -0,0 +1,119 @@
+# src/audio_analysis_check.py
+"""
+Audio Analysis Check
+
+Compares the sample peak and integrated loudness measured by analyze_audio
+with those of ffmpeg's ebur128 filter, on mono and stereo fixtures generated
+with ffmpeg. Mono sources must be measured on their one channel: an upmix to
+stereo would put them 3 dB low.
+
+Usage: python audio_analysis_check.py
+
+Exits with status 1 when a measurement differs by more than the tolerance.
+"""
+
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+from audio_analysis import analyze_audio, ffmpeg_executable
+
+# ebur128 prints one decimal
+TOLERANCE_DB = 0.1
+
+# Name, lavfi source and channel count of each fixture
+FIXTURES = [
+    ("mono sine", "sine=frequency=1000:duration=5,volume=0.5", 1),
+    ("mono noise", "anoisesrc=duration=5:amplitude=0.2:seed=1", 1),
+    ("stereo", "sine=frequency=440:duration=5,volume=0.3", 2),
+]
+
+_INTEGRATED = re.compile(r"I:\s+(-?[\d.]+) LUFS")
+_PEAK = re.compile(r"Peak:\s+(-?[\d.]+) dBFS")
+
+
+def ebur128(path):
+    """
+    Measure a file with ffmpeg's ebur128 filter.
+
+    Returns:
+    - tuple: Integrated loudness in LUFS and sample peak in dBFS.
+    """
+    output = subprocess.run(
+        [
+            ffmpeg_executable(),
+            "-nostats",
+            "-i",
+            path,
+            "-af",
+            "ebur128=peak=sample",
+            "-f",
+            "null",
+            "-",
+        ],
+        stdin=subprocess.DEVNULL,
+        capture_output=True,
+        check=True,
+    ).stderr.decode("utf-8", "replace")
+    # The summary comes last
+    return (
+        float(_INTEGRATED.findall(output)[-1]),
+        float(_PEAK.findall(output)[-1]),
+    )
+
+
+def check(name, path, channels):
+    expected_loudness, expected_peak = ebur128(path)
+    analysis = analyze_audio(path)
+    failures = []
+    if analysis["analyzed_channels"] != channels:
+        failures.append(f"{analysis['analyzed_channels']} channels analyzed")
+    for field, expected in (
+        ("integrated_loudness_lufs", expected_loudness),
+        ("peak_db", expected_peak),
+    ):
+        if abs(analysis[field] - expected) > TOLERANCE_DB:
+            failures.append(f"{field} {analysis[field]} instead of {expected}")
+    print(
+        f"{name}: {analysis['integrated_loudness_lufs']} LUFS, "
+        f"{analysis['peak_db']} dBFS peak "
+        f"(ebur128: {expected_loudness} LUFS, {expected_peak} dBFS)"
+    )
+    for failure in failures:
+        print(f"  {name}: {failure}")
+    return not failures
+
+
+def main():
+    if ffmpeg_executable() is None:
+        sys.exit("ffmpeg is not available")
+    ok = True
+    with tempfile.TemporaryDirectory() as directory:
+        for name, source, channels in FIXTURES:
+            path = os.path.join(directory, f"{name.replace(' ', '_')}.wav")
+            subprocess.run(
+                [
+                    ffmpeg_executable(),
+                    "-v",
+                    "error",
+                    "-f",
+                    "lavfi",
+                    "-i",
+                    source,
+                    "-ac",
+                    str(channels),
+                    "-ar",
+                    "44100",
+                    path,
+                ],
+                stdin=subprocess.DEVNULL,
+                check=True,
+            )
+            ok = check(name, path, channels) and ok
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,483 @@
+# src/concurrency_controller.py
+"""
+Adaptive Concurrency Controller
+
+Runs the RabbitMQ message handler on a worker pool whose size is adjusted at
+runtime. At a fixed interval the controller samples the queue depth (passive
+queue_declare), the age of the messages being processed, the latency of the
+MinIO requests and the CPU utilization, and adapts the number of concurrent
+inspections and the channel prefetch AIMD-style: one more worker while there
+is a backlog and all workers are busy, a multiplicative decrease as soon as
+MinIO latency rises or the CPU is saturated.
+"""
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import pika
+from loguru import logger
+from opentelemetry import metrics, trace
+
+from config_utils import get_env_variable
+from latency_stats import MINIO_LATENCY, percentile
+from tracing import extract_context
+
+# Bounds of the number of concurrent inspections
+CONCURRENCY_MIN = get_env_variable("CONCURRENCY_MIN", 1, int)
+CONCURRENCY_MAX = get_env_variable("CONCURRENCY_MAX", (os.cpu_count() or 1) * 4, int)
+CONCURRENCY_INITIAL = get_env_variable("CONCURRENCY_INITIAL", 2, int)
+# Seconds between two adjustments
+CONCURRENCY_ADJUST_INTERVAL = get_env_variable(
+    "CONCURRENCY_ADJUST_INTERVAL", 5.0, float
+)
+# Additive increase and multiplicative decrease
+CONCURRENCY_INCREASE_STEP = get_env_variable("CONCURRENCY_INCREASE_STEP", 1, int)
+CONCURRENCY_DECREASE_FACTOR = get_env_variable(
+    "CONCURRENCY_DECREASE_FACTOR", 0.75, float
+)
+# Unacknowledged messages allowed per worker
+CONCURRENCY_PREFETCH_PER_WORKER = get_env_variable(
+    "CONCURRENCY_PREFETCH_PER_WORKER", 2, int
+)
+# Back off when the p90 MinIO latency exceeds this multiple of the baseline
+# (the lowest median seen), but never below the floor
+CONCURRENCY_LATENCY_TOLERANCE = get_env_variable(
+    "CONCURRENCY_LATENCY_TOLERANCE", 2.0, float
+)
+CONCURRENCY_LATENCY_FLOOR_MS = get_env_variable(
+    "CONCURRENCY_LATENCY_FLOOR_MS", 50.0, float
+)
+# Back off when the CPU utilization (0-1) exceeds this value
+CONCURRENCY_CPU_TARGET = get_env_variable("CONCURRENCY_CPU_TARGET", 0.85, float)
+# Messages older than this count as a backlog even when the queue is empty
+CONCURRENCY_LAG_TARGET_SECONDS = get_env_variable(
+    "CONCURRENCY_LAG_TARGET_SECONDS", 10.0, float
+)
+
+_tracer = trace.get_tracer(__name__)
+
+# Signals sampled at each adjustment
+Signals = namedtuple(
+    "Signals",
+    [
+        "queue_depth",
+        "lag_seconds",
+        "latency_p50_ms",
+        "latency_p90_ms",
+        "cpu_utilization",
+        "in_flight",
+    ],
+)
+
+
+class CpuSampler:
+    """
+    Measures the CPU utilization of the node between two samples.
+    """
+
+    def __init__(self):
+        self._last = self._read()
+
+    @staticmethod
+    def _read():
+        try:
+            with open("/proc/stat") as stat_file:
+                fields = [int(value) for value in stat_file.readline().split()[1:]]
+        except (OSError, ValueError):
+            return None
+        # idle + iowait
+        idle = fields[3] + (fields[4] if len(fields) > 4 else 0)
+        return sum(fields), idle
+
+    def sample(self):
+        """
+        Get the CPU utilization since the previous sample.
+
+        Falls back to the load average where /proc/stat is not available.
+
+        Returns:
+        - float or None: The utilization between 0 and 1.
+        """
+        current = self._read()
+        last, self._last = self._last, current
+        if current is None or last is None:
+            try:
+                return min(os.getloadavg()[0] / (os.cpu_count() or 1), 1.0)
+            except OSError:
+                return None
+        total = current[0] - last[0]
+        if total <= 0:
+            return None
+        return 1 - (current[1] - last[1]) / total
+
+
+class ConcurrencyLimit:
+    """
+    Limits the number of threads inside a block; the limit can be changed
+    while threads are waiting.
+    """
+
+    def __init__(self, limit):
+        """
+        Create a ConcurrencyLimit instance.
+
+        Parameters:
+        - limit (int): The initial limit.
+        """
+        self.limit = limit
+        self.active = 0
+        self._peak = 0
+        self._condition = threading.Condition()
+
+    def set_limit(self, limit):
+        with self._condition:
+            self.limit = limit
+            self._condition.notify_all()
+
+    def take_peak(self):
+        """
+        Get the highest number of active threads since the previous call.
+        """
+        with self._condition:
+            peak, self._peak = self._peak, self.active
+            return peak
+
+    def __enter__(self):
+        with self._condition:
+            self._condition.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+            self._peak = max(self._peak, self.active)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+
+class AimdPolicy:
+    """
+    Additive-increase / multiplicative-decrease policy for the concurrency.
+    """
+
+    def __init__(
+        self,
+        minimum=CONCURRENCY_MIN,
+        maximum=CONCURRENCY_MAX,
+        increase_step=CONCURRENCY_INCREASE_STEP,
+        decrease_factor=CONCURRENCY_DECREASE_FACTOR,
+        latency_tolerance=CONCURRENCY_LATENCY_TOLERANCE,
+        latency_floor_ms=CONCURRENCY_LATENCY_FLOOR_MS,
+        cpu_target=CONCURRENCY_CPU_TARGET,
+        lag_target_seconds=CONCURRENCY_LAG_TARGET_SECONDS,
+    ):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.latency_floor_ms = latency_floor_ms
+        self.cpu_target = cpu_target
+        self.lag_target_seconds = lag_target_seconds
+        self.baseline_ms = None
+
+    def latency_threshold_ms(self):
+        """
+        Get the p90 MinIO latency above which the concurrency is reduced.
+        """
+        if self.baseline_ms is None:
+            return None
+        return max(self.latency_floor_ms, self.baseline_ms * self.latency_tolerance)
+
+    def _update_baseline(self, latency_p50_ms):
+        if latency_p50_ms is None:
+            return
+        if self.baseline_ms is None or latency_p50_ms < self.baseline_ms:
+            self.baseline_ms = latency_p50_ms
+        else:
+            # Drift slowly towards the current latency so that a permanently
+            # slower cluster becomes the new baseline
+            self.baseline_ms += 0.02 * (latency_p50_ms - self.baseline_ms)
+
+    def next_limit(self, limit, signals):
+        """
+        Compute the next concurrency limit.
+
+        Parameters:
+        - limit (int): The current limit.
+        - signals (Signals): The sampled signals.
+
+        Returns:
+        - tuple: The new limit and the reason ('backoff', 'increase', 'idle'
+          or 'hold').
+        """
+        threshold_ms = self.latency_threshold_ms()
+        self._update_baseline(signals.latency_p50_ms)
+
+        latency_high = (
+            threshold_ms is not None
+            and signals.latency_p90_ms is not None
+            and signals.latency_p90_ms > threshold_ms
+        )
+        cpu_high = (
+            signals.cpu_utilization is not None
+            and signals.cpu_utilization > self.cpu_target
+        )
+        if latency_high or cpu_high:
+            return max(self.minimum, int(limit * self.decrease_factor)), "backoff"
+
+        backlog = signals.queue_depth > 0 or (
+            signals.lag_seconds is not None
+            and signals.lag_seconds > self.lag_target_seconds
+        )
+        if backlog and signals.in_flight >= limit:
+            return min(self.maximum, limit + self.increase_step), "increase"
+        if not backlog and signals.in_flight * 2 < limit:
+            return max(self.minimum, limit - 1), "idle"
+        return limit, "hold"
+
+
+class ConcurrencyController:
+    """
+    Dispatches RabbitMQ deliveries to an adaptively sized worker pool.
+
+    All channel operations run on the connection thread: acknowledgements are
+    handed over with add_callback_threadsafe and adjustments run from a
+    connection timer, so the controller works with a BlockingConnection.
+    """
+
+    def __init__(
+        self,
+        connection,
+        channel,
+        queue_name,
+        handler,
+        policy=None,
+        initial=CONCURRENCY_INITIAL,
+        interval=CONCURRENCY_ADJUST_INTERVAL,
+        prefetch_per_worker=CONCURRENCY_PREFETCH_PER_WORKER,
+        latency=MINIO_LATENCY,
+    ):
+        """
+        Create a ConcurrencyController instance.
+
+        Parameters:
+        - connection (BlockingConnection): The RabbitMQ connection.
+        - channel (BlockingChannel): The channel consuming the queue.
+        - queue_name (str): The consumed queue.
+        - handler (callable): Called as handler(properties, body) on a worker
+          thread for each message; the message is acknowledged afterwards.
+        - policy (AimdPolicy): The adjustment policy.
+        - initial (int): The initial concurrency.
+        - interval (float): Seconds between two adjustments.
+        - prefetch_per_worker (int): Unacknowledged messages per worker.
+        - latency (LatencyTracker): The MinIO request latencies.
+        """
+        self.connection = connection
+        self.channel = channel
+        self.queue_name = queue_name
+        self.handler = handler
+        self.policy = policy or AimdPolicy()
+        self.interval = interval
+        self.prefetch_per_worker = prefetch_per_worker
+        self.latency = latency
+        self.limit = ConcurrencyLimit(
+            min(max(initial, self.policy.minimum), self.policy.maximum)
+        )
+        self.prefetch_count = None
+        self.cpu = CpuSampler()
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.policy.maximum, thread_name_prefix="inspect"
+        )
+        self._ages = []
+        self._ages_lock = threading.Lock()
+        self._stats_channel = None
+        self._last_adjustment = time.monotonic()
+        self._timer = None
+        self._stopped = False
+
+        meter = metrics.get_meter(__name__)
+        self.queue_depth_recorder = meter.create_value_recorder(
+            name="queue_depth",
+            description="Messages waiting in the inspection queue",
+            unit="1",
+        )
+        self.queue_lag_recorder = meter.create_value_recorder(
+            name="queue_lag",
+            description="Age of the oldest message started since the last adjustment",
+            unit="s",
+        )
+        self.concurrency_recorder = meter.create_value_recorder(
+            name="inspection_concurrency",
+            description="Current limit of concurrent inspections",
+            unit="1",
+        )
+        self.in_flight_recorder = meter.create_value_recorder(
+            name="inspections_in_flight",
+            description="Peak number of concurrent inspections",
+            unit="1",
+        )
+        self.minio_latency_recorder = meter.create_value_recorder(
+            name="minio_request_latency_p90",
+            description="90th percentile of the MinIO request latency",
+            unit="ms",
+        )
+        self.cpu_recorder = meter.create_value_recorder(
+            name="cpu_utilization",
+            description="CPU utilization of the node",
+            unit="1",
+        )
+
+    def start(self):
+        """
+        Apply the initial prefetch and schedule the adjustments.
+
+        Call before basic_consume, from the connection thread.
+        """
+        self._apply_prefetch()
+        self._timer = self.connection.call_later(self.interval, self._tick)
+
+    def stop(self):
+        """
+        Stop adjusting, wait for the running inspections and deliver their
+        acknowledgements while the connection is still open.
+        """
+        self._stopped = True
+        if self._timer is not None and self.connection.is_open:
+            self.connection.remove_timeout(self._timer)
+        self._timer = None
+        self.limit.set_limit(self.policy.maximum)
+        self.executor.shutdown(wait=True)
+        if self.connection.is_open:
+            self.connection.process_data_events(time_limit=0)
+
+    def on_message(self, channel, method, properties, body):
+        """
+        basic_consume callback handing the message to the worker pool.
+        """
+        # The span is started here, under the Pika consumer span when there is
+        # one, so that the trace stays open until the worker has processed the
+        # message and is sampled as a whole
+        parent = trace.get_current_span().get_span_context()
+        span = _tracer.start_span(
+            "process_message",
+            context=None if parent.is_valid else extract_context(properties.headers),
+        )
+        self.executor.submit(
+            self._process, span, method.delivery_tag, properties, body
+        )
+
+    def _process(self, span, delivery_tag, properties, body):
+        with self.limit, trace.use_span(span, end_on_exit=True):
+            if span.is_recording():
+                # Waiting for a worker does not make the inspection slow
+                span.set_attribute(
+                    "inspector.queue_wait_ms",
+                    (time.time_ns() - span.start_time) / 1e6,
+                )
+            if properties.timestamp:
+                with self._ages_lock:
+                    self._ages.append(max(time.time() - properties.timestamp, 0))
+            try:
+                self.handler(properties, body)
+            except Exception as e:
+                logger.error(f"Error processing RabbitMQ message: {e}", exc_info=True)
+            finally:
+                self._ack(delivery_tag)
+
+    def _ack(self, delivery_tag):
+        try:
+            self.connection.add_callback_threadsafe(
+                partial(self._basic_ack, delivery_tag)
+            )
+        except pika.exceptions.ConnectionWrongStateError:
+            # The message is delivered again after reconnecting
+            logger.warning(f"Connection closed before acknowledging {delivery_tag}")
+
+    def _basic_ack(self, delivery_tag):
+        if self.channel.is_open:
+            self.channel.basic_ack(delivery_tag=delivery_tag)
+
+    def _apply_prefetch(self):
+        prefetch_count = self.limit.limit * self.prefetch_per_worker
+        if prefetch_count != self.prefetch_count:
+            # global_qos makes the new limit apply to the running consumer
+            self.channel.basic_qos(prefetch_count=prefetch_count, global_qos=True)
+            self.prefetch_count = prefetch_count
+
+    def _queue_depth(self):
+        # Passive declares run on their own channel, since a failure closes it
+        try:
+            if self._stats_channel is None or not self._stats_channel.is_open:
+                self._stats_channel = self.connection.channel()
+            result = self._stats_channel.queue_declare(
+                queue=self.queue_name, passive=True
+            )
+            return result.method.message_count
+        except pika.exceptions.AMQPError as e:
+            logger.warning(f"Could not read the depth of '{self.queue_name}': {e}")
+            self._stats_channel = None
+            return 0
+
+    def _take_lag(self):
+        with self._ages_lock:
+            ages, self._ages = self._ages, []
+        return max(ages) if ages else None
+
+    def sample(self):
+        """
+        Sample the signals since the previous adjustment.
+
+        Returns:
+        - Signals: The sampled signals.
+        """
+        since, self._last_adjustment = self._last_adjustment, time.monotonic()
+        latencies = self.latency.samples(since)
+        return Signals(
+            queue_depth=self._queue_depth(),
+            lag_seconds=self._take_lag(),
+            latency_p50_ms=percentile(latencies, 50),
+            latency_p90_ms=percentile(latencies, 90),
+            cpu_utilization=self.cpu.sample(),
+            in_flight=self.limit.take_peak(),
+        )
+
+    def adjust(self):
+        """
+        Sample the signals, then resize the worker pool and the prefetch.
+        """
+        signals = self.sample()
+        limit = self.limit.limit
+        new_limit, reason = self.policy.next_limit(limit, signals)
+        if new_limit != limit:
+            self.limit.set_limit(new_limit)
+            self._apply_prefetch()
+            logger.bind(
+                reason=reason,
+                latency_threshold_ms=self.policy.latency_threshold_ms(),
+                **signals._asdict(),
+            ).info(f"Adjusted inspection concurrency from {limit} to {new_limit}")
+
+        self.queue_depth_recorder.record(signals.queue_depth)
+        if signals.lag_seconds is not None:
+            self.queue_lag_recorder.record(signals.lag_seconds)
+        if signals.latency_p90_ms is not None:
+            self.minio_latency_recorder.record(signals.latency_p90_ms)
+        if signals.cpu_utilization is not None:
+            self.cpu_recorder.record(signals.cpu_utilization)
+        self.in_flight_recorder.record(signals.in_flight)
+        self.concurrency_recorder.record(new_limit)
+
+    def _tick(self):
+        self._timer = None
+        if self._stopped:
+            return
+        try:
+            self.adjust()
+        except Exception as e:
+            logger.error(f"Error adjusting inspection concurrency: {e}", exc_info=True)
+        if not self._stopped and self.connection.is_open:
+            self._timer = self.connection.call_later(self.interval, self._tick)
@@ -24,3 +24,18 @@ def get_env_variable(env_name, default=None, cast_func=None):
     """
     value = os.getenv(env_name, default)
     return cast_func(value) if cast_func is not None else value
+
+
+def parse_bool(value):
+    """
+    Interpret an environment variable value as a boolean.
+
+    Parameters:
+    - value: The raw value (str or bool).
+
+    Returns:
+    - bool: True for "1", "true", "yes" and "on" (case-insensitive).
+    """
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
@@ -0,0 +1,672 @@
+# src/document_extractor.py
+"""
+Document Extractor Module
+
+Characterizes PDF documents from a handful of ranged reads: the version and
+linearization dictionary come from the head of the object, the trailer and
+cross-reference data from its tail, and only the catalog, page tree root and
+document information objects are fetched after that. Full parsing of the
+document (with the optional pypdf package) only happens when requested.
+"""
+import re
+import zlib
+from collections import namedtuple
+
+from loguru import logger
+
+from config_utils import get_env_variable, parse_bool
+from inspection_budget import BudgetExceeded
+from storage import BufferReader, RangedFile
+
+# Parse the whole document instead of using ranged reads
+DOCUMENT_FULL_PARSE = get_env_variable("DOCUMENT_FULL_PARSE", "false", parse_bool)
+# Size of the ranged reads used to locate the trailer and objects
+DOCUMENT_RANGE_BLOCK_SIZE = get_env_variable("DOCUMENT_RANGE_BLOCK_SIZE", 4096, int)
+
+# Bytes read at the end of the file to locate 'startxref'
+TAIL_SIZES = (1024, 16 * 1024)
+# Bytes read at an object offset, retried with the larger sizes if truncated
+OBJECT_READ_SIZES = (4096, 64 * 1024, 1024 * 1024)
+# Maximum number of cross-reference sections followed through /Prev
+MAX_XREF_SECTIONS = 32
+
+INFO_FIELDS = {
+    "Title": "title",
+    "Author": "author",
+    "Subject": "subject",
+    "Producer": "producer",
+    "Creator": "creator",
+    "CreationDate": "creation_date",
+    "ModDate": "modification_date",
+}
+
+WHITESPACE = b"\x00\t\n\x0c\r "
+DELIMITERS = b"()<>[]{}/%"
+
+PdfRef = namedtuple("PdfRef", ["number", "generation"])
+
+
+class PdfError(ValueError):
+    """
+    Raised when PDF data cannot be parsed.
+    """
+
+
+class PdfName(str):
+    """
+    A PDF name object (strings are returned as bytes).
+    """
+
+
+class PdfStream(namedtuple("PdfStream", ["dictionary", "data"])):
+    """
+    A PDF stream object with its raw (still encoded) data.
+    """
+
+
+def is_pdf(head):
+    """
+    Check whether the leading bytes of an object are those of a PDF.
+
+    Parameters:
+    - head (bytes): The leading bytes.
+
+    Returns:
+    - bool: True for PDF documents.
+    """
+    return b"%PDF-" in head[:1024]
+
+
+class _Parser:
+    """
+    Minimal parser for PDF objects held in a bytes buffer.
+    """
+
+    def __init__(self, data, position=0):
+        self.data = data
+        self.position = position
+
+    def skip_whitespace(self):
+        data = self.data
+        while self.position < len(data):
+            char = data[self.position]
+            if char in WHITESPACE:
+                self.position += 1
+            elif char == ord("%"):
+                end = data.find(b"\n", self.position)
+                self.position = len(data) if end == -1 else end + 1
+            else:
+                break
+
+    def _token(self):
+        start = self.position
+        data = self.data
+        while (
+            self.position < len(data)
+            and data[self.position] not in WHITESPACE
+            and data[self.position] not in DELIMITERS
+        ):
+            self.position += 1
+        return data[start : self.position]
+
+    def expect(self, keyword):
+        self.skip_whitespace()
+        if self._token() != keyword:
+            raise PdfError(f"Expected '{keyword.decode()}'")
+
+    def parse(self):
+        self.skip_whitespace()
+        data = self.data
+        if self.position >= len(data):
+            raise PdfError("Unexpected end of data")
+
+        if data.startswith(b"<<", self.position):
+            return self._parse_dictionary()
+        char = data[self.position]
+        if char == ord("<"):
+            return self._parse_hex_string()
+        if char == ord("["):
+            return self._parse_array()
+        if char == ord("("):
+            return self._parse_literal_string()
+        if char == ord("/"):
+            return self._parse_name()
+
+        token = self._token()
+        if not token:
+            raise PdfError(f"Unexpected character at {self.position}")
+        if token == b"true":
+            return True
+        if token == b"false":
+            return False
+        if token == b"null":
+            return None
+        try:
+            number = int(token)
+        except ValueError:
+            try:
+                return float(token)
+            except ValueError:
+                return token.decode("latin-1")
+
+        # An indirect reference is written as 'number generation R'
+        saved = self.position
+        self.skip_whitespace()
+        generation = self._token()
+        self.skip_whitespace()
+        if generation.isdigit() and self._token() == b"R":
+            return PdfRef(number, int(generation))
+        self.position = saved
+        return number
+
+    def _parse_dictionary(self):
+        self.position += 2
+        dictionary = {}
+        while True:
+            self.skip_whitespace()
+            if self.data.startswith(b">>", self.position):
+                self.position += 2
+                return dictionary
+            key = self.parse()
+            if not isinstance(key, PdfName):
+                raise PdfError("Dictionary key is not a name")
+            dictionary[str(key)] = self.parse()
+
+    def _parse_array(self):
+        self.position += 1
+        items = []
+        while True:
+            self.skip_whitespace()
+            if self.position >= len(self.data):
+                raise PdfError("Unterminated array")
+            if self.data[self.position] == ord("]"):
+                self.position += 1
+                return items
+            items.append(self.parse())
+
+    def _parse_name(self):
+        self.position += 1
+        token = self._token()
+        return PdfName(
+            re.sub(
+                rb"#([0-9A-Fa-f]{2})", lambda m: bytes([int(m.group(1), 16)]), token
+            ).decode("utf-8", "replace")
+        )
+
+    def _parse_hex_string(self):
+        end = self.data.find(b">", self.position)
+        if end == -1:
+            raise PdfError("Unterminated hex string")
+        digits = re.sub(rb"\s", b"", self.data[self.position + 1 : end])
+        self.position = end + 1
+        if len(digits) % 2:
+            digits += b"0"
+        return bytes.fromhex(digits.decode("ascii"))
+
+    def _parse_literal_string(self):
+        escapes = {
+            ord("n"): b"\n",
+            ord("r"): b"\r",
+            ord("t"): b"\t",
+            ord("b"): b"\b",
+            ord("f"): b"\f",
+        }
+        data = self.data
+        position = self.position + 1
+        depth = 1
+        result = bytearray()
+        while position < len(data):
+            char = data[position]
+            if char == ord("\\"):
+                position += 1
+                if position >= len(data):
+                    break
+                char = data[position]
+                if char in escapes:
+                    result += escapes[char]
+                elif char in b"01234567":
+                    octal = re.match(rb"[0-7]{1,3}", data[position : position + 3])
+                    result.append(int(octal.group(), 8) & 0xFF)
+                    position += len(octal.group()) - 1
+                elif char == ord("\r"):
+                    if data[position + 1 : position + 2] == b"\n":
+                        position += 1
+                elif char != ord("\n"):
+                    result.append(char)
+            elif char == ord("("):
+                depth += 1
+                result.append(char)
+            elif char == ord(")"):
+                depth -= 1
+                if depth == 0:
+                    self.position = position + 1
+                    return bytes(result)
+                result.append(char)
+            else:
+                result.append(char)
+            position += 1
+        raise PdfError("Unterminated string")
+
+    def parse_indirect_object(self, resolve=None):
+        """
+        Parse 'number generation obj value [stream ... endstream] endobj'.
+
+        Parameters:
+        - resolve (callable): Resolves an indirect stream /Length.
+        """
+        number = self.parse()
+        generation = self.parse()
+        if not isinstance(number, int) or not isinstance(generation, int):
+            raise PdfError("Invalid object header")
+        self.expect(b"obj")
+        value = self.parse()
+
+        saved = self.position
+        self.skip_whitespace()
+        if isinstance(value, dict) and self._token() == b"stream":
+            # The stream keyword is followed by CRLF or LF
+            if self.data.startswith(b"\r\n", self.position):
+                self.position += 2
+            elif self.data.startswith(b"\n", self.position):
+                self.position += 1
+            length = value.get("Length")
+            if isinstance(length, PdfRef) and resolve is not None:
+                length = resolve(length)
+            if not isinstance(length, int):
+                raise PdfError("Stream length is not a direct integer")
+            if self.position + length > len(self.data):
+                raise PdfError("Truncated stream")
+            value = PdfStream(
+                value, self.data[self.position : self.position + length]
+            )
+        else:
+            self.position = saved
+        return value
+
+
+def _png_unpredict(data, columns):
+    """
+    Reverse the PNG predictors used in cross-reference streams.
+    """
+    row_size = columns + 1
+    previous = bytearray(columns)
+    output = bytearray()
+    for start in range(0, len(data) - row_size + 1, row_size):
+        filter_type = data[start]
+        row = bytearray(data[start + 1 : start + row_size])
+        for i in range(columns):
+            left = row[i - 1] if i else 0
+            up = previous[i]
+            if filter_type == 1:
+                row[i] = (row[i] + left) & 0xFF
+            elif filter_type == 2:
+                row[i] = (row[i] + up) & 0xFF
+            elif filter_type == 3:
+                row[i] = (row[i] + (left + up) // 2) & 0xFF
+            elif filter_type == 4:
+                upper_left = previous[i - 1] if i else 0
+                estimate = left + up - upper_left
+                distances = (
+                    abs(estimate - left),
+                    abs(estimate - up),
+                    abs(estimate - upper_left),
+                )
+                predictor = (left, up, upper_left)[distances.index(min(distances))]
+                row[i] = (row[i] + predictor) & 0xFF
+        output += row
+        previous = row
+    return bytes(output)
+
+
+def decode_stream(stream):
+    """
+    Decode the data of a FlateDecode (or unfiltered) stream.
+
+    Parameters:
+    - stream (PdfStream): The stream.
+
+    Returns:
+    - bytes: The decoded data.
+    """
+    filters = stream.dictionary.get("Filter")
+    if isinstance(filters, list):
+        filters = filters[0] if len(filters) == 1 else filters
+    if filters is None:
+        return stream.data
+    if filters != "FlateDecode":
+        raise PdfError(f"Unsupported stream filter: {filters}")
+
+    try:
+        data = zlib.decompress(stream.data)
+    except zlib.error as e:
+        raise PdfError(f"Invalid stream data: {e}")
+    parameters = stream.dictionary.get("DecodeParms") or {}
+    if isinstance(parameters, list):
+        parameters = parameters[0] or {}
+    if parameters.get("Predictor", 1) >= 10:
+        data = _png_unpredict(data, parameters.get("Columns", 1))
+    return data
+
+
+def _decode_text(value):
+    if isinstance(value, bytes):
+        if value.startswith(b"\xfe\xff"):
+            return value[2:].decode("utf-16-be", "replace")
+        if value.startswith(b"\xef\xbb\xbf"):
+            return value[3:].decode("utf-8", "replace")
+        return value.decode("latin-1")
+    if value is None:
+        return None
+    return str(value)
+
+
+class PdfReader:
+    """
+    Reads the objects of a PDF document through ranged reads.
+    """
+
+    def __init__(self, ranged_file):
+        """
+        Create a PdfReader instance.
+
+        Parameters:
+        - ranged_file (RangedFile): The document.
+        """
+        self.file = ranged_file
+        self.size = ranged_file.size
+        self._xref_sections = None
+        self._object_streams = {}
+
+    def read_at(self, offset, length):
+        self.file.seek(offset)
+        return self.file.read(length)
+
+    def find_startxref(self):
+        """
+        Locate the last cross-reference section from the end of the file.
+
+        Returns:
+        - int: The offset of the cross-reference section.
+        """
+        for tail_size in TAIL_SIZES:
+            start = max(self.size - tail_size, 0)
+            tail = self.read_at(start, self.size - start)
+            match = re.match(
+                rb"startxref\s+(\d+)", tail[tail.rfind(b"startxref") :]
+            )
+            if match:
+                return int(match.group(1))
+        raise PdfError("startxref not found")
+
+    def read_xref_section(self, offset):
+        """
+        Read the cross-reference section at an offset.
+
+        Classic tables are not read in full: only their subsection headers are
+        kept, and entries are fetched individually when looked up.
+
+        Returns:
+        - tuple: (trailer dict, lookup) where lookup is a list of subsections
+          (first object, count, entries offset) for tables, or a dict mapping
+          object numbers to entries for cross-reference streams.
+        """
+        if self.read_at(offset, 4) == b"xref":
+            subsections = []
+            position = offset + 4
+            while True:
+                match = re.match(
+                    rb"\s*(\d+)\s+(\d+)[ \t]*\r?\n?", self.read_at(position, 64)
+                )
+                if not match:
+                    break
+                first, count = int(match.group(1)), int(match.group(2))
+                entries_offset = position + match.end()
+                subsections.append((first, count, entries_offset))
+                position = entries_offset + count * 20
+            parser = _Parser(self.read_at(position, OBJECT_READ_SIZES[0]))
+            parser.expect(b"trailer")
+            return parser.parse(), subsections
+
+        stream = self.read_object_at(offset)
+        if (
+            not isinstance(stream, PdfStream)
+            or stream.dictionary.get("Type") != "XRef"
+        ):
+            raise PdfError("Invalid cross-reference section")
+        return stream.dictionary, self._parse_xref_stream(stream)
+
+    def _parse_xref_stream(self, stream):
+        widths = stream.dictionary["W"]
+        index = stream.dictionary.get("Index") or [0, stream.dictionary["Size"]]
+        data = decode_stream(stream)
+        if len(data) < sum(widths) * sum(index[1::2]):
+            raise PdfError("Truncated cross-reference stream")
+        entries = {}
+        position = 0
+        for first, count in zip(index[::2], index[1::2]):
+            for number in range(first, first + count):
+                fields = []
+                for width in widths:
+                    fields.append(
+                        int.from_bytes(data[position : position + width], "big")
+                    )
+                    position += width
+                # A zero-width type field defaults to type 1
+                entry_type = fields[0] if widths[0] else 1
+                entries[number] = (entry_type, fields[1], fields[2])
+        return entries
+
+    def xref_sections(self):
+        """
+        Read the chain of cross-reference sections, newest first.
+        """
+        if self._xref_sections is None:
+            self._xref_sections = []
+            offset = self.find_startxref()
+            seen = set()
+            while offset is not None and offset not in seen:
+                if len(self._xref_sections) >= MAX_XREF_SECTIONS:
+                    break
+                seen.add(offset)
+                trailer, lookup = self.read_xref_section(offset)
+                self._xref_sections.append((trailer, lookup))
+                offset = trailer.get("Prev")
+        return self._xref_sections
+
+    def trailer(self):
+        """
+        Merge the trailer dictionaries, newer entries taking precedence.
+        """
+        merged = {}
+        for trailer, _ in reversed(self.xref_sections()):
+            merged.update(trailer)
+        return merged
+
+    def _lookup(self, number):
+        for _, lookup in self.xref_sections():
+            if isinstance(lookup, dict):
+                if number in lookup:
+                    return lookup[number]
+                continue
+            for first, count, entries_offset in lookup:
+                if first <= number < first + count:
+                    entry = self.read_at(entries_offset + (number - first) * 20, 20)
+                    match = re.match(rb"(\d{10}) (\d{5}) ([nf])", entry)
+                    if not match:
+                        raise PdfError(f"Invalid xref entry for object {number}")
+                    if match.group(3) == b"f":
+                        return (0, 0, 0)
+                    return (1, int(match.group(1)), int(match.group(2)))
+        return None
+
+    def read_object_at(self, offset):
+        for read_size in OBJECT_READ_SIZES:
+            data = self.read_at(offset, read_size)
+            try:
+                return _Parser(data).parse_indirect_object(self.resolve)
+            except PdfError:
+                if len(data) < read_size:
+                    raise
+        raise PdfError(f"Object at offset {offset} is too large")
+
+    def _read_compressed_object(self, stream_number, index):
+        stream = self._object_streams.get(stream_number)
+        if stream is None:
+            stream = self.resolve(PdfRef(stream_number, 0))
+            if not isinstance(stream, PdfStream):
+                raise PdfError("Invalid object stream")
+            stream = (stream.dictionary, decode_stream(stream))
+            self._object_streams[stream_number] = stream
+        dictionary, data = stream
+        parser = _Parser(data[: dictionary["First"]])
+        offsets = [parser.parse() for _ in range(2 * dictionary["N"])]
+        return _Parser(data, dictionary["First"] + offsets[2 * index + 1]).parse()
+
+    def resolve(self, value):
+        """
+        Resolve an indirect reference to the object it points to.
+
+        Parameters:
+        - value: A PdfRef or a direct object.
+
+        Returns:
+        - The referenced object (direct objects are returned unchanged).
+        """
+        if not isinstance(value, PdfRef):
+            return value
+        entry = self._lookup(value.number)
+        if entry is None or entry[0] == 0:
+            return None
+        if entry[0] == 2:
+            return self._read_compressed_object(entry[1], entry[2])
+        return self.read_object_at(entry[1])
+
+
+def parse_linearization(head):
+    """
+    Read the linearization dictionary from the head of a PDF.
+
+    Parameters:
+    - head (bytes): The leading bytes of the document.
+
+    Returns:
+    - dict or None: The dictionary, or None for non-linearized documents.
+    """
+    match = re.search(rb"\d+\s+\d+\s+obj\s*<<", head[:2048])
+    if not match or b"/Linearized" not in head[match.start() : match.end() + 1024]:
+        return None
+    try:
+        value = _Parser(head, match.start()).parse_indirect_object()
+    except PdfError:
+        return None
+    return value if isinstance(value, dict) and "Linearized" in value else None
+
+
+def _full_parse(ranged_file):
+    """
+    Parse the whole document with pypdf.
+    """
+    from pypdf import PdfReader as FullPdfReader
+
+    ranged_file.seek(0)
+    document = ranged_file.read()
+    with BufferReader(document) as document_file:
+        reader = FullPdfReader(document_file)
+        info = reader.metadata or {}
+        metadata = {
+            "page_count": len(reader.pages),
+            "encrypted": reader.is_encrypted,
+        }
+        for key, field in INFO_FIELDS.items():
+            value = info.get(f"/{key}")
+            metadata[field] = str(value) if value is not None else None
+    return metadata
+
+
+def _parse_structure(ranged_file, head, metadata):
+    """
+    Fill in the metadata from the linearization dictionary, the trailer, the
+    catalog and the document information, using ranged reads.
+    """
+    linearization = parse_linearization(head)
+    if linearization is not None:
+        metadata["linearized"] = True
+        metadata["page_count"] = linearization.get("N")
+
+    reader = PdfReader(ranged_file)
+    trailer = reader.trailer()
+    metadata["encrypted"] = "Encrypt" in trailer
+
+    if metadata["page_count"] is None:
+        try:
+            catalog = reader.resolve(trailer.get("Root"))
+            if isinstance(catalog, dict):
+                pages = reader.resolve(catalog.get("Pages"))
+                if isinstance(pages, dict):
+                    metadata["page_count"] = reader.resolve(pages.get("Count"))
+                # The catalog can override the header version
+                if isinstance(catalog.get("Version"), PdfName):
+                    metadata["pdf_version"] = str(catalog["Version"])
+        except PdfError:
+            # Object streams of encrypted documents cannot be decoded
+            if not metadata["encrypted"]:
+                raise
+
+    # Strings of encrypted documents cannot be read without decrypting them
+    if not metadata["encrypted"]:
+        info = reader.resolve(trailer.get("Info"))
+        if isinstance(info, dict):
+            for key_name, field in INFO_FIELDS.items():
+                metadata[field] = _decode_text(reader.resolve(info.get(key_name)))
+
+
+def extract_pdf_metadata(backend, key, head, size=None, full=DOCUMENT_FULL_PARSE):
+    """
+    Extract metadata from a PDF document.
+
+    Parameters:
+    - backend (StorageBackend): The backend holding the document.
+    - key (str): The object key.
+    - head (bytes): The leading bytes of the document.
+    - size (int): The object size, fetched from the backend when omitted.
+    - full (bool): Parse the whole document with pypdf instead (ranged reads
+      are used when pypdf is not installed).
+
+    Returns:
+    - dict: The document metadata; when the inspection budget runs out, the
+      fields read until then.
+    """
+    ranged_file = RangedFile(
+        backend, key, size, block_size=DOCUMENT_RANGE_BLOCK_SIZE, head=head
+    )
+    version = re.search(rb"%PDF-(\d+\.\d+)", head[:1024])
+    metadata = {
+        "file_type": "document",
+        "document_format": "pdf",
+        "size": ranged_file.size,
+        "pdf_version": version.group(1).decode() if version else None,
+        "linearized": False,
+        "page_count": None,
+        "encrypted": False,
+    }
+    for field in INFO_FIELDS.values():
+        metadata[field] = None
+
+    try:
+        if full:
+            try:
+                metadata.update(_full_parse(ranged_file))
+                metadata["bytes_read"] = ranged_file.bytes_read
+                return metadata
+            except ImportError:
+                logger.error(
+                    "pypdf is not installed, parsing the document with ranged "
+                    "reads instead."
+                )
+        _parse_structure(ranged_file, head, metadata)
+    except BudgetExceeded:
+        # The inspection is marked partial; keep what was read until then
+        pass
+
+    metadata["bytes_read"] = ranged_file.bytes_read
+    return metadata
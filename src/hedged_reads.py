@@ -0,0 +1,434 @@
+# src/hedged_reads.py
+"""
+Hedged Reads Module
+
+Reads objects from every node of the MinIO cluster instead of a single
+endpoint. Requests go to a healthy node (the better of two random picks,
+scored by recent latency and errors); when it has not answered within a
+percentile-based delay, a duplicate request is sent to the next best node.
+Whichever node answers first wins and the other request is cancelled by
+closing its connection, so one slow disk or paused node does not show up as
+tail latency of the inspections. Requests still waiting for a thread are
+cancelled once the read is decided, and those already sent to a stalled node
+are bounded by a timeout.
+"""
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import certifi
+import urllib3
+from loguru import logger
+from minio import Minio
+from minio.error import InvalidResponseError, S3Error, ServerError
+
+from config_utils import get_env_variable
+from latency_stats import MINIO_LATENCY, LatencyTracker, percentile
+from storage import PRESIGNED_URL_EXPIRY_SECONDS, MinioBackend, ObjectStat
+
+# Comma-separated 'host:port' of the MinIO nodes (defaults to MINIO_ENDPOINT)
+MINIO_ENDPOINTS = get_env_variable("MINIO_ENDPOINTS", "")
+# Region of the cluster; setting it avoids a bucket location lookup per node
+MINIO_REGION = get_env_variable("MINIO_REGION", None)
+# Delay before hedging: this percentile of the recent latencies of all nodes,
+# clamped to the bounds below
+HEDGE_PERCENTILE = get_env_variable("HEDGE_PERCENTILE", 95.0, float)
+HEDGE_MIN_DELAY_MS = get_env_variable("HEDGE_MIN_DELAY_MS", 5.0, float)
+HEDGE_MAX_DELAY_MS = get_env_variable("HEDGE_MAX_DELAY_MS", 1000.0, float)
+# Delay used until HEDGE_MIN_SAMPLES latencies have been recorded
+HEDGE_DEFAULT_DELAY_MS = get_env_variable("HEDGE_DEFAULT_DELAY_MS", 50.0, float)
+HEDGE_MIN_SAMPLES = get_env_variable("HEDGE_MIN_SAMPLES", 20, int)
+# Duplicate requests sent per read when the first node is slow
+HEDGE_MAX_HEDGES = get_env_variable("HEDGE_MAX_HEDGES", 1, int)
+# Hedged requests allowed as a share of all requests, so that hedging does
+# not add load to an already overloaded cluster
+HEDGE_MAX_RATIO = get_env_variable("HEDGE_MAX_RATIO", 0.1, float)
+# Connect and read timeout of the requests sent to a node, so that requests
+# stuck on a stalled node release their thread
+HEDGE_REQUEST_TIMEOUT_SECONDS = get_env_variable(
+    "HEDGE_REQUEST_TIMEOUT_SECONDS", 30.0, float
+)
+# Latency added to the score of a node per unit of error rate
+HEDGE_ERROR_PENALTY_MS = get_env_variable("HEDGE_ERROR_PENALTY_MS", 1000.0, float)
+
+# Errors meaning that a node could not answer; other nodes are tried. An
+# S3Error is an answer (e.g. NoSuchKey) and is returned as is.
+ENDPOINT_ERRORS = (
+    ServerError,
+    InvalidResponseError,
+    urllib3.exceptions.HTTPError,
+    OSError,
+)
+
+
+class Endpoint:
+    """
+    A MinIO node with the statistics used to score its health.
+    """
+
+    def __init__(self, name, client, latency=None):
+        """
+        Create an Endpoint instance.
+
+        Parameters:
+        - name (str): Name of the node, e.g. 'minio1:9000'.
+        - client (Minio): Client connected to the node only.
+        - latency (LatencyTracker): Latencies and errors of the node.
+        """
+        self.name = name
+        self.client = client
+        self.latency = latency or LatencyTracker()
+
+    def score(self):
+        """
+        Get the health score of the node; lower is better.
+
+        Nodes without recent requests score 0, so that they are tried again.
+
+        Returns:
+        - float: The median latency plus a penalty for errors, in ms.
+        """
+        median = percentile(self.latency.samples(), 50) or 0.0
+        return median + self.latency.error_rate() * HEDGE_ERROR_PENALTY_MS
+
+    def __repr__(self):
+        return f"Endpoint({self.name!r})"
+
+
+class _Race:
+    """
+    Outcome of the requests sent for one read.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.winner = None
+        self.answer_error = None
+        self.failures = []
+
+    def claim(self, endpoint, response):
+        with self.condition:
+            if self.winner is not None or self.answer_error is not None:
+                return False
+            self.winner = (endpoint, response)
+            self.condition.notify_all()
+            return True
+
+    def answer(self, error):
+        with self.condition:
+            if self.winner is None and self.answer_error is None:
+                self.answer_error = error
+            self.condition.notify_all()
+
+    def fail(self, error):
+        with self.condition:
+            self.failures.append(error)
+            self.condition.notify_all()
+
+    def decided(self):
+        return self.winner is not None or self.answer_error is not None
+
+
+class HedgedReader:
+    """
+    Sends requests to the MinIO nodes, hedging slow ones.
+    """
+
+    def __init__(
+        self,
+        endpoints,
+        delay_percentile=HEDGE_PERCENTILE,
+        min_delay_ms=HEDGE_MIN_DELAY_MS,
+        max_delay_ms=HEDGE_MAX_DELAY_MS,
+        default_delay_ms=HEDGE_DEFAULT_DELAY_MS,
+        max_hedges=HEDGE_MAX_HEDGES,
+        max_ratio=HEDGE_MAX_RATIO,
+    ):
+        """
+        Create a HedgedReader instance.
+
+        Parameters:
+        - endpoints (list): The Endpoint of each node.
+        - delay_percentile (float): Percentile of the latencies used as hedge
+          delay.
+        - min_delay_ms (float): Lower bound of the hedge delay.
+        - max_delay_ms (float): Upper bound of the hedge delay.
+        - default_delay_ms (float): Delay used before enough samples exist.
+        - max_hedges (int): Duplicate requests per read.
+        - max_ratio (float): Hedged requests allowed per request.
+        """
+        if not endpoints:
+            raise ValueError("At least one MinIO endpoint is required")
+        self.endpoints = list(endpoints)
+        self.delay_percentile = delay_percentile
+        self.min_delay_ms = min_delay_ms
+        self.max_delay_ms = max_delay_ms
+        self.default_delay_ms = default_delay_ms
+        self.max_hedges = max_hedges
+        self.max_ratio = max_ratio
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._hedge_tokens = 1.0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=32 * len(self.endpoints), thread_name_prefix="hedged-read"
+        )
+
+    def hedge_delay(self):
+        """
+        Get the time to wait for an answer before hedging.
+
+        Returns:
+        - float: The delay in seconds.
+        """
+        latencies = [
+            latency
+            for endpoint in self.endpoints
+            for latency in endpoint.latency.samples()
+        ]
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            delay_ms = self.default_delay_ms
+        else:
+            delay_ms = percentile(latencies, self.delay_percentile)
+        return min(max(delay_ms, self.min_delay_ms), self.max_delay_ms) / 1000
+
+    def ranked_endpoints(self):
+        """
+        Order the nodes for a request.
+
+        The first node is the better of two random picks, which spreads the
+        load over the healthy nodes; the others follow by score.
+
+        Returns:
+        - list: The endpoints.
+        """
+        scores = {endpoint: endpoint.score() for endpoint in self.endpoints}
+        if len(self.endpoints) > 1:
+            first = min(random.sample(self.endpoints, 2), key=scores.get)
+        else:
+            first = self.endpoints[0]
+        others = sorted(
+            (endpoint for endpoint in self.endpoints if endpoint is not first),
+            key=scores.get,
+        )
+        return [first] + others
+
+    def _take_hedge_token(self):
+        with self._lock:
+            if self._hedge_tokens < 1:
+                return False
+            self._hedge_tokens -= 1
+            self.hedges += 1
+            return True
+
+    def _attempt(self, endpoint, race, open_response, discard):
+        start_time = time.perf_counter()
+        try:
+            response = open_response(endpoint.client)
+        except S3Error as e:
+            endpoint.latency.record((time.perf_counter() - start_time) * 1000)
+            race.answer(e)
+            return
+        except ENDPOINT_ERRORS as e:
+            endpoint.latency.record_error()
+            logger.bind(endpoint=endpoint.name).warning(f"MinIO request failed: {e}")
+            race.fail(e)
+            return
+        except Exception as e:
+            # Invalid requests fail the same way on every node
+            race.answer(e)
+            return
+        # The loser also records its latency, which keeps slow nodes scored
+        endpoint.latency.record((time.perf_counter() - start_time) * 1000)
+        if not race.claim(endpoint, response) and discard is not None:
+            discard(response)
+
+    def request(self, open_response, consume=None, discard=None):
+        """
+        Send a request, hedging it if the first node is slow to answer.
+
+        Parameters:
+        - open_response (callable): Called with a Minio client, sends the
+          request and returns once the node has answered (e.g. get_object,
+          which returns after the response headers).
+        - consume (callable): Called with the winning response, e.g. to read
+          the body. Defaults to returning the response.
+        - discard (callable): Called with the response of a losing request
+          to cancel it.
+
+        Returns:
+        - The result of consume.
+        """
+        with self._lock:
+            self.requests += 1
+            self._hedge_tokens = min(self._hedge_tokens + self.max_ratio, 10.0)
+
+        ranked = self.ranked_endpoints()
+        race = _Race()
+        launched = [ranked.pop(0)]
+        futures = [
+            self._executor.submit(
+                self._attempt, launched[0], race, open_response, discard
+            )
+        ]
+        delay = self.hedge_delay()
+        hedges = 0
+
+        with race.condition:
+            while not race.decided():
+                all_failed = len(race.failures) == len(launched)
+                if all_failed and not ranked:
+                    raise race.failures[-1]
+                if not all_failed:
+                    can_hedge = ranked and hedges < self.max_hedges
+                    race.condition.wait(timeout=delay if can_hedge else None)
+                    if race.decided() or len(race.failures) == len(launched):
+                        continue
+                    if not (can_hedge and self._take_hedge_token()):
+                        continue
+                    hedges += 1
+                # Hedge a slow node, or fail over from a failed one
+                endpoint = ranked.pop(0)
+                launched.append(endpoint)
+                futures.append(
+                    self._executor.submit(
+                        self._attempt, endpoint, race, open_response, discard
+                    )
+                )
+
+        # Requests that have not started yet are not sent at all
+        for future in futures:
+            future.cancel()
+        if race.answer_error is not None:
+            raise race.answer_error
+        endpoint, response = race.winner
+        if endpoint is not launched[0]:
+            with self._lock:
+                self.hedge_wins += 1
+        return consume(response) if consume else response
+
+
+def _close_response(response):
+    response.close()
+    response.release_conn()
+
+
+def _read_response(response):
+    try:
+        return response.read()
+    finally:
+        _close_response(response)
+
+
+class HedgedMinioBackend(MinioBackend):
+    """
+    MinIO storage backend sending hedged requests to all nodes of a cluster.
+    """
+
+    def __init__(self, reader, latency=MINIO_LATENCY):
+        """
+        Create a HedgedMinioBackend instance.
+
+        Parameters:
+        - reader (HedgedReader): Sends the requests to the nodes.
+        - latency (LatencyTracker): Records the latency seen by the caller.
+        """
+        super().__init__(reader.endpoints[0].client, latency)
+        self.reader = reader
+
+    def stat(self, key):
+        bucket_name, object_name = self.split_key(key)
+        with self.latency.measure():
+            stat = self.reader.request(
+                lambda client: client.stat_object(bucket_name, object_name)
+            )
+        return ObjectStat(stat.size, stat.etag, stat.last_modified)
+
+    def _get(self, key, consume, **kwargs):
+        bucket_name, object_name = self.split_key(key)
+        # Like MinioBackend, only the time to the response headers is measured;
+        # the body is read afterwards
+        with self.latency.measure():
+            response = self.reader.request(
+                lambda client: client.get_object(bucket_name, object_name, **kwargs),
+                discard=_close_response,
+            )
+        return consume(response) if consume else response
+
+    def read(self, key):
+        return self._get(key, _read_response)
+
+    def read_range(self, key, offset, length):
+        return self._get(key, _read_response, offset=offset, length=length)
+
+    def open_stream(self, key):
+        return self._get(key, None)
+
+    def url(self, key):
+        # Point external readers at the healthiest node
+        client = self.reader.ranked_endpoints()[0].client
+        return client.presigned_get_object(
+            *self.split_key(key),
+            expires=timedelta(seconds=PRESIGNED_URL_EXPIRY_SECONDS),
+        )
+
+
+def create_endpoints(
+    endpoints,
+    access_key,
+    secret_key,
+    secure=False,
+    region=None,
+    timeout=HEDGE_REQUEST_TIMEOUT_SECONDS,
+):
+    """
+    Create a client for each node of the cluster.
+
+    Parameters:
+    - endpoints (list): 'host:port' of each node.
+    - access_key (str): The access key.
+    - secret_key (str): The secret key.
+    - secure (bool): Whether to use HTTPS.
+    - region (str): Region of the cluster.
+    - timeout (float): Connect and read timeout of the requests in seconds.
+
+    Returns:
+    - list: The Endpoint of each node.
+    """
+    return [
+        Endpoint(
+            endpoint,
+            Minio(
+                endpoint,
+                access_key=access_key,
+                secret_key=secret_key,
+                secure=secure,
+                region=region,
+                http_client=urllib3.PoolManager(
+                    timeout=urllib3.Timeout(connect=timeout, read=timeout),
+                    maxsize=10,
+                    cert_reqs="CERT_REQUIRED",
+                    ca_certs=os.environ.get("SSL_CERT_FILE") or certifi.where(),
+                    # Failed requests are retried on the other nodes instead
+                    retries=False,
+                ),
+            ),
+        )
+        for endpoint in endpoints
+    ]
+
+
+def configured_endpoints():
+    """
+    Get the MinIO nodes listed in MINIO_ENDPOINTS.
+
+    Returns:
+    - list: 'host:port' of each node.
+    """
+    return [
+        endpoint.strip() for endpoint in MINIO_ENDPOINTS.split(",") if endpoint.strip()
+    ]
@@ -0,0 +1,190 @@
+# src/hedged_reads_benchmark.py
+"""
+Hedged Reads Benchmark
+
+Runs HedgedMinioBackend against stand-in S3 nodes served from this process, so
+the effect of hedging can be reproduced without a MinIO cluster:
+
+- slow node: two of four nodes pause now and then (e.g. for garbage collection),
+  and the p50/p99 latency of ranged reads is compared with and without hedging.
+- unreachable node: the first node refuses connections, and reads have to fail
+  over to the other node.
+
+Usage: python hedged_reads_benchmark.py [--requests N] [--slow-ms MS]
+[--slow-probability P]
+
+Exits with status 1 when hedging does not lower the p99 latency or a read does
+not fail over.
+"""
+
+import argparse
+import random
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from hedged_reads import HedgedMinioBackend, HedgedReader, create_endpoints
+from latency_stats import percentile
+
+# Content of the stand-in object
+OBJECT_DATA = bytes(range(256)) * 4096
+OBJECT_KEY = "bucket/object"
+READ_SIZE = 8192
+
+
+def _handler(delay):
+    class StandInHandler(BaseHTTPRequestHandler):
+        # Minimal S3 GET/HEAD of a single object, with ranged reads
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_headers(self, status, length, headers=()):
+            self.send_response(status)
+            self.send_header("ETag", '"stand-in"')
+            self.send_header("Last-Modified", "Mon, 01 Jan 2024 00:00:00 GMT")
+            self.send_header("Content-Length", str(length))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+
+        def do_HEAD(self):
+            time.sleep(delay())
+            self._send_headers(200, len(OBJECT_DATA))
+
+        def do_GET(self):
+            time.sleep(delay())
+            byte_range = self.headers.get("Range")
+            if byte_range:
+                start, end = byte_range.split("=", 1)[1].split("-")
+                body = OBJECT_DATA[int(start) : int(end) + 1]
+                self._send_headers(
+                    206,
+                    len(body),
+                    [("Content-Range", f"bytes {start}-{end}/{len(OBJECT_DATA)}")],
+                )
+            else:
+                body = OBJECT_DATA
+                self._send_headers(200, len(body))
+            self.wfile.write(body)
+
+    return StandInHandler
+
+
+class _StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # The losing request of a race is closed by the client
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def serve_stand_in(delay):
+    """
+    Serve a stand-in S3 node on a free local port.
+
+    Parameters:
+    - delay (callable): Returns the seconds to wait before each response.
+
+    Returns:
+    - str: 'host:port' of the node.
+    """
+    server = _StandInServer(("127.0.0.1", 0), _handler(delay))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"127.0.0.1:{server.server_address[1]}"
+
+
+def unreachable_endpoint():
+    """
+    Get a local 'host:port' that refuses connections.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return f"127.0.0.1:{sock.getsockname()[1]}"
+
+
+def create_backend(endpoints, **kwargs):
+    reader = HedgedReader(
+        create_endpoints(endpoints, "access", "secret", region="us-east-1"), **kwargs
+    )
+    return reader, HedgedMinioBackend(reader)
+
+
+def measure(backend, requests):
+    """
+    Time random ranged reads of the stand-in object.
+
+    Returns:
+    - tuple: p50, p99 and maximum latency in milliseconds.
+    """
+    latencies = []
+    for _ in range(requests):
+        offset = random.randrange(0, len(OBJECT_DATA) - READ_SIZE)
+        start = time.perf_counter()
+        data = backend.read_range(OBJECT_KEY, offset, READ_SIZE)
+        latencies.append((time.perf_counter() - start) * 1000)
+        if data != OBJECT_DATA[offset : offset + READ_SIZE]:
+            raise AssertionError(f"Wrong content read at offset {offset}")
+    return percentile(latencies, 50), percentile(latencies, 99), max(latencies)
+
+
+def slow_node_scenario(requests, slow_seconds, slow_probability):
+    def fast():
+        return 0.002
+
+    def pausing():
+        return slow_seconds if random.random() < slow_probability else 0.002
+
+    endpoints = [serve_stand_in(delay) for delay in (fast, fast, pausing, pausing)]
+    _, unhedged = create_backend(endpoints, max_hedges=0)
+    reader, hedged = create_backend(endpoints)
+
+    unhedged_latency = measure(unhedged, requests)
+    hedged_latency = measure(hedged, requests)
+    print("slow node: unhedged p50/p99/max %.1f/%.1f/%.1f ms" % unhedged_latency)
+    print(
+        "slow node: hedged p50/p99/max %.1f/%.1f/%.1f ms, %d requests, %d hedges, "
+        "%d won by the hedge"
+        % (*hedged_latency, reader.requests, reader.hedges, reader.hedge_wins)
+    )
+    return hedged_latency[1] < unhedged_latency[1]
+
+
+def unreachable_node_scenario(reads=20):
+    endpoint = serve_stand_in(lambda: 0.002)
+    _, backend = create_backend([unreachable_endpoint(), endpoint])
+
+    latencies = []
+    for _ in range(reads):
+        start = time.perf_counter()
+        try:
+            data = backend.read(OBJECT_KEY)
+        except Exception as e:
+            print(f"unreachable node: read failed: {e}")
+            return False
+        latencies.append((time.perf_counter() - start) * 1000)
+        if data != OBJECT_DATA:
+            raise AssertionError("Wrong content read")
+    print("unreachable node: %d full reads, slowest %.1f ms" % (reads, max(latencies)))
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--slow-ms", type=float, default=400.0)
+    parser.add_argument("--slow-probability", type=float, default=0.04)
+    args = parser.parse_args()
+
+    ok = slow_node_scenario(args.requests, args.slow_ms / 1000, args.slow_probability)
+    ok = unreachable_node_scenario() and ok
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,408 @@
+# src/http_service.py
+"""
+HTTP Inspection Service
+
+Long-lived HTTP front end for InspectObject, so on-demand inspections do not
+pay for process start-up:
+
+    GET  /inspect/{bucket}/{key}   inspect one object (JSON)
+    GET  /similar/{bucket}/{key}   near duplicates of an indexed image
+    POST /inspect:batch            inspect several objects, results are
+                                   streamed as NDJSON as they complete
+    GET  /healthz                  liveness check
+
+The inspection endpoints take a depth query parameter ('sniff', 'standard'
+or 'deep') and a budget applied to each object (e.g. budget=2s,16MB).
+
+Connections are kept alive (HTTP/1.1). Concurrent requests for the same
+bucket, key, ETag and options share a single in-flight inspection.
+"""
+import json
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from loguru import logger
+from minio.error import S3Error
+from opentelemetry import trace
+
+from config_utils import get_env_variable, parse_bool
+from inspection_budget import InspectionBudget, parse_depth
+from inspector import CustomJSONEncoder, InspectObject
+from minio_client import get_minio_backend, get_minio_client
+from opentelemetry_config import configure_opentelemetry
+from perceptual_hash import PERCEPTUAL_HASH_MAX_DISTANCE, get_near_duplicate_index
+from profiling import profile_inspection
+from result_writer import get_result_writer
+from tracing import extract_context, mark_failed
+
+HTTP_HOST = get_env_variable("HTTP_HOST", "0.0.0.0")
+HTTP_PORT = get_env_variable("HTTP_PORT", 8080, int)
+HTTP_BATCH_CONCURRENCY = get_env_variable("HTTP_BATCH_CONCURRENCY", 8, int)
+HTTP_BATCH_MAX_OBJECTS = get_env_variable("HTTP_BATCH_MAX_OBJECTS", 1000, int)
+HTTP_MAX_BODY_BYTES = get_env_variable("HTTP_MAX_BODY_BYTES", 1024 * 1024, int)
+# Default for the include_content query parameter
+HTTP_INCLUDE_CONTENT = get_env_variable("HTTP_INCLUDE_CONTENT", "false", parse_bool)
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time; concurrent callers with the same
+    key wait for and share the result of the call in flight.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function):
+        """
+        Call function, or wait for the in-flight call with the same key.
+
+        Parameters:
+        - key: Identifies equivalent calls.
+        - function (callable): Computes the result.
+
+        Returns:
+        - tuple: The result and whether it was shared with another caller.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            future.set_result(function())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return future.result(), False
+
+
+class InspectionService:
+    """
+    Inspects MinIO objects on behalf of the HTTP handlers.
+    """
+
+    def __init__(self, minio_client, backend, concurrency=HTTP_BATCH_CONCURRENCY):
+        """
+        Create an InspectionService instance.
+
+        Parameters:
+        - minio_client (Minio): The shared Minio client.
+        - backend (StorageBackend): The backend objects are read from.
+        - concurrency (int): Number of objects of a batch inspected at once.
+        """
+        self.minio_client = minio_client
+        self.backend = backend
+        self.single_flight = SingleFlight()
+        self.executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="inspect"
+        )
+
+    def inspect(
+        self,
+        object_path,
+        include_content=False,
+        parent_context=None,
+        depth=None,
+        budget=None,
+    ):
+        """
+        Inspect one object.
+
+        Parameters:
+        - object_path (str): 'bucket_name/object_name'.
+        - include_content (bool): Whether to include the base64 content.
+        - parent_context (Context): Trace context of the caller.
+        - depth (str): The inspection depth (INSPECT_DEPTH by default).
+        - budget (str): Time and bytes the inspection may spend, e.g.
+          '2s,16MB' (the INSPECT_BUDGET_* defaults when not given).
+
+        Returns:
+        - tuple: (HTTP status, response document).
+        """
+        if "/" not in object_path.strip("/"):
+            return 400, {"object": object_path, "error": "Expected bucket/key"}
+
+        try:
+            stat = self.backend.stat(object_path)
+        except S3Error as e:
+            status = 404 if e.code in ("NoSuchKey", "NoSuchBucket") else 502
+            return status, {"object": object_path, "error": e.code}
+
+        flight_key = (object_path, stat.etag, include_content, depth, budget)
+        metadata, shared = self.single_flight.do(
+            flight_key,
+            lambda: self._inspect(
+                object_path, stat, include_content, parent_context, depth, budget
+            ),
+        )
+        if metadata is None:
+            return 422, {"object": object_path, "error": "Inspection failed"}
+        return 200, {
+            "object": object_path,
+            "etag": stat.etag,
+            "shared": shared,
+            "metadata": metadata,
+        }
+
+    def _inspect(
+        self, object_path, stat, include_content, parent_context, depth, budget
+    ):
+        with trace.get_tracer(__name__).start_as_current_span(
+            "http_inspect",
+            context=parent_context,
+            kind=trace.SpanKind.SERVER,
+            attributes={"inspector.object_key": object_path},
+        ), profile_inspection(object_path):
+            start_time = time.perf_counter()
+            with InspectObject(
+                self.minio_client,
+                object_path,
+                backend=self.backend,
+                include_content=include_content,
+                depth=depth,
+                budget=InspectionBudget.parse(budget),
+            ) as inspect_object:
+                metadata = inspect_object.generate_metadata()
+            duration_ms = (time.perf_counter() - start_time) * 1000
+
+            if metadata is None:
+                mark_failed("Inspection failed")
+                return None
+
+            result_writer = get_result_writer(self.minio_client)
+            if result_writer is not None:
+                result_writer.submit(object_path, stat.etag, metadata, duration_ms)
+            return metadata
+
+    def inspect_batch(
+        self,
+        object_paths,
+        include_content=False,
+        parent_context=None,
+        depth=None,
+        budget=None,
+    ):
+        """
+        Inspect several objects concurrently, each with its own budget.
+
+        Yields:
+        - tuple: (HTTP status, response document) in completion order.
+        """
+        futures = [
+            self.executor.submit(
+                self.inspect_safely,
+                object_path,
+                include_content,
+                parent_context,
+                depth,
+                budget,
+            )
+            for object_path in object_paths
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+    def inspect_safely(
+        self,
+        object_path,
+        include_content=False,
+        parent_context=None,
+        depth=None,
+        budget=None,
+    ):
+        """
+        Inspect one object, turning unexpected errors into a 500 response.
+
+        Returns:
+        - tuple: (HTTP status, response document).
+        """
+        try:
+            return self.inspect(
+                object_path, include_content, parent_context, depth, budget
+            )
+        except Exception as e:
+            logger.bind(object_key=object_path).error(f"Inspection error: {e}")
+            return 500, {"object": object_path, "error": str(e)}
+
+
+class InspectionRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP/1.1 handler for the inspection endpoints.
+    """
+
+    protocol_version = "HTTP/1.1"
+    service = None
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def _send_json(self, status, document):
+        body = CustomJSONEncoder().encode(document).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _trace_context(self):
+        return extract_context(
+            {name.lower(): value for name, value in self.headers.items()}
+        )
+
+    def _include_content(self, query):
+        values = parse_qs(query).get("include_content")
+        return parse_bool(values[0]) if values else HTTP_INCLUDE_CONTENT
+
+    def _inspection_options(self, query):
+        # Validated here so that bad values get a 400 response; the budget
+        # itself is created when each inspection starts
+        params = parse_qs(query)
+        depth = params["depth"][0] if "depth" in params else None
+        budget = params["budget"][0] if "budget" in params else None
+        parse_depth(depth)
+        InspectionBudget.parse(budget)
+        return depth, budget
+
+    def _send_similar(self, object_path, query):
+        index = get_near_duplicate_index()
+        if index is None:
+            self._send_json(404, {"error": "Near-duplicate index not configured"})
+            return
+        values = parse_qs(query).get("max_distance")
+        try:
+            max_distance = int(values[0]) if values else PERCEPTUAL_HASH_MAX_DISTANCE
+        except ValueError:
+            self._send_json(400, {"error": "Invalid max_distance"})
+            return
+        if index.get(object_path) is None:
+            self._send_json(404, {"object": object_path, "error": "Not indexed"})
+            return
+        matches = index.similar_to(object_path, max_distance)
+        self._send_json(
+            200,
+            {
+                "object": object_path,
+                "near_duplicates": [
+                    {"key": key, "distance": distance} for key, distance in matches
+                ],
+            },
+        )
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/healthz":
+            self._send_json(200, {"status": "ok"})
+            return
+        if url.path.startswith("/similar/"):
+            self._send_similar(unquote(url.path[len("/similar/") :]), url.query)
+            return
+        if not url.path.startswith("/inspect/"):
+            self._send_json(404, {"error": "Not found"})
+            return
+
+        object_path = unquote(url.path[len("/inspect/") :])
+        try:
+            depth, budget = self._inspection_options(url.query)
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        status, document = self.service.inspect_safely(
+            object_path,
+            self._include_content(url.query),
+            self._trace_context(),
+            depth,
+            budget,
+        )
+        self._send_json(status, document)
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != "/inspect:batch":
+            self._send_json(404, {"error": "Not found"})
+            return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > HTTP_MAX_BODY_BYTES:
+            self._send_json(413, {"error": "Request body too large"})
+            return
+        try:
+            request = json.loads(self.rfile.read(length) or b"null")
+            object_paths = request["objects"] if isinstance(request, dict) else request
+            if not isinstance(object_paths, list) or not all(
+                isinstance(object_path, str) for object_path in object_paths
+            ):
+                raise ValueError("Expected a list of 'bucket/key' strings")
+        except (KeyError, ValueError) as e:
+            self._send_json(400, {"error": f"Invalid batch request: {e}"})
+            return
+        if len(object_paths) > HTTP_BATCH_MAX_OBJECTS:
+            self._send_json(413, {"error": "Too many objects in batch"})
+            return
+        try:
+            depth, budget = self._inspection_options(url.query)
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        encoder = CustomJSONEncoder()
+        for status, document in self.service.inspect_batch(
+            object_paths,
+            include_content=self._include_content(url.query),
+            parent_context=self._trace_context(),
+            depth=depth,
+            budget=budget,
+        ):
+            line = encoder.encode({"status": status, **document}) + "\n"
+            self._write_chunk(line.encode("utf-8"))
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def main():
+    """
+    Run the HTTP inspection service.
+    """
+    # Logging, the tracer provider exporting the http_inspect spans, and
+    # metrics, as in the consumer
+    configure_opentelemetry()
+    InspectionRequestHandler.service = InspectionService(
+        get_minio_client(), get_minio_backend()
+    )
+    server = ThreadingHTTPServer((HTTP_HOST, HTTP_PORT), InspectionRequestHandler)
+    server.daemon_threads = True
+    logger.info(f"HTTP inspection service listening on {HTTP_HOST}:{HTTP_PORT}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Received interrupt signal. Shutting down gracefully.")
+    finally:
+        server.server_close()
+        result_writer = get_result_writer(get_minio_client())
+        if result_writer is not None:
+            result_writer.close()
+        logger.complete()
+
+
+if __name__ == "__main__":
+    main()
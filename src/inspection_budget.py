@@ -0,0 +1,294 @@
+# src/inspection_budget.py
+"""
+Inspection Depth and Budget Module
+
+Inspections run at one of three depths, so that bulk listings can ask for a
+cheap classification and only the objects that need it get a full analysis:
+
+- sniff: the type only, from the leading bytes of the object.
+- standard: container metadata (dimensions, EXIF, audio and video stream
+  details, archive listings, PDF info) parsed with ranged reads, and video
+  thumbnails sampled from a few keyframes when enabled.
+- deep: the whole object is read and hashed (videos are hashed as they
+  stream by), and the decode-based analyses (perceptual hashes, audio
+  levels) run when enabled.
+
+Each inspection can also carry a budget of time and bytes read. Reads through
+a BudgetedBackend are metered and raise BudgetExceeded once the budget is
+spent; the inspection then returns what it gathered so far, marked partial.
+"""
+import re
+import threading
+import time
+
+from config_utils import get_env_variable
+from storage import StorageBackend
+
+# Inspection depths, cheapest first
+DEPTHS = ("sniff", "standard", "deep")
+
+# Depth used when a request does not ask for one
+INSPECT_DEPTH = get_env_variable("INSPECT_DEPTH", "deep")
+# Default budget of each inspection (0 for no limit)
+INSPECT_BUDGET_SECONDS = get_env_variable("INSPECT_BUDGET_SECONDS", 0, float)
+INSPECT_BUDGET_BYTES = get_env_variable("INSPECT_BUDGET_BYTES", 0, int)
+
+# Budget items such as '2.5s', '500ms', '16MB' or '65536'
+_BUDGET_ITEM = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(ms|s|b|kb|mb|gb)?\s*$", re.I)
+_BUDGET_UNITS = {
+    "ms": ("seconds", 0.001),
+    "s": ("seconds", 1),
+    "b": ("bytes", 1),
+    "kb": ("bytes", 1024),
+    "mb": ("bytes", 1024**2),
+    "gb": ("bytes", 1024**3),
+}
+
+
+class BudgetExceeded(Exception):
+    """
+    Raised by metered reads once the inspection budget is spent.
+    """
+
+
+def parse_depth(value=None):
+    """
+    Validate an inspection depth.
+
+    Parameters:
+    - value (str): 'sniff', 'standard' or 'deep'; INSPECT_DEPTH when empty.
+
+    Returns:
+    - str: The depth.
+
+    Raises:
+    - ValueError: For an unknown depth.
+    """
+    depth = (value or INSPECT_DEPTH).strip().lower()
+    if depth not in DEPTHS:
+        raise ValueError(f"Unknown inspection depth '{value}'")
+    return depth
+
+
+class InspectionBudget:
+    """
+    Time and bytes an inspection may spend. The clock starts when the budget
+    is created.
+    """
+
+    def __init__(self, seconds=INSPECT_BUDGET_SECONDS, max_bytes=INSPECT_BUDGET_BYTES):
+        """
+        Create an InspectionBudget instance.
+
+        Parameters:
+        - seconds (float): Wall-clock time allowed (None or 0 for no limit).
+        - max_bytes (int): Bytes that may be read (None or 0 for no limit).
+        """
+        self.seconds = seconds or None
+        self.max_bytes = max_bytes or None
+        self.bytes_read = 0
+        # 'time' or 'bytes' once a check failed
+        self.exceeded = None
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def parse(cls, value):
+        """
+        Create a budget from a request.
+
+        Parameters:
+        - value (str or dict): Comma-separated items such as '2s,16MB' (bare
+          numbers are bytes), or a mapping with 'seconds' and 'bytes' (e.g. an
+          AMQP header table). Limits not given use the defaults.
+
+        Returns:
+        - InspectionBudget: The budget.
+
+        Raises:
+        - ValueError: When the value cannot be parsed.
+        """
+        limits = {"seconds": INSPECT_BUDGET_SECONDS, "bytes": INSPECT_BUDGET_BYTES}
+        if isinstance(value, dict):
+            unknown = set(value) - set(limits)
+            if unknown:
+                raise ValueError(f"Unknown budget fields: {', '.join(sorted(unknown))}")
+            limits["seconds"] = float(value.get("seconds", limits["seconds"]))
+            limits["bytes"] = int(value.get("bytes", limits["bytes"]))
+        elif value:
+            if isinstance(value, bytes):
+                value = value.decode("utf-8")
+            for item in str(value).split(","):
+                match = _BUDGET_ITEM.match(item)
+                if match is None:
+                    raise ValueError(f"Invalid budget item '{item.strip()}'")
+                limit, factor = _BUDGET_UNITS[(match.group(2) or "b").lower()]
+                limits[limit] = float(match.group(1)) * factor
+        if limits["seconds"] < 0 or limits["bytes"] < 0:
+            raise ValueError("Budget limits cannot be negative")
+        return cls(limits["seconds"], int(limits["bytes"]))
+
+    def elapsed(self):
+        """
+        Get the seconds spent since the budget was created.
+        """
+        return time.monotonic() - self._started
+
+    def remaining_seconds(self):
+        """
+        Get the time left.
+
+        Returns:
+        - float or None: Seconds left (at least 0), or None without a limit.
+        """
+        if self.seconds is None:
+            return None
+        return max(self.seconds - self.elapsed(), 0.0)
+
+    def remaining_bytes(self):
+        """
+        Get the bytes that may still be read.
+
+        Returns:
+        - int or None: Bytes left (at least 0), or None without a limit.
+        """
+        if self.max_bytes is None:
+            return None
+        return max(self.max_bytes - self.bytes_read, 0)
+
+    def cap_seconds(self, seconds):
+        """
+        Limit a time allowance to the time left.
+
+        Parameters:
+        - seconds (float): The allowance (None for no limit).
+
+        Returns:
+        - float or None: The smaller of the two.
+        """
+        remaining = self.remaining_seconds()
+        if remaining is None or seconds is None:
+            return seconds if remaining is None else remaining
+        return min(seconds, remaining)
+
+    def allows(self, length=0):
+        """
+        Check that time is left and that length more bytes may be read.
+
+        Parameters:
+        - length (int): Bytes about to be read.
+
+        Returns:
+        - bool: Whether the budget allows it; otherwise the reason is kept in
+          the exceeded attribute.
+        """
+        with self._lock:
+            if self.seconds is not None and self.elapsed() >= self.seconds:
+                self.exceeded = "time"
+                return False
+            if self.max_bytes is not None and self.bytes_read + length > self.max_bytes:
+                self.exceeded = "bytes"
+                return False
+            return True
+
+    def check(self, length=0):
+        """
+        Like allows(), but raise when the budget does not allow the read.
+
+        Raises:
+        - BudgetExceeded: When the budget is spent.
+        """
+        if not self.allows(length):
+            raise BudgetExceeded(f"Inspection {self.exceeded} budget exceeded")
+
+    def charge(self, length):
+        """
+        Record bytes read.
+
+        Parameters:
+        - length (int): Number of bytes.
+        """
+        with self._lock:
+            self.bytes_read += length
+
+    def summary(self):
+        """
+        Describe what the inspection spent.
+
+        Returns:
+        - dict: Elapsed time, bytes read and the exceeded limit, if any.
+        """
+        return {
+            "partial": self.exceeded is not None,
+            "budget_exceeded": self.exceeded,
+            "elapsed_ms": round(self.elapsed() * 1000, 1),
+            "bytes_read": self.bytes_read,
+        }
+
+
+class _MeteredStream:
+    """
+    Sequential stream charging what is read to a budget.
+    """
+
+    def __init__(self, stream, budget):
+        self._stream = stream
+        self._budget = budget
+
+    def read(self, size=-1):
+        self._budget.check(max(size, 0))
+        data = self._stream.read(size)
+        self._budget.charge(len(data))
+        return data
+
+    def close(self):
+        self._stream.close()
+        if hasattr(self._stream, "release_conn"):
+            self._stream.release_conn()
+
+
+class BudgetedBackend(StorageBackend):
+    """
+    Storage backend wrapper metering reads against an InspectionBudget.
+
+    Stats are not metered, and neither are the reads made by external tools
+    through local_path() and url(); those get their time allowance from
+    InspectionBudget.cap_seconds() instead.
+    """
+
+    def __init__(self, backend, budget):
+        """
+        Create a BudgetedBackend instance.
+
+        Parameters:
+        - backend (StorageBackend): The backend to read from.
+        - budget (InspectionBudget): The budget reads are charged to.
+        """
+        self.backend = backend
+        self.budget = budget
+
+    def stat(self, key):
+        return self.backend.stat(key)
+
+    def read(self, key):
+        # The size is checked by the caller (it knows it from stat())
+        self.budget.check()
+        content = self.backend.read(key)
+        self.budget.charge(len(content))
+        return content
+
+    def read_range(self, key, offset, length):
+        self.budget.check(length)
+        chunk = self.backend.read_range(key, offset, length)
+        self.budget.charge(len(chunk))
+        return chunk
+
+    def open_stream(self, key):
+        self.budget.check()
+        return _MeteredStream(self.backend.open_stream(key), self.budget)
+
+    def local_path(self, key):
+        return self.backend.local_path(key)
+
+    def url(self, key):
+        return self.backend.url(key)
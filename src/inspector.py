@@ -9,34 +9,67 @@ import json
 import os
 import secrets
 import string
+import subprocess
 import time
-from io import BytesIO
 from json import JSONEncoder
 
 import magic
-import mutagen
 import piexif
 from loguru import logger
 from minio import Minio
 from minio.error import S3Error
-from moviepy.editor import AudioFileClip, VideoFileClip
-from mutagen import File
-
-# from mutagen import MutagenError, MutagenFormatError
 from PIL import Image
 from PIL.ExifTags import GPSTAGS, TAGS
 
+from archive_extractor import (
+    ARCHIVE_RECURSE,
+    detect_archive_format,
+    extract_archive_metadata,
+)
+from audio_analysis import AUDIO_ANALYSIS, analyze_audio, read_audio_info
+from document_extractor import DOCUMENT_FULL_PARSE, extract_pdf_metadata, is_pdf
+from inspection_budget import (
+    DEPTHS,
+    BudgetedBackend,
+    BudgetExceeded,
+    InspectionBudget,
+    parse_depth,
+)
+from perceptual_hash import (
+    PERCEPTUAL_HASH,
+    PERCEPTUAL_HASH_INDEX_HASH,
+    compute_hashes,
+    get_near_duplicate_index,
+)
+from profiling import profile_inspection
+from storage import (
+    STORAGE_ERRORS,
+    BufferReader,
+    MinioBackend,
+    RangedFile,
+    release_buffer,
+)
+from structured_logging import summarize_fields
+from tracing import annotate, mark_failed, stage
+from video_thumbnails import (
+    VIDEO_THUMBNAIL_BUDGET_SECONDS,
+    VIDEO_THUMBNAILS,
+    extract_thumbnails,
+    probe_video,
+)
+
 # Minio configurations
 # TODO: Use env var
 MINIO_ENDPOINT = os.environ.get("MINIO_ENDPOINT")
 MINIO_ACCESS_KEY = os.environ.get("MINIO_ACCESS_KEY")
 MINIO_SECRET_KEY = os.environ.get("MINIO_SECRET_KEY")
 
-# Ensure the required environment variables are set
-if not (MINIO_ENDPOINT and MINIO_ACCESS_KEY and MINIO_SECRET_KEY):
-    raise ValueError(
-        "Please set the MINIO_ENDPOINT, MINIO_ACCESS_KEY, and MINIO_SECRET_KEY environment variables."
-    )
+# Number of leading bytes used to determine the file type
+SNIFF_BYTES = 16 * 1024
+# Size of the ranged reads made when parsing headers without the whole object
+HEADER_BLOCK_SIZE = 16 * 1024
+# Size of the reads made when hashing an object without holding it in memory
+HASH_CHUNK_SIZE = 1024 * 1024
 
 
 # Initialize Minio client
@@ -56,39 +89,186 @@ class Object:
 
 
 class InspectObject(Object):
-    def __init__(self, minio_client, object_path):
+    def __init__(
+        self,
+        minio_client,
+        object_path,
+        backend=None,
+        include_content=True,
+        nesting_depth=0,
+        depth=None,
+        budget=None,
+    ):
+        """
+        Initialize an InspectObject instance.
+
+        Args:
+            minio_client (Minio): The Minio client, used when no backend is given.
+            object_path (str): The object key, 'bucket_name/object_name' for Minio.
+            backend (StorageBackend): The storage backend to read the object from.
+            include_content (bool): Whether to add the base64-encoded content
+                to the metadata (deep inspections of non-video files only).
+            nesting_depth (int): Number of archives this object is nested in.
+            depth (str): 'sniff', 'standard' or 'deep' (INSPECT_DEPTH when not
+                given).
+            budget (InspectionBudget): Time and bytes the inspection may spend
+                (the INSPECT_BUDGET_* defaults when not given).
+
+        Raises:
+            ValueError: For an unknown depth.
+        """
         super().__init__(object_path)
         self.minio_client = minio_client
         self.object_path = object_path
+        self.depth = parse_depth(depth)
+        self.budget = budget or InspectionBudget()
+        # Reads are charged to the budget
+        self.backend = BudgetedBackend(
+            backend or MinioBackend(minio_client), self.budget
+        )
+        self.include_content = include_content
+        self.nesting_depth = nesting_depth
+        self._content = None
+        self._head = None
+        # Whether the head is the whole object
+        self._head_is_whole = False
+        self._stat = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Release the content buffer held by this instance.
+        """
+        if self._content is not None:
+            release_buffer(self._content)
+            self._content = None
 
     def read_object(self):
         """
-        Read the content of the file and return it as bytes.
+        Read the content of the file.
+
+        The content is read once and kept for the other inspection steps. The
+        local filesystem backend returns a read-only memory map rather than
+        bytes.
 
         Returns:
-            bytes: The content of the file.
+            bytes-like: The content of the file.
         """
+        if self._content is not None:
+            return self._content
+        if self._head_is_whole:
+            # Small objects were read whole with the head
+            self._content = self._head
+            return self._content
         try:
-            bucket_name, object_name = self.object_path.split("/")
-            object_data = self.minio_client.get_object(bucket_name, object_name)
-            content = object_data.read()
-            return content
-        except S3Error as e:
-            print(f"Error fetching the object from Minio: {e}")
+            self._content = self.backend.read(self.object_path)
+            return self._content
+        except STORAGE_ERRORS as e:
+            print(f"Error fetching the object '{self.object_path}': {e}")
+            return None
+
+    def stat(self):
+        """
+        Get the size and ETag of the object.
+
+        Returns:
+            ObjectStat: The object metadata.
+        """
+        if self._stat is None:
+            self._stat = self.backend.stat(self.object_path)
+        return self._stat
+
+    def content_size(self):
+        """
+        Get the size of the object, without a request once it has been read.
+
+        Returns:
+            int: The size in bytes.
+        """
+        if self._content is not None:
+            return len(self._content)
+        return self.stat().size
+
+    def open_content(self):
+        """
+        Open the content for parsers that only need part of it.
+
+        Once the object has been read (deep inspections) the buffer is used;
+        otherwise only the blocks the parser reads are fetched.
+
+        Returns:
+            file object: A seekable binary file object.
+        """
+        if self._content is not None:
+            return BufferReader(self._content)
+        return RangedFile(
+            self.backend,
+            self.object_path,
+            size=self.stat().size,
+            block_size=HEADER_BLOCK_SIZE,
+            head=self._head,
+        )
+
+    def read_head(self, length=SNIFF_BYTES):
+        """
+        Read the first bytes of the file.
+
+        Args:
+            length (int): Number of bytes to read.
+
+        Returns:
+            bytes: The leading bytes of the file.
+        """
+        if self._content is not None:
+            return bytes(self._content[:length])
+        if self._head is not None and (
+            len(self._head) >= length or self._head_is_whole
+        ):
+            return self._head[:length]
+        if self._stat is not None:
+            length = min(length, self._stat.size)
+        # A small byte budget still leaves room for sniffing the type
+        remaining = self.budget.remaining_bytes()
+        if remaining is not None:
+            length = max(min(length, remaining), 1)
+        try:
+            self._head = self.backend.read_range(self.object_path, 0, length)
+            # A short read ends at the end of the object
+            self._head_is_whole = len(self._head) < length or (
+                self._stat is not None and len(self._head) >= self._stat.size
+            )
+            return self._head
+        except STORAGE_ERRORS as e:
+            print(f"Error fetching the object '{self.object_path}': {e}")
             return None
 
     def determine_file_type(self):
         """
-        Determine the type of the file based on its content.
+        Determine the type of the file based on its leading bytes.
 
         Returns:
-            str: The file type ('text', 'image', 'video', 'audio', or 'unknown').
+            str: The file type ('text', 'image', 'video', 'audio', 'archive',
+                'document' or 'unknown').
         """
 
-        content = self.read_object()
+        content = self.read_head()
         if content:
-            # Initialize the magic library
-            mime = magic.Magic()
+            # Archives are recognized by their signature; magic describes
+            # some ZIP-based documents as text
+            if detect_archive_format(content):
+                return "archive"
+            if is_pdf(content):
+                return "document"
+
+            # Initialize the magic library; the MIME type is matched rather
+            # than the description, which names e.g. MP4 'ISO Media' and
+            # mentions the audio stream of an AVI
+            mime = magic.Magic(mime=True)
             mime_type = mime.from_buffer(content)
 
             # Map MIME types to file types
@@ -100,12 +280,12 @@ class InspectObject(Object):
             }
 
             # Check if the MIME type corresponds to a known file type
-            for mime_type_keyword, file_type in mime_type_mapping.items():
-                if mime_type_keyword in mime_type:
-                    return file_type
+            file_type = mime_type_mapping.get(mime_type.split("/", 1)[0])
+            if file_type is not None:
+                return file_type
 
-            # Check for MP3 files specifically
-            if "MPEG" in mime_type:
+            # Ogg streams without a more specific type (e.g. Opus)
+            if mime_type == "application/ogg":
                 return "audio"
 
         return "unknown"
@@ -122,11 +302,10 @@ class InspectObject(Object):
         Returns:
             dict: Metadata information for image objects.
         """
+        image_metadata = None
         try:
-            image_data = self.read_object()
-            if image_data is not None:
-                image = Image.open(BytesIO(image_data))
-
+            # Standard inspections parse the headers with ranged reads
+            with self.open_content() as image_file, Image.open(image_file) as image:
                 # Extract EXIF metadata using piexif
                 exif_data = None
                 try:
@@ -149,7 +328,22 @@ class InspectObject(Object):
                     "exif_data": exif_data,
                 }
 
-                return image_metadata
+                # Hashes decode a reduced-size copy, so they come last
+                if PERCEPTUAL_HASH and self.depth == "deep" and self.budget.allows():
+                    with stage("perceptual_hash"):
+                        hashes = compute_hashes(image)
+                        image_metadata["perceptual_hashes"] = hashes
+                        if hashes is not None:
+                            image_metadata[
+                                "near_duplicates"
+                            ] = self.find_near_duplicates(hashes)
+
+            return image_metadata
+        except BudgetExceeded:
+            # Keep the header fields read before the budget ran out
+            if image_metadata is None:
+                raise
+            return image_metadata
         except Exception as e:
             print(f"Error extracting image metadata: {e}")
             return None
@@ -189,147 +383,368 @@ class InspectObject(Object):
             print(f"Error extracting image metadata: {e}")
             return None
 
+    def find_near_duplicates(self, hashes):
+        """
+        Look up images similar to this one and add it to the index.
+
+        Args:
+            hashes (dict): The perceptual hashes of the image.
+
+        Returns:
+            list or None: Keys and Hamming distances of the near duplicates,
+                or None without an index.
+        """
+        index = get_near_duplicate_index()
+        # Archive members have no key of their own
+        if index is None or self.nesting_depth > 0:
+            return None
+        value = hashes[PERCEPTUAL_HASH_INDEX_HASH]
+        near_duplicates = [
+            {"key": key, "distance": distance}
+            for key, distance in index.query(value)
+            if key != self.object_path
+        ]
+        index.add(self.object_path, value)
+        return near_duplicates
+
     def extract_video_metadata(self):
         """
         Extract metadata from a video object.
 
+        The video stream is described from the container headers and preview
+        frames are sampled by seeking to keyframes, so the cost does not grow
+        with the length of the video. ffmpeg reads local files in place and
+        MinIO objects through a presigned URL with ranged requests.
+
         Returns:
             dict: Metadata information for video objects.
         """
+        temp_video_file_path = None
         try:
-            video_data = self.read_object()
-            if video_data is not None:
-                # Get the size of the video data
-                video_size = len(video_data)
-
-                # Create a unique temporary file name with a timestamp and a prefixed random 8-character name
+            video_file_path = self.backend.local_path(
+                self.object_path
+            ) or self.backend.url(self.object_path)
+            if video_file_path is None:
+                # Other backends need a copy ffmpeg can seek in. Create a unique
+                # temporary file name with a timestamp and a prefixed random
+                # 8-character name
                 timestamp = int(time.time())
                 random_name = "".join(
                     secrets.choice(string.ascii_lowercase) for _ in range(8)
                 )
                 prefix = "video"  # Prefix for the random name
-                temp_video_file_path = f"/tmp/{prefix}_{random_name}_{timestamp}.mp4"
+                temp_video_file_path = f"/tmp/{prefix}_{random_name}_{timestamp}"
                 with open(temp_video_file_path, "wb") as temp_video_file:
-                    temp_video_file.write(video_data)
-
-                # Read video metadata from the temporary file
-                video = VideoFileClip(temp_video_file_path)
-                duration = video.duration
-                frame_rate = video.fps
-                resolution = video.size
-                audio_info = self.extract_audio_metadata(video.audio)
-
-                # Extract additional video metadata
-                video_metadata = {
-                    "file_type": "video",
-                    "size": video_size,
-                    "duration": duration,
-                    "frame_rate": frame_rate,
-                    "resolution": resolution,
-                    "title": getattr(video, "title", ""),  # Title of the video
-                    "author": getattr(
-                        video, "author", ""
-                    ),  # Author/creator of the video
-                    "copyright": getattr(
-                        video, "copyright", ""
-                    ),  # Copyright information
-                    "bitrate": getattr(video, "bitrate", 0),  # Bitrate in kbps
-                    "container": getattr(
-                        video, "container", ""
-                    ),  # Video container format
-                    "video_codec": getattr(
-                        video, "video_codec", ""
-                    ),  # Video codec used
-                    "video_bitrate": getattr(
-                        video, "video_bitrate", 0
-                    ),  # Video bitrate in kbps
-                    "audio_codec": getattr(
-                        video, "audio_codec", ""
-                    ),  # Audio codec used
-                    "audio_channels": getattr(
-                        video, "audio_channels", 0
-                    ),  # Number of audio channels
-                    "audio_bitrate": getattr(
-                        video, "audio_bitrate", 0
-                    ),  # Audio bitrate in kbps
-                }
+                    temp_video_file.write(self.read_object())
+                video_file_path = temp_video_file_path
 
-                # Remove the temporary file
-                os.remove(temp_video_file_path)
+            # Duration, codec, resolution and frame rate of the video stream
+            video_info = None
+            if self.budget.allows():
+                try:
+                    video_info = probe_video(
+                        video_file_path,
+                        timeout=self.budget.cap_seconds(
+                            VIDEO_THUMBNAIL_BUDGET_SECONDS
+                        ),
+                    )
+                except subprocess.TimeoutExpired:
+                    # Records the time budget as exceeded if it cut the probe
+                    self.budget.allows()
+
+            # Thumbnails only read the index and a few keyframes, so standard
+            # inspections sample them too
+            thumbnails = None
+            if video_info is not None and VIDEO_THUMBNAILS and self.budget.allows():
+                with stage("thumbnails"):
+                    thumbnails = extract_thumbnails(
+                        video_file_path,
+                        video_info["duration"],
+                        budget=self.budget.cap_seconds(VIDEO_THUMBNAIL_BUDGET_SECONDS),
+                    )
+                if thumbnails is not None and not thumbnails["complete"]:
+                    # Records the time budget as exceeded if it left frames out
+                    self.budget.allows()
+
+            # Size and audio track details; the audio analysis, which decodes
+            # the whole track, gets the time that is left
+            try:
+                video_metadata = self.extract_audio_metadata(
+                    is_video=True,
+                    has_audio=video_info["has_audio"] if video_info else None,
+                )
+            except BudgetExceeded:
+                if video_info is None:
+                    raise
+                # The probe still describes the video
+                video_metadata = {"file_type": "video", "size": self.content_size()}
+            if video_metadata is None:
+                return None
+            if video_info is not None:
+                video_metadata.update(
+                    (name, value)
+                    for name, value in video_info.items()
+                    if value is not None
+                )
+            if thumbnails is not None:
+                video_metadata["thumbnails"] = thumbnails
 
-                return video_metadata
+            return video_metadata
+        except BudgetExceeded:
+            raise
         except Exception as e:
             print(f"Error extracting video metadata: {e}")
             return None
+        finally:
+            # Remove the temporary file
+            if temp_video_file_path is not None:
+                os.remove(temp_video_file_path)
 
-    def extract_audio_metadata(self, is_video=False):
+    def extract_audio_metadata(self, is_video=False, has_audio=None):
         """
-        Extract audio metadata from a video file.
+        Extract audio metadata from an audio file or the audio track of a
+        video.
+
+        Stream information comes from the container headers. With
+        AUDIO_ANALYSIS enabled, deep inspections also decode the audio in
+        chunks with a piped ffmpeg to measure levels, loudness and silences.
 
         Args:
             is_video (bool): Set to True if the file is a video.
+            has_audio (bool): Whether the video has an audio track, if known.
 
         Returns:
             dict: Audio metadata information.
         """
+        audio_metadata = None
         try:
-            audio_data = self.read_object()
-            if audio_data is not None:
-                # Get the size of the audio data
-                audio_size = len(audio_data)
-
-                if is_video:
-                    # If it's a video, use moviepy to extract audio metadata
-                    video = VideoFileClip(self.file_path)
-                    audio = video.audio
-                    audio_channels = getattr(audio, "nchannels", 0)
-                    audio_bitrate = getattr(audio, "bitrate", 0)
-                    audio_codec = "Unknown"
-                else:
-                    # If it's an audio file, use mutagen to extract audio metadata
-                    with BytesIO(audio_data) as temp_audio_file:
-                        metadata = File(temp_audio_file)
-                        if metadata is not None:
-                            audio_channels = metadata.info.channels
-                            audio_bitrate = metadata.info.bitrate
-                            audio_codec = getattr(
-                                metadata.info, "codec_name", "Unknown"
-                            )
-                        else:
-                            return None
-
-                audio_metadata = {
-                    "file_type": "audio",
-                    "size": audio_size,
-                    "audio_codec": audio_codec,
-                    "audio_channels": audio_channels,
-                    "audio_bitrate": audio_bitrate,
-                }
+            # Standard inspections read the headers with ranged reads
+            with self.open_content() as audio_file:
+                audio_info = read_audio_info(audio_file)
+            # Videos are described even when mutagen does not know the
+            # container
+            if audio_info is None and not is_video:
+                return None
+
+            audio_metadata = {
+                "file_type": "video" if is_video else "audio",
+                "size": self.content_size(),
+                **(audio_info or {}),
+            }
 
-                return audio_metadata
+            if (
+                AUDIO_ANALYSIS
+                and has_audio is not False
+                and self.depth == "deep"
+                and self.budget.allows()
+            ):
+                with stage("audio_analysis"):
+                    analysis = self.analyze_audio()
+                audio_metadata["audio_analysis"] = analysis
+                if analysis is not None and not analysis["complete"]:
+                    # The decoding was stopped by the time budget
+                    self.budget.allows()
+
+            return audio_metadata
+        except BudgetExceeded:
+            # Keep the header fields read before the budget ran out
+            if audio_metadata is None:
+                raise
+            return audio_metadata
         except Exception as e:
             print(f"Error extracting audio metadata: {e}")
             return None
 
+    def analyze_audio(self):
+        """
+        Measure the levels of the (first) audio track.
+
+        ffmpeg decodes local files in place and is piped content that has
+        already been read. Otherwise it reads the object through a URL, which
+        also lets it seek in containers that need it (e.g. MP4 with the index
+        at the end), or the object is streamed to it in chunks. The object is
+        never read into memory for the analysis.
+
+        Returns:
+            dict or None: The analysis, or None without an audio track.
+        """
+        time_limit = self.budget.remaining_seconds()
+        local_path = self.backend.local_path(self.object_path)
+        if local_path is not None:
+            return analyze_audio(local_path, time_limit=time_limit)
+        if self._content is not None:
+            analysis = analyze_audio(data=self._content, time_limit=time_limit)
+            if analysis is not None:
+                return analysis
+        url = self.backend.url(self.object_path)
+        if url is not None:
+            return analyze_audio(url, time_limit=time_limit)
+        if self._content is not None:
+            return None
+
+        stream = self.backend.open_stream(self.object_path)
+        try:
+            analysis = analyze_audio(data=stream, time_limit=time_limit)
+        finally:
+            stream.close()
+        if analysis is not None and self.budget.exceeded is not None:
+            # The read budget ran out before the end of the stream
+            analysis["complete"] = False
+        return analysis
+
+    def extract_archive_metadata(self):
+        """
+        Extract metadata from an archive object using ranged reads.
+
+        Returns:
+            dict: Metadata information for archive objects.
+        """
+        try:
+            head = self.read_head()
+            if head is not None:
+                archive_metadata = extract_archive_metadata(
+                    self.backend,
+                    self.object_path,
+                    head,
+                    size=self.stat().size,
+                    depth=self.nesting_depth,
+                    # Members are only inspected by deep inspections
+                    recurse=ARCHIVE_RECURSE and self.depth == "deep",
+                    inspect_depth=self.depth,
+                    budget=self.budget,
+                )
+                if archive_metadata is not None:
+                    archive_metadata["file_type"] = "archive"
+                return archive_metadata
+        except BudgetExceeded:
+            raise
+        except Exception as e:
+            print(f"Error extracting archive metadata: {e}")
+            return None
+
+    def extract_document_metadata(self):
+        """
+        Extract metadata from a PDF document using ranged reads of its head
+        and tail.
+
+        Returns:
+            dict: Metadata information for document objects.
+        """
+        try:
+            head = self.read_head()
+            if head is not None:
+                return extract_pdf_metadata(
+                    self.backend,
+                    self.object_path,
+                    head,
+                    size=self.stat().size,
+                    # Parsing the whole document is for deep inspections
+                    full=DOCUMENT_FULL_PARSE and self.depth == "deep",
+                )
+        except BudgetExceeded:
+            raise
+        except Exception as e:
+            print(f"Error extracting document metadata: {e}")
+            return None
+
     def generate_metadata(self):
         """
         Generate metadata for the provided file.
 
+        The type is determined from the leading bytes first so that archives
+        and documents can be described without reading the whole object. How
+        much more is read depends on the depth: 'sniff' stops at the type,
+        'standard' parses the container metadata with ranged reads and 'deep'
+        reads, hashes and analyzes the whole object.
+
+        When the budget runs out, the metadata gathered so far is returned and
+        the 'inspection' entry is marked partial.
+
         Returns:
             dict or None: Metadata information for the file.
         """
-        data = self.read_object()
+        filename = os.path.basename(self.file_path)
+        annotate(depth=self.depth)
+        file_type = None
+        metadata = None
+        try:
+            with stage("sniff"):
+                file_type = self.determine_file_type()
+            metadata = self.extract_metadata(file_type, filename)
+        except BudgetExceeded as e:
+            logger.bind(object_key=self.object_path).debug(str(e))
+
+        if metadata is None:
+            if self.budget.exceeded is None:
+                return None
+            # Stopped by the budget: only the type is known
+            metadata = {"file_type": file_type, "filename": filename}
+        metadata["inspection"] = {"depth": self.depth, **self.budget.summary()}
+        return metadata
+
+    def extract_metadata(self, file_type, filename):
+        """
+        Extract the metadata of a file of known type at the inspection depth.
+
+        Args:
+            file_type (str): The type determined from the leading bytes.
+            filename (str): The name of the file.
+
+        Returns:
+            dict or None: Metadata information for the file.
+        """
+        # The object could not be read
+        if self._head is None and self._content is None:
+            return None
+
+        if self.depth == "sniff":
+            return {
+                "file_type": file_type,
+                "filename": filename,
+                "size": self.content_size(),
+            }
+
+        if file_type in ["archive", "document"]:
+            with stage("extract", file_type=file_type) as span:
+                if file_type == "archive":
+                    range_metadata = self.extract_archive_metadata()
+                else:
+                    range_metadata = self.extract_document_metadata()
+                if not range_metadata:
+                    mark_failed(
+                        f"{file_type.title()} metadata extraction failed", span
+                    )
+            if range_metadata:
+                annotate(size=range_metadata["size"], file_type=file_type)
+                range_metadata["filename"] = filename
+            return range_metadata
+
+        if self.depth == "deep" and self._content is None:
+            size = self.content_size() if self.budget.max_bytes else 0
+            if not self.budget.allows(size):
+                # Reading the whole object would exceed the budget
+                self.depth = "standard"
+        if self.depth == "standard":
+            return self.extract_standard_metadata(file_type, filename)
+        if file_type == "video" and self._content is None:
+            return self.extract_deep_video_metadata(filename)
+
+        with stage("fetch") as span:
+            data = self.read_object()
+            span.set_attribute("inspector.bytes_read", len(data) if data else 0)
         if data:
-            file_type = self.determine_file_type()
-            filename = os.path.basename(self.file_path)
-            content_hash = hashlib.sha256(data).hexdigest()
+            annotate(size=len(data), file_type=file_type)
+            with stage("hash"):
+                content_hash = hashlib.sha256(data).hexdigest()
 
             metadata = {}  # Create an empty metadata dictionary
 
             if file_type == "text":
-                content = data.decode("utf-8")
-                word_count = len(content.split())
-                char_count = len(content)
+                with stage("extract", size=len(data), file_type=file_type):
+                    # Text in other encodings is still counted
+                    content = str(data, "utf-8", errors="replace")
+                    word_count = len(content.split())
+                    char_count = len(content)
                 metadata = {
                     "file_type": file_type,
                     "filename": filename,
@@ -338,27 +753,42 @@ class InspectObject(Object):
                 }
 
             elif file_type == "image":
-                image_metadata = self.extract_image_metadata()
+                with stage("extract", size=len(data), file_type=file_type) as span:
+                    image_metadata = self.extract_image_metadata()
+                    if not image_metadata:
+                        mark_failed("Image metadata extraction failed", span)
                 if image_metadata:
                     image_metadata["filename"] = filename
                     image_metadata["content_hash"] = content_hash
 
                     # Convert the bytes data to a base64-encoded string
-                    content_base64 = base64.b64encode(data).decode("utf-8")
-                    image_metadata["content_base64"] = content_base64
+                    if self.include_content:
+                        with stage("encode", size=len(data)):
+                            content_base64 = base64.b64encode(data).decode("utf-8")
+                        image_metadata["content_base64"] = content_base64
 
                     metadata = image_metadata
 
             elif file_type in ["video", "audio"]:
                 is_video = file_type == "video"
-                audio_metadata = self.extract_audio_metadata(is_video)
+                with stage("extract", size=len(data), file_type=file_type) as span:
+                    if is_video:
+                        audio_metadata = self.extract_video_metadata()
+                    else:
+                        audio_metadata = self.extract_audio_metadata()
+                    if not audio_metadata:
+                        mark_failed(
+                            f"{file_type.title()} metadata extraction failed", span
+                        )
                 if audio_metadata:
                     audio_metadata["filename"] = filename
                     audio_metadata["content_hash"] = content_hash
 
                     # Convert the bytes data to a base64-encoded string
-                    content_base64 = base64.b64encode(data).decode("utf-8")
-                    audio_metadata["content_base64"] = content_base64
+                    if self.include_content:
+                        with stage("encode", size=len(data)):
+                            content_base64 = base64.b64encode(data).decode("utf-8")
+                        audio_metadata["content_base64"] = content_base64
 
                     metadata = audio_metadata
 
@@ -370,11 +800,92 @@ class InspectObject(Object):
                 }
 
                 # Convert the bytes data to a base64-encoded string
-                content_base64 = base64.b64encode(data).decode("utf-8")
-                metadata["content_base64"] = content_base64
+                if self.include_content:
+                    with stage("encode", size=len(data)):
+                        content_base64 = base64.b64encode(data).decode("utf-8")
+                    metadata["content_base64"] = content_base64
 
             return metadata
 
+    def extract_deep_video_metadata(self, filename):
+        """
+        Extract the metadata of a video and hash it without holding it in
+        memory.
+
+        The stream details and thumbnails are read as for standard
+        inspections, then the content is hashed as it streams by. Videos are
+        too large to be base64-encoded into the metadata.
+
+        Args:
+            filename (str): The name of the file.
+
+        Returns:
+            dict or None: Metadata information for the video.
+        """
+        metadata = self.extract_standard_metadata("video", filename)
+        if metadata:
+            try:
+                with stage("hash"):
+                    metadata["content_hash"] = self.hash_content()
+            except BudgetExceeded as e:
+                # The metadata gathered so far is kept; the budget marks it
+                # partial
+                logger.bind(object_key=self.object_path).debug(str(e))
+        return metadata
+
+    def hash_content(self):
+        """
+        Compute the SHA-256 of the content in chunks.
+
+        Returns:
+            str: The hex digest.
+        """
+        digest = hashlib.sha256()
+        stream = self.backend.open_stream(self.object_path)
+        try:
+            while True:
+                chunk = stream.read(HASH_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        finally:
+            stream.close()
+        return digest.hexdigest()
+
+    def extract_standard_metadata(self, file_type, filename):
+        """
+        Extract the container metadata of a file with ranged reads, without
+        hashing or decoding it.
+
+        Args:
+            file_type (str): The type determined from the leading bytes.
+            filename (str): The name of the file.
+
+        Returns:
+            dict or None: Metadata information for the file.
+        """
+        extractors = {
+            "image": self.extract_image_metadata,
+            "video": self.extract_video_metadata,
+            "audio": self.extract_audio_metadata,
+        }
+        if file_type not in extractors:
+            # Text and unknown content have no headers to parse
+            return {
+                "file_type": file_type,
+                "filename": filename,
+                "size": self.content_size(),
+            }
+
+        with stage("extract", file_type=file_type) as span:
+            metadata = extractors[file_type]()
+            if not metadata:
+                mark_failed(f"{file_type.title()} metadata extraction failed", span)
+        if metadata:
+            annotate(size=self.content_size(), file_type=file_type)
+            metadata["filename"] = filename
+        return metadata
+
 
 class CustomJSONEncoder(JSONEncoder):
     """
@@ -435,15 +946,30 @@ def main():
         None
     """
     # Add log file for writing logs to a file
-    logger.add("app.log", rotation="5 MB", level="INFO")
+    logger.add("app.log", rotation="5 MB", level="INFO", enqueue=True)
 
     parser = argparse.ArgumentParser(description="File Inspector for Minio Objects")
     parser.add_argument(
         "object_path",
         help="Full path to the object in the format 'bucket_name/object_name'",
     )
+    parser.add_argument(
+        "--depth",
+        choices=DEPTHS,
+        help="Inspection depth (defaults to INSPECT_DEPTH)",
+    )
+    parser.add_argument(
+        "--budget",
+        help="Time and bytes the inspection may spend, e.g. '2s,16MB'",
+    )
     args = parser.parse_args()
 
+    # Ensure the required environment variables are set
+    if not (MINIO_ENDPOINT and MINIO_ACCESS_KEY and MINIO_SECRET_KEY):
+        raise ValueError(
+            "Please set the MINIO_ENDPOINT, MINIO_ACCESS_KEY, and MINIO_SECRET_KEY environment variables."
+        )
+
     try:
         # Initialize Minio client
         minio_client = Minio(
@@ -454,21 +980,30 @@ def main():
         )
 
         # Create an InspectObject instance
-        inspector = InspectObject(minio_client, args.object_path)
+        inspector = InspectObject(
+            minio_client,
+            args.object_path,
+            depth=args.depth,
+            budget=InspectionBudget.parse(args.budget),
+        )
 
-        # Inspect the object
-        content = inspector.read_object()
+        # Check that the object can be read; the inspection reads as much of
+        # it as its depth needs
+        content = inspector.read_head()
 
         if content:
-            logger.info("Inspecting object '{args.object_path}':")
-            metadata = inspector.generate_metadata()
+            logger.bind(object_key=args.object_path).info("Inspecting object")
+            with profile_inspection(args.object_path):
+                metadata = inspector.generate_metadata()
 
             if metadata:
-                # Use the CustomJSONEncoder to serialize the metadata
+                # Log a compact summary; the full metadata (including the
+                # base64 content) only goes to stdout
+                logger.bind(
+                    object_key=args.object_path, **summarize_fields(metadata)
+                ).info("Metadata generated")
                 custom_encoder = CustomJSONEncoder(indent=4)
-                metadata_json = custom_encoder.encode(metadata)
-                logger.info("Metadata:")
-                logger.info(metadata_json)
+                print(custom_encoder.encode(metadata))
             else:
                 logger.warning(
                     f"Failed to generate metadata for object '{args.object_path}'"
@@ -481,6 +1016,9 @@ def main():
     except Exception as e:
         # Log any exceptions that occur
         logger.error(f"An error occurred: {str(e)}")
+    finally:
+        # Flush records still queued for the background log writer
+        logger.complete()
 
 
 if __name__ == "__main__":
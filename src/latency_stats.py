@@ -0,0 +1,160 @@
+# src/latency_stats.py
+"""
+Latency Statistics Module
+
+Thread-safe tracking of request latencies (EWMA and percentiles over a
+sliding time window), used to observe how MinIO responds under load.
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from config_utils import get_env_variable
+
+# Seconds of samples kept for the percentiles
+LATENCY_WINDOW_SECONDS = get_env_variable("LATENCY_WINDOW_SECONDS", 60.0, float)
+# Maximum number of samples kept per tracker
+LATENCY_MAX_SAMPLES = get_env_variable("LATENCY_MAX_SAMPLES", 4096, int)
+# Smoothing factor of the exponentially weighted moving average
+LATENCY_EWMA_ALPHA = get_env_variable("LATENCY_EWMA_ALPHA", 0.2, float)
+
+
+class LatencyTracker:
+    """
+    Records latency samples in milliseconds.
+    """
+
+    def __init__(
+        self,
+        window_seconds=LATENCY_WINDOW_SECONDS,
+        max_samples=LATENCY_MAX_SAMPLES,
+        alpha=LATENCY_EWMA_ALPHA,
+    ):
+        """
+        Create a LatencyTracker instance.
+
+        Parameters:
+        - window_seconds (float): Age of the oldest sample used for percentiles.
+        - max_samples (int): Maximum number of samples kept.
+        - alpha (float): Smoothing factor of the moving average.
+        """
+        self.window_seconds = window_seconds
+        self.alpha = alpha
+        self.ewma = None
+        self.count = 0
+        self.errors = 0
+        self._samples = deque(maxlen=max_samples)
+        self._errors = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+
+    def record(self, latency_ms):
+        """
+        Record the latency of a successful request.
+
+        Parameters:
+        - latency_ms (float): The latency in milliseconds.
+        """
+        with self._lock:
+            self._samples.append((time.monotonic(), latency_ms))
+            self.count += 1
+            if self.ewma is None:
+                self.ewma = latency_ms
+            else:
+                self.ewma += self.alpha * (latency_ms - self.ewma)
+
+    def record_error(self):
+        """
+        Record a failed request.
+        """
+        with self._lock:
+            self._errors.append(time.monotonic())
+            self.errors += 1
+
+    def _cutoff(self, since):
+        cutoff = time.monotonic() - self.window_seconds
+        return cutoff if since is None else max(cutoff, since)
+
+    def samples(self, since=None):
+        """
+        Get the latencies recorded in the window.
+
+        Parameters:
+        - since (float): Only return samples recorded after this
+          time.monotonic() value.
+
+        Returns:
+        - list: The latencies in milliseconds, oldest first.
+        """
+        cutoff = self._cutoff(since)
+        with self._lock:
+            return [latency for at, latency in self._samples if at >= cutoff]
+
+    def error_rate(self, since=None):
+        """
+        Get the share of failed requests in the window.
+
+        Parameters:
+        - since (float): Only count requests made after this time.
+
+        Returns:
+        - float: The error rate between 0 and 1 (0 without requests).
+        """
+        cutoff = self._cutoff(since)
+        with self._lock:
+            errors = sum(1 for at in self._errors if at >= cutoff)
+            successes = sum(1 for at, _ in self._samples if at >= cutoff)
+        total = errors + successes
+        return errors / total if total else 0.0
+
+    def percentile(self, q, since=None):
+        """
+        Get a percentile of the latencies recorded in the window.
+
+        Parameters:
+        - q (float): The percentile (0-100).
+        - since (float): Only use samples recorded after this time.
+
+        Returns:
+        - float or None: The latency in milliseconds, or None without samples.
+        """
+        return percentile(self.samples(since), q)
+
+    @contextmanager
+    def measure(self):
+        """
+        Measure the latency of the enclosed request.
+
+        Exceptions are recorded as errors and re-raised.
+        """
+        start_time = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.record_error()
+            raise
+        self.record((time.perf_counter() - start_time) * 1000)
+
+
+def percentile(values, q):
+    """
+    Compute a percentile with linear interpolation.
+
+    Parameters:
+    - values (list): The values.
+    - q (float): The percentile (0-100).
+
+    Returns:
+    - float or None: The percentile, or None for an empty list.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+# Latency of the requests made to MinIO by the storage backends
+MINIO_LATENCY = LatencyTracker()
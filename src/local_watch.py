@@ -0,0 +1,301 @@
+# src/local_watch.py
+"""
+Local Filesystem Inspection Module
+
+Inspects files on local and NFS volumes through the same pipeline as MinIO
+objects. Files are memory-mapped by the local storage backend and inspected on
+all cores; in watch mode new or changed files are picked up through inotify
+(when the optional inotify_simple package is installed) or by polling, and are
+only inspected once they have stopped changing for a debounce period.
+
+Usage:
+python local_watch.py <root> [--watch] [--workers N]
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from loguru import logger
+
+from config_utils import get_env_variable
+from inspector import CustomJSONEncoder, InspectObject
+from storage import LocalFilesystemBackend
+from structured_logging import summarize_fields
+
+try:
+    from inotify_simple import INotify
+    from inotify_simple import flags as inotify_flags
+except ImportError:
+    INotify = None
+
+LOCAL_WATCH_POLL_INTERVAL = get_env_variable("LOCAL_WATCH_POLL_INTERVAL", 2.0, float)
+LOCAL_WATCH_DEBOUNCE = get_env_variable("LOCAL_WATCH_DEBOUNCE", 1.0, float)
+
+
+def inspect_local_file(root, relative_path):
+    """
+    Inspect a single file below a root directory.
+
+    Runs in a worker process. The content is memory-mapped and not included
+    in the metadata. Errors are logged rather than raised, so that one bad
+    file does not abort a scan.
+
+    Parameters:
+    - root (str): The root directory.
+    - relative_path (str): The path of the file relative to the root.
+
+    Returns:
+    - tuple: The relative path and the metadata (or None on failure).
+    """
+    backend = LocalFilesystemBackend(root)
+    try:
+        with InspectObject(
+            None, relative_path, backend=backend, include_content=False
+        ) as inspect_object:
+            return relative_path, inspect_object.generate_metadata()
+    except Exception as e:
+        logger.bind(object_key=relative_path).error(
+            f"Error inspecting local file: {e}", exc_info=True
+        )
+        return relative_path, None
+
+
+def init_worker():
+    """
+    Send what the extractors print to stderr, keeping stdout for the results.
+    """
+    sys.stdout = sys.stderr
+
+
+def scan_files(root):
+    """
+    List the regular files below a root directory.
+
+    Parameters:
+    - root (str): The root directory.
+
+    Returns:
+    - dict: Relative paths mapped to their (size, mtime_ns) signature.
+    """
+    files = {}
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files[os.path.relpath(path, root)] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+class PollingWatcher:
+    """
+    Detects new and changed files by periodically scanning a directory tree.
+
+    A file is reported once its size and modification time have been
+    unchanged for the debounce period.
+    """
+
+    def __init__(
+        self, root, interval=LOCAL_WATCH_POLL_INTERVAL, debounce=LOCAL_WATCH_DEBOUNCE
+    ):
+        """
+        Create a PollingWatcher instance.
+
+        Parameters:
+        - root (str): The directory to watch.
+        - interval (float): Seconds between two scans.
+        - debounce (float): Seconds a file must stay unchanged.
+        """
+        self.root = root
+        self.interval = interval
+        self.debounce = debounce
+        # Signatures of the files already reported
+        self._reported = scan_files(root)
+        # Candidate files: signature and time it was first seen
+        self._pending = {}
+
+    def poll(self):
+        """
+        Scan the directory once.
+
+        Returns:
+        - list: Relative paths of the files that are ready to inspect.
+        """
+        now = time.monotonic()
+        ready = []
+        for path, signature in scan_files(self.root).items():
+            if self._reported.get(path) == signature:
+                continue
+            pending = self._pending.get(path)
+            if pending is None or pending[0] != signature:
+                self._pending[path] = (signature, now)
+            elif now - pending[1] >= self.debounce:
+                del self._pending[path]
+                self._reported[path] = signature
+                ready.append(path)
+        return ready
+
+    def __iter__(self):
+        while True:
+            yield self.poll()
+            time.sleep(self.interval)
+
+
+class InotifyWatcher:
+    """
+    Detects new and changed files through inotify.
+
+    A file is reported once no event has been received for it during the
+    debounce period.
+    """
+
+    def __init__(self, root, debounce=LOCAL_WATCH_DEBOUNCE):
+        """
+        Create an InotifyWatcher instance.
+
+        Parameters:
+        - root (str): The directory to watch.
+        - debounce (float): Seconds without events before a file is reported.
+        """
+        self.root = root
+        self.debounce = debounce
+        self._inotify = INotify()
+        self._directories = {}
+        self._pending = {}
+        for directory, _, _ in os.walk(root):
+            self._add_watch(directory)
+
+    def _add_watch(self, directory):
+        watch = self._inotify.add_watch(
+            directory,
+            inotify_flags.CLOSE_WRITE
+            | inotify_flags.MOVED_TO
+            | inotify_flags.CREATE
+            | inotify_flags.MODIFY,
+        )
+        self._directories[watch] = directory
+
+    def poll(self):
+        """
+        Wait for events for up to the debounce period.
+
+        Returns:
+        - list: Relative paths of the files that are ready to inspect.
+        """
+        for event in self._inotify.read(timeout=int(self.debounce * 1000)):
+            path = os.path.join(self._directories[event.wd], event.name)
+            if event.mask & inotify_flags.ISDIR:
+                if event.mask & (inotify_flags.CREATE | inotify_flags.MOVED_TO):
+                    self._add_watch(path)
+                continue
+            self._pending[os.path.relpath(path, self.root)] = time.monotonic()
+
+        now = time.monotonic()
+        ready = [
+            path
+            for path, last_event in self._pending.items()
+            if now - last_event >= self.debounce
+        ]
+        for path in ready:
+            del self._pending[path]
+        return [
+            path for path in ready if os.path.isfile(os.path.join(self.root, path))
+        ]
+
+    def __iter__(self):
+        while True:
+            yield self.poll()
+
+
+def create_watcher(root):
+    """
+    Create the best available watcher for a directory.
+
+    Parameters:
+    - root (str): The directory to watch.
+
+    Returns:
+    - InotifyWatcher or PollingWatcher: The watcher.
+    """
+    if INotify is not None:
+        try:
+            return InotifyWatcher(root)
+        except OSError as e:
+            logger.warning(f"inotify unavailable for '{root}', polling instead: {e}")
+    return PollingWatcher(root)
+
+
+def report(path, metadata):
+    """
+    Log a summary of a result and write the metadata as a JSON line to stdout.
+
+    Only results are written to stdout; the workers print to stderr.
+    """
+    if metadata is None:
+        logger.bind(object_key=path).warning("Failed to inspect local file")
+        return
+    logger.bind(object_key=path, **summarize_fields(metadata)).info(
+        "Local file inspected"
+    )
+    print(CustomJSONEncoder().encode({"path": path, "metadata": metadata}), flush=True)
+
+
+def main():
+    """
+    Inspect all files below a directory and optionally keep watching it.
+    """
+    parser = argparse.ArgumentParser(description="File Inspector for Local Files")
+    parser.add_argument("root", help="Directory containing the files to inspect")
+    parser.add_argument(
+        "--watch", action="store_true", help="Keep watching for new or changed files"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of worker processes (defaults to the number of cores)",
+    )
+    args = parser.parse_args()
+    root = os.path.realpath(args.root)
+
+    with ProcessPoolExecutor(
+        max_workers=args.workers, initializer=init_worker
+    ) as executor:
+        # Create the watcher before the initial scan so no file is missed
+        watcher = create_watcher(root) if args.watch else None
+
+        paths = sorted(scan_files(root))
+        for path, metadata in executor.map(
+            inspect_local_file, [root] * len(paths), paths, chunksize=16
+        ):
+            report(path, metadata)
+
+        if watcher is None:
+            return
+
+        logger.info(f"Watching '{root}' for new files. To exit press Ctrl+C")
+        try:
+            for ready in watcher:
+                futures = [
+                    executor.submit(inspect_local_file, root, path) for path in ready
+                ]
+                for path, future in zip(ready, futures):
+                    try:
+                        report(*future.result())
+                    except Exception as e:
+                        # E.g. a worker process that died
+                        logger.bind(object_key=path).error(
+                            f"Error inspecting local file: {e}"
+                        )
+        except KeyboardInterrupt:
+            logger.info("Stopped watching.")
+        finally:
+            logger.complete()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
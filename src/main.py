@@ -6,8 +6,12 @@ import pika
 from loguru import logger
 from opentelemetry import trace
 
-from inspect_object import InspectObject
+from concurrency_controller import ConcurrencyController
+from inspection_budget import InspectionBudget, parse_depth
+from inspector import InspectObject
+from minio_client import get_bucket_name, get_minio_backend, get_minio_client
 from opentelemetry_config import configure_opentelemetry
+from profiling import profile_inspection
 from rabbitmq_config import (
     RABBITMQ_EXCHANGE_NAME,
     RABBITMQ_HOST,
@@ -16,6 +20,10 @@ from rabbitmq_config import (
     RABBITMQ_QUEUE_NAME,
     RABBITMQ_USER,
 )
+from result_writer import get_result_writer
+from storage import STORAGE_ERRORS
+from structured_logging import summarize_fields
+from tracing import mark_failed
 
 
 def handle_interrupt(signum, frame):
@@ -29,36 +37,84 @@ signal.signal(signal.SIGINT, handle_interrupt)
 configure_opentelemetry()
 
 
-def callback(ch, method, properties, body):
+def inspection_options(headers):
+    # Depth and budget requested by the publisher in the x-inspect-depth and
+    # x-inspect-budget headers, e.g. 'sniff' and '2s,16MB'
+    depth = headers.get("x-inspect-depth")
+    if isinstance(depth, bytes):
+        depth = depth.decode("utf-8", "replace")
+    try:
+        return parse_depth(depth), InspectionBudget.parse(
+            headers.get("x-inspect-budget")
+        )
+    except (TypeError, ValueError) as e:
+        logger.warning(f"Ignoring invalid inspection options: {e}")
+        return parse_depth(), InspectionBudget()
+
+
+def handle_message(properties, body):
+    # Runs on a worker thread of the ConcurrencyController, which
+    # acknowledges the message afterwards. The inspection span is a child of
+    # the controller's span, which already carries the publisher's context
     try:
         filename = body.decode("utf-8")
-        logger.info(f"Received event from RabbitMQ: {filename}")
-        inspect_uploaded_object(filename)
+        logger.bind(object_key=filename).info("Received event from RabbitMQ")
+        depth, budget = inspection_options(properties.headers or {})
+        inspect_uploaded_object(filename, depth=depth, budget=budget)
     except Exception as e:
         logger.error(f"Error processing RabbitMQ message: {e}", exc_info=True)
         # Increment failed inspections counter
         failed_inspections_counter.add(1)
-    ch.basic_ack(delivery_tag=method.delivery_tag)
 
 
-def inspect_uploaded_object(filename: str):
+def inspect_uploaded_object(
+    filename: str, parent_context=None, depth=None, budget=None
+):
     try:
         with trace.get_tracer(__name__).start_as_current_span(
-            "inspect_uploaded_object"
-        ):
+            "inspect_uploaded_object",
+            context=parent_context,
+            kind=trace.SpanKind.CONSUMER,
+            attributes={"inspector.object_key": filename},
+        ), profile_inspection(filename):
             # Increment objects inspected counter
             objects_inspected_counter.add(1)
 
-            inspect_object = InspectObject(filename)
-            result = inspect_object.inspect()
-            if result["content"] is not None:
-                logger.info(
-                    f"Object inspection for '{filename}' completed successfully. Result: {result}"
+            object_path = f"{get_bucket_name()}/{filename}"
+            start_time = time.perf_counter()
+            # The consumer only logs and writes back a summary, so the
+            # content is not base64-encoded into the result
+            inspect_object = InspectObject(
+                get_minio_client(),
+                object_path,
+                backend=get_minio_backend(),
+                include_content=False,
+                depth=depth,
+                budget=budget,
+            )
+            # The ETag is taken before the content is read, so that an object
+            # replaced during the inspection is not recorded under the new one
+            try:
+                etag = inspect_object.stat().etag
+            except STORAGE_ERRORS:
+                etag = None
+            result = inspect_object.generate_metadata()
+            duration_ms = (time.perf_counter() - start_time) * 1000
+            if result is not None:
+                logger.bind(object_key=filename, **summarize_fields(result)).info(
+                    "Object inspection completed successfully"
                 )
+                # Queue the summary for batched write-back to MinIO
+                result_writer = get_result_writer(get_minio_client())
+                if result_writer is not None and etag is not None:
+                    result_writer.submit(object_path, etag, result, duration_ms)
                 # Increment successful inspections counter
                 successful_inspections_counter.add(1)
             else:
-                logger.warning(f"Object '{filename}' not found in 'uploads' bucket.")
+                logger.bind(object_key=filename).warning(
+                    "Object not found in 'uploads' bucket"
+                )
+                mark_failed("Object not found or inspection failed")
                 # Increment failed inspections counter
                 failed_inspections_counter.add(1)
     except Exception as e:
@@ -106,6 +162,7 @@ def connect_to_rabbitmq():
 def listen_for_rabbitmq_events():
     connection = None
     channel = None
+    controller = None
 
     while True:
         try:
@@ -119,7 +176,15 @@ def listen_for_rabbitmq_events():
             channel.queue_bind(
                 exchange=RABBITMQ_EXCHANGE_NAME, queue=result.method.queue
             )
-            channel.basic_consume(queue=queue_name, on_message_callback=callback)
+            # Worker pool and prefetch are sized at runtime from the queue lag,
+            # MinIO latency and CPU utilization
+            controller = ConcurrencyController(
+                connection, channel, queue_name, handle_message
+            )
+            controller.start()
+            channel.basic_consume(
+                queue=queue_name, on_message_callback=controller.on_message
+            )
             logger.info(
                 f"Connected to RabbitMQ. Waiting for events on {RABBITMQ_QUEUE_NAME} queue. To exit press Ctrl+C"
             )
@@ -127,6 +192,11 @@ def listen_for_rabbitmq_events():
         except Exception as e:
             logger.error(f"Error setting up RabbitMQ consumer: {e}", exc_info=True)
         finally:
+            # Let running inspections finish and acknowledge them
+            if controller is not None:
+                controller.stop()
+                controller = None
+
             # Close the channel if it is open
             if channel is not None and channel.is_open:
                 channel.close()
@@ -147,3 +217,9 @@ if __name__ == "__main__":
         # Calculate script uptime and record the value
         script_uptime = time.time() - script_start_time
         script_uptime_counter.add(int(script_uptime))
+        # Write back the summaries still queued
+        result_writer = get_result_writer(get_minio_client())
+        if result_writer is not None:
+            result_writer.close()
+        # Flush records still queued for the background log writer
+        logger.complete()
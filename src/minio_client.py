@@ -2,9 +2,23 @@
 """
 Minio client module for accessing objects in the 'uploads' bucket.
 """
+import threading
+
 from minio import Minio
 
 from config_utils import get_env_variable
+from hedged_reads import (
+    MINIO_REGION,
+    HedgedMinioBackend,
+    HedgedReader,
+    configured_endpoints,
+    create_endpoints,
+)
+from storage import MinioBackend
+
+_shared_client = None
+_shared_client_lock = threading.Lock()
+_shared_backend = None
 
 
 def initialize_minio_client():
@@ -31,6 +45,54 @@ def initialize_minio_client():
     )
 
 
+def get_minio_client():
+    """
+    Get a Minio client shared by the whole process.
+
+    The client is thread-safe and keeps a pool of connections, so reusing it
+    avoids a new connection per request.
+
+    Returns:
+    - Minio: The shared instance of the Minio client.
+    """
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            _shared_client = initialize_minio_client()
+        return _shared_client
+
+
+def get_minio_backend():
+    """
+    Get the storage backend shared by the whole process.
+
+    When MINIO_ENDPOINTS lists several nodes, reads are sent to all of them
+    with hedging; otherwise the shared client is used.
+
+    Returns:
+    - StorageBackend: The shared backend.
+    """
+    global _shared_backend
+    client = get_minio_client()
+    with _shared_client_lock:
+        if _shared_backend is None:
+            endpoints = configured_endpoints()
+            if len(endpoints) > 1:
+                _shared_backend = HedgedMinioBackend(
+                    HedgedReader(
+                        create_endpoints(
+                            endpoints,
+                            get_env_variable("MINIO_ACCESS_KEY"),
+                            get_env_variable("MINIO_SECRET_KEY"),
+                            region=MINIO_REGION,
+                        )
+                    )
+                )
+            else:
+                _shared_backend = MinioBackend(client)
+        return _shared_backend
+
+
 def get_bucket_name():
     """
     Get the name of the Minio bucket.
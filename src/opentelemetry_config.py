@@ -1,17 +1,28 @@
 # src/opentelemetry_config.py
+import sys
 
 from loguru import logger
-from opentelemetry import trace
+from opentelemetry import metrics, trace
 from opentelemetry.exporter.prometheus import PrometheusMetricsExporter
 from opentelemetry.instrumentation.pika import PikaInstrumentor
 from opentelemetry.sdk.metrics import MeterProvider
 from opentelemetry.sdk.metrics.export import MetricsExportSpanProcessor
 
+from config_utils import get_env_variable, parse_bool
+from structured_logging import RateLimitFilter
+from tracing import configure_tracer_provider
+
 # Constants for the logger
 LOG_FILE = "logs/app.log"
 LOG_ROTATION = "1 MB"
 LOG_LEVEL = "INFO"
 LOG_FORMAT = "{time} - {level} - {message}"
+# Write log records from a background thread instead of the worker thread
+LOG_ENQUEUE = get_env_variable("LOG_ENQUEUE", "true", parse_bool)
+# Write the log file as JSON records including the bound fields
+LOG_SERIALIZE = get_env_variable("LOG_SERIALIZE", "false", parse_bool)
+# Records allowed per call site and level each minute (0 disables the limit)
+LOG_RATE_LIMIT_PER_MINUTE = get_env_variable("LOG_RATE_LIMIT_PER_MINUTE", 120, int)
 RETRY_INTERVAL = 5
 
 
@@ -19,13 +30,16 @@ def configure_opentelemetry():
     # Configure logging
     setup_logging()
 
-    # Configure OpenTelemetry with Prometheus exporter
-    trace.set_tracer_provider(trace.TracerProvider())
+    # Configure OpenTelemetry with tail-sampled trace export
+    configure_tracer_provider()
 
+    # Configure OpenTelemetry with Prometheus exporter
     metrics_exporter = PrometheusMetricsExporter(endpoint=":9464/metrics")
 
     meter_provider = MeterProvider()
     meter_provider.add_exporter(metrics_exporter)
+    # Make the provider available to metrics.get_meter() in other modules
+    metrics.set_meter_provider(meter_provider)
 
     trace.get_tracer_provider().add_span_processor(
         MetricsExportSpanProcessor(meter_provider)
@@ -100,5 +114,30 @@ def configure_opentelemetry():
 
 
 # Logging
+def format_record(record):
+    """
+    Loguru format function appending the bound fields to LOG_FORMAT.
+    """
+    if record["extra"]:
+        return LOG_FORMAT + " | {extra}\n{exception}"
+    return LOG_FORMAT + "\n{exception}"
+
+
 def setup_logging():
-    logger.add(LOG_FILE, rotation=LOG_ROTATION, level=LOG_LEVEL, format=LOG_FORMAT)
+    logger.remove()
+    logger.add(
+        sys.stderr,
+        level=LOG_LEVEL,
+        format=format_record,
+        enqueue=LOG_ENQUEUE,
+        filter=RateLimitFilter(LOG_RATE_LIMIT_PER_MINUTE),
+    )
+    logger.add(
+        LOG_FILE,
+        rotation=LOG_ROTATION,
+        level=LOG_LEVEL,
+        format=format_record,
+        serialize=LOG_SERIALIZE,
+        enqueue=LOG_ENQUEUE,
+        filter=RateLimitFilter(LOG_RATE_LIMIT_PER_MINUTE),
+    )
@@ -0,0 +1,420 @@
+# src/perceptual_hash.py
+"""
+Perceptual Hashing Module
+
+Computes 64-bit perceptual hashes (aHash, dHash, pHash) of images with NumPy
+on a reduced-size decode, and keeps them in a persistent near-duplicate index
+so that re-encoded or resized copies of an image can be found.
+
+JPEG files are decoded at a reduced DCT scale (Image.draft), so they are
+never decoded at full resolution. Pillow has no reduced decode for the other
+formats (PNG, WebP, GIF, ...): they are decoded in full once and shrunk with
+Image.reduce before the small grayscale thumbnails used by the hashes are
+made. Hashes of many images are computed together on stacked arrays.
+
+The index uses multi-index hashing in SQLite: each hash is split into four
+16-bit chunks, each stored in an indexed column. Two hashes within Hamming
+distance r agree within r // 4 bits on at least one chunk, so a query only
+visits the rows whose chunks are close to the query chunks and stays
+sub-linear in the number of indexed images.
+"""
+import argparse
+import itertools
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+import numpy as np
+from PIL import Image
+
+from config_utils import get_env_variable, parse_bool
+
+# Compute perceptual hashes in extract_image_metadata()
+PERCEPTUAL_HASH = get_env_variable("PERCEPTUAL_HASH", "false", parse_bool)
+# SQLite file of the near-duplicate index (no index when empty)
+PERCEPTUAL_HASH_INDEX = get_env_variable("PERCEPTUAL_HASH_INDEX", "")
+# Hash used by the index ('phash', 'dhash' or 'ahash')
+PERCEPTUAL_HASH_INDEX_HASH = get_env_variable("PERCEPTUAL_HASH_INDEX_HASH", "phash")
+# Images within this Hamming distance are near duplicates
+PERCEPTUAL_HASH_MAX_DISTANCE = get_env_variable("PERCEPTUAL_HASH_MAX_DISTANCE", 8, int)
+
+HASH_NAMES = ("ahash", "dhash", "phash")
+HASH_BITS = 64
+# Side of the grayscale thumbnail the DCT of the pHash is computed on
+PHASH_SIZE = 32
+# Number of chunks of a hash in the index
+INDEX_CHUNKS = 4
+CHUNK_BITS = HASH_BITS // INDEX_CHUNKS
+
+
+def _dct_matrix(size):
+    # Orthonormal DCT-II matrix: the 2-D DCT of X is D @ X @ D.T
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.sqrt(2 / size) * np.cos(np.pi * (2 * n + 1) * k / (2 * size))
+    matrix[0] /= np.sqrt(2)
+    return matrix.astype(np.float32)
+
+
+_DCT = _dct_matrix(PHASH_SIZE)
+
+
+def reduced_grayscale(image, size=PHASH_SIZE):
+    """
+    Decode an image at the smallest resolution usable for hashing.
+
+    Only JPEG images are decoded at a reduced scale; other formats are
+    decoded at full resolution first and then reduced.
+
+    Parameters:
+    - image (PIL.Image.Image): An opened, not yet loaded image.
+    - size (int): Smallest side needed.
+
+    Returns:
+    - PIL.Image.Image: A grayscale image at least size pixels on each side.
+    """
+    # JPEG: let the decoder scale down by up to 8 in the DCT domain (draft()
+    # does nothing for other formats)
+    image.draft("L", (size * 2, size * 2))
+    factor = min(image.width, image.height) // (size * 2)
+    if factor > 1:
+        image = image.reduce(factor)
+    return image.convert("L")
+
+
+def _thumbnails(image):
+    image = reduced_grayscale(image)
+    return (
+        np.asarray(image.resize((8, 8), Image.BOX), dtype=np.float32),
+        np.asarray(image.resize((9, 8), Image.BOX), dtype=np.float32),
+        np.asarray(image.resize((PHASH_SIZE, PHASH_SIZE), Image.BOX), dtype=np.float32),
+    )
+
+
+def _pack(bits):
+    # (n, 64) booleans -> n unsigned 64-bit integers, most significant bit first
+    return np.packbits(bits.reshape(len(bits), HASH_BITS), axis=1).view(">u8")[:, 0]
+
+
+def hash_arrays(small, wide, large):
+    """
+    Compute the hashes of stacked grayscale thumbnails.
+
+    Parameters:
+    - small (ndarray): (n, 8, 8) thumbnails for the aHash.
+    - wide (ndarray): (n, 8, 9) thumbnails for the dHash.
+    - large (ndarray): (n, 32, 32) thumbnails for the pHash.
+
+    Returns:
+    - dict: 'ahash', 'dhash' and 'phash' arrays of n unsigned 64-bit integers.
+    """
+    ahash = small > small.mean(axis=(1, 2), keepdims=True)
+    dhash = wide[:, :, 1:] > wide[:, :, :-1]
+    # Low frequencies of the DCT, compared to their median without the DC term
+    low = (_DCT @ large @ _DCT.T)[:, :8, :8].reshape(len(large), HASH_BITS)
+    median = np.median(low[:, 1:], axis=1, keepdims=True)
+    phash = low > median
+    return {"ahash": _pack(ahash), "dhash": _pack(dhash), "phash": _pack(phash)}
+
+
+def to_hex(value):
+    return f"{int(value):016x}"
+
+
+def compute_hashes(image):
+    """
+    Compute the perceptual hashes of an image.
+
+    The image is decoded at reduced size, so call this after reading
+    anything that needs the full-size image (e.g. its dimensions).
+
+    Parameters:
+    - image (PIL.Image.Image): An opened, not yet loaded image.
+
+    Returns:
+    - dict: The hashes as 16-digit hexadecimal strings.
+    """
+    return hash_images([image])[0]
+
+
+def hash_images(images):
+    """
+    Compute the perceptual hashes of many images at once.
+
+    Parameters:
+    - images (list): PIL images, or paths or file objects to open.
+
+    Returns:
+    - list: A dict of hexadecimal hashes per image, or None for images that
+      could not be decoded.
+    """
+    thumbnails = []
+    decoded = []
+    for position, source in enumerate(images):
+        try:
+            if isinstance(source, Image.Image):
+                thumbnails.append(_thumbnails(source))
+            else:
+                with Image.open(source) as image:
+                    thumbnails.append(_thumbnails(image))
+            decoded.append(position)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            continue
+
+    results = [None] * len(images)
+    if not thumbnails:
+        return results
+    hashes = hash_arrays(*(np.stack(arrays) for arrays in zip(*thumbnails)))
+    for row, position in enumerate(decoded):
+        results[position] = {name: to_hex(hashes[name][row]) for name in HASH_NAMES}
+    return results
+
+
+def hamming_distance(first, second):
+    """
+    Get the number of differing bits of two hashes.
+
+    Parameters:
+    - first (str or int): A hash (hexadecimal string or integer).
+    - second (str or int): Another hash.
+
+    Returns:
+    - int: The Hamming distance.
+    """
+    if isinstance(first, str):
+        first = int(first, 16)
+    if isinstance(second, str):
+        second = int(second, 16)
+    return bin(first ^ second).count("1")
+
+
+def _chunks(value):
+    mask = (1 << CHUNK_BITS) - 1
+    return [
+        (value >> (CHUNK_BITS * (INDEX_CHUNKS - 1 - position))) & mask
+        for position in range(INDEX_CHUNKS)
+    ]
+
+
+def _signed(value):
+    # SQLite integers are signed 64-bit
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def _neighbors(value, radius):
+    # All chunk values within the given Hamming distance of value
+    values = [value]
+    for distance in range(1, radius + 1):
+        for bits in itertools.combinations(range(CHUNK_BITS), distance):
+            flipped = value
+            for bit in bits:
+                flipped ^= 1 << bit
+            values.append(flipped)
+    return values
+
+
+class NearDuplicateIndex:
+    """
+    Persistent index of perceptual hashes answering "similar to" queries.
+    """
+
+    def __init__(self, path):
+        """
+        Open (or create) a NearDuplicateIndex.
+
+        Parameters:
+        - path (str): The SQLite file, or ':memory:'.
+        """
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        chunk_columns = ", ".join(
+            f"c{position} INTEGER" for position in range(INDEX_CHUNKS)
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS hashes "
+            f"(key TEXT PRIMARY KEY, hash INTEGER NOT NULL, {chunk_columns})"
+        )
+        for position in range(INDEX_CHUNKS):
+            self._connection.execute(
+                f"CREATE INDEX IF NOT EXISTS hashes_c{position} "
+                f"ON hashes (c{position})"
+            )
+        self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+
+    def add_many(self, items):
+        """
+        Add or replace the hashes of several images.
+
+        Parameters:
+        - items (iterable): (key, hash) pairs, hashes as hexadecimal strings.
+        """
+        rows = []
+        for key, value in items:
+            value = int(value, 16)
+            rows.append((key, _signed(value), *_chunks(value)))
+        with self._lock:
+            placeholders = ", ".join("?" * (2 + INDEX_CHUNKS))
+            self._connection.executemany(
+                f"INSERT OR REPLACE INTO hashes VALUES ({placeholders})", rows
+            )
+            self._connection.commit()
+
+    def add(self, key, value):
+        """
+        Add or replace the hash of an image.
+
+        Parameters:
+        - key (str): The object key.
+        - value (str): The hash as a hexadecimal string.
+        """
+        self.add_many([(key, value)])
+
+    def remove(self, key):
+        with self._lock:
+            self._connection.execute("DELETE FROM hashes WHERE key = ?", (key,))
+            self._connection.commit()
+
+    def get(self, key):
+        """
+        Get the indexed hash of an image.
+
+        Returns:
+        - str or None: The hash, or None if the key is not indexed.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT hash FROM hashes WHERE key = ?", (key,)
+            ).fetchone()
+        return to_hex(row[0] & ((1 << HASH_BITS) - 1)) if row else None
+
+    def query(self, value, max_distance=PERCEPTUAL_HASH_MAX_DISTANCE, limit=None):
+        """
+        Find the images whose hash is within max_distance of a hash.
+
+        Parameters:
+        - value (str): The hash as a hexadecimal string.
+        - max_distance (int): Largest Hamming distance returned.
+        - limit (int): Maximum number of results.
+
+        Returns:
+        - list: (key, distance) pairs, closest first.
+        """
+        value = int(value, 16)
+        radius = max_distance // INDEX_CHUNKS
+        candidates = {}
+        with self._lock:
+            for position, chunk in enumerate(_chunks(value)):
+                neighbors = _neighbors(chunk, radius)
+                placeholders = ", ".join("?" * len(neighbors))
+                for key, stored in self._connection.execute(
+                    f"SELECT key, hash FROM hashes "
+                    f"WHERE c{position} IN ({placeholders})",
+                    neighbors,
+                ):
+                    candidates[key] = stored & ((1 << HASH_BITS) - 1)
+
+        matches = sorted(
+            (distance, key)
+            for key, stored in candidates.items()
+            if (distance := hamming_distance(value, stored)) <= max_distance
+        )
+        return [(key, distance) for distance, key in matches[:limit]]
+
+    def similar_to(self, key, max_distance=PERCEPTUAL_HASH_MAX_DISTANCE, limit=None):
+        """
+        Find the images similar to an indexed image.
+
+        Returns:
+        - list: (key, distance) pairs, closest first, without the image itself.
+        """
+        value = self.get(key)
+        if value is None:
+            return []
+        return [
+            match
+            for match in self.query(value, max_distance, limit and limit + 1)
+            if match[0] != key
+        ][:limit]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_near_duplicate_index():
+    """
+    Get the process-wide near-duplicate index.
+
+    Returns:
+    - NearDuplicateIndex or None: The index, or None when not configured.
+    """
+    global _index
+    if not PERCEPTUAL_HASH_INDEX:
+        return None
+    with _index_lock:
+        if _index is None:
+            _index = NearDuplicateIndex(PERCEPTUAL_HASH_INDEX)
+        return _index
+
+
+def main():
+    """
+    Hash local images into an index, or query it.
+
+    Usage:
+    python perceptual_hash.py add <index> <image>...
+    python perceptual_hash.py query <index> <image or hash> [--max-distance N]
+    """
+    parser = argparse.ArgumentParser(description="Perceptual hash index")
+    parser.add_argument("command", choices=["add", "query"])
+    parser.add_argument("index", help="SQLite file of the index")
+    parser.add_argument("images", nargs="+", help="Image files (or hashes)")
+    parser.add_argument(
+        "--max-distance", type=int, default=PERCEPTUAL_HASH_MAX_DISTANCE
+    )
+    parser.add_argument("--batch-size", type=int, default=256)
+    args = parser.parse_args()
+
+    index = NearDuplicateIndex(args.index)
+    try:
+        if args.command == "add":
+            for start in range(0, len(args.images), args.batch_size):
+                paths = args.images[start : start + args.batch_size]
+                index.add_many(
+                    (path, hashes[PERCEPTUAL_HASH_INDEX_HASH])
+                    for path, hashes in zip(paths, hash_images(paths))
+                    if hashes is not None
+                )
+            print(f"{len(index)} images indexed", file=sys.stderr)
+            return
+
+        for image in args.images:
+            if os.path.exists(image):
+                hashes = hash_images([image])[0]
+                if hashes is None:
+                    print(f"Cannot decode '{image}'", file=sys.stderr)
+                    continue
+                value = hashes[PERCEPTUAL_HASH_INDEX_HASH]
+            else:
+                value = image
+            matches = index.query(value, args.max_distance)
+            print(json.dumps({"query": image, "hash": value, "matches": matches}))
+    finally:
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,411 @@
+# src/profiling.py
+"""
+Profiling Module
+
+Opt-in profiling for object inspections. A low-overhead stack sampler records
+where each inspection spends its time, cProfile is enabled for a sampled
+fraction of jobs, and any inspection slower than a threshold is captured to a
+local directory together with its stage breakdown.
+
+Run as a script to aggregate the captured profiles into a hot-function report:
+
+    python profiling.py --dir profiles --top 20
+"""
+import argparse
+import contextvars
+import cProfile
+import glob
+import json
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from loguru import logger
+
+from config_utils import get_env_variable, parse_bool
+
+PROFILE_ENABLED = get_env_variable("PROFILE_ENABLED", "false", parse_bool)
+PROFILE_SAMPLE_RATE = get_env_variable("PROFILE_SAMPLE_RATE", 0.0, float)
+PROFILE_SLOW_THRESHOLD_MS = get_env_variable("PROFILE_SLOW_THRESHOLD_MS", 5000, float)
+PROFILE_STACK_INTERVAL_MS = get_env_variable("PROFILE_STACK_INTERVAL_MS", 10, float)
+PROFILE_OUTPUT_DIR = get_env_variable("PROFILE_OUTPUT_DIR", "profiles")
+
+# Number of distinct stacks kept in a capture file
+MAX_CAPTURED_STACKS = 200
+
+_current_profile = contextvars.ContextVar("inspection_profile", default=None)
+
+# cProfile can only profile one job at a time reliably (a single profiling
+# hook per interpreter on newer Python versions)
+_cprofile_lock = threading.Lock()
+
+
+class StackSampler:
+    """
+    Background thread that periodically samples the stacks of the threads
+    running a profiled inspection.
+    """
+
+    def __init__(self, interval_ms=PROFILE_STACK_INTERVAL_MS):
+        """
+        Create a StackSampler instance.
+
+        Parameters:
+        - interval_ms (float): Time between two samples in milliseconds.
+        """
+        self.interval = interval_ms / 1000.0
+        self._targets = {}
+        # Notified when a target is registered, so that the thread can wait
+        # instead of polling while no inspection is profiled
+        self._lock = threading.Condition()
+        self._thread = None
+
+    def register(self, thread_id, profile):
+        """
+        Start sampling a thread on behalf of a profile.
+
+        Parameters:
+        - thread_id (int): Identifier of the thread to sample.
+        - profile (InspectionProfile): The profile receiving the samples.
+        """
+        with self._lock:
+            self._targets[thread_id] = profile
+            self._lock.notify()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="stack-sampler", daemon=True
+                )
+                self._thread.start()
+
+    def unregister(self, thread_id):
+        """
+        Stop sampling a thread.
+
+        Parameters:
+        - thread_id (int): Identifier of the thread to stop sampling.
+        """
+        with self._lock:
+            self._targets.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                # Park until an inspection is profiled
+                self._lock.wait_for(lambda: self._targets)
+                targets = dict(self._targets)
+
+            frames = sys._current_frames()
+            for thread_id, profile in targets.items():
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    profile.stack_samples[collapse_stack(frame)] += 1
+
+
+_sampler = StackSampler()
+
+
+def collapse_stack(frame):
+    """
+    Collapse a frame and its callers into a single 'root;...;leaf' string.
+
+    Parameters:
+    - frame: The innermost frame of the stack.
+
+    Returns:
+    - str: The collapsed stack.
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        location = f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}"
+        names.append(f"{code.co_name} ({location})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class InspectionProfile:
+    """
+    Profiling state for a single object inspection.
+    """
+
+    def __init__(self, key, use_cprofile=False):
+        """
+        Create an InspectionProfile instance.
+
+        Parameters:
+        - key (str): The key of the inspected object.
+        - use_cprofile (bool): Whether to run cProfile for this inspection.
+        """
+        self.key = key
+        self.size = None
+        self.file_type = None
+        self.stages = []
+        self.stack_samples = Counter()
+        self.profiler = cProfile.Profile() if use_cprofile else None
+        self.started_at = None
+        self.duration_ms = None
+        self._thread_id = None
+
+    def start(self):
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._thread_id = threading.get_ident()
+        _sampler.register(self._thread_id, self)
+        if self.profiler is not None:
+            self.profiler.enable()
+
+    def stop(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+        _sampler.unregister(self._thread_id)
+        self.duration_ms = (time.perf_counter() - self._start) * 1000
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a stage of the inspection.
+
+        Parameters:
+        - name (str): The name of the stage (e.g. 'fetch', 'sniff', 'extract').
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append(
+                {"stage": name, "duration_ms": (time.perf_counter() - start) * 1000}
+            )
+
+    def annotate(self, **fields):
+        """
+        Record object details such as size and file type.
+        """
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    def to_dict(self, reason):
+        return {
+            "key": self.key,
+            "size": self.size,
+            "file_type": self.file_type,
+            "reason": reason,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "stages": self.stages,
+            "stack_samples": dict(self.stack_samples.most_common(MAX_CAPTURED_STACKS)),
+        }
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a stage of the inspection running in the current context.
+
+    Does nothing when no inspection is being profiled.
+
+    Parameters:
+    - name (str): The name of the stage.
+    """
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    with profile.stage(name):
+        yield
+
+
+def annotate(**fields):
+    """
+    Record object details on the inspection running in the current context.
+    """
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.annotate(**fields)
+
+
+@contextmanager
+def profile_inspection(key):
+    """
+    Profile an inspection when profiling is enabled.
+
+    The stack sampler always runs for the duration of the inspection; cProfile
+    is enabled for a PROFILE_SAMPLE_RATE fraction of jobs. A capture is written
+    when the job was sampled or took longer than PROFILE_SLOW_THRESHOLD_MS.
+
+    Parameters:
+    - key (str): The key of the inspected object.
+
+    Yields:
+    - InspectionProfile or None: The active profile, or None when disabled.
+    """
+    if not PROFILE_ENABLED:
+        yield None
+        return
+
+    use_cprofile = random.random() < PROFILE_SAMPLE_RATE and _cprofile_lock.acquire(
+        blocking=False
+    )
+    profile = InspectionProfile(key, use_cprofile=use_cprofile)
+    token = _current_profile.set(profile)
+    profile.start()
+    try:
+        yield profile
+    finally:
+        profile.stop()
+        _current_profile.reset(token)
+        if use_cprofile:
+            _cprofile_lock.release()
+
+        if profile.duration_ms >= PROFILE_SLOW_THRESHOLD_MS:
+            write_capture(profile, "slow")
+        elif use_cprofile:
+            write_capture(profile, "sampled")
+
+
+def write_capture(profile, reason, output_dir=None):
+    """
+    Write a profile capture to the output directory.
+
+    Parameters:
+    - profile (InspectionProfile): The profile to write.
+    - reason (str): Why the profile was captured ('slow' or 'sampled').
+    - output_dir (str): Directory for captures, defaults to PROFILE_OUTPUT_DIR.
+
+    Returns:
+    - str or None: The path of the JSON capture, or None on failure.
+    """
+    output_dir = output_dir or PROFILE_OUTPUT_DIR
+    safe_key = re.sub(r"[^A-Za-z0-9._-]", "_", profile.key)[:100]
+    base_path = os.path.join(
+        output_dir, f"{int(profile.started_at * 1000)}-{reason}-{safe_key}"
+    )
+
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+        with open(f"{base_path}.json", "w") as capture_file:
+            json.dump(profile.to_dict(reason), capture_file)
+        if profile.profiler is not None:
+            profile.profiler.dump_stats(f"{base_path}.prof")
+    except OSError as e:
+        logger.error(f"Failed to write profile capture for '{profile.key}': {e}")
+        return None
+
+    logger.info(
+        f"Captured {reason} inspection profile for '{profile.key}' "
+        f"({profile.duration_ms:.0f} ms) to {base_path}.json"
+    )
+    return f"{base_path}.json"
+
+
+def build_report(output_dir, top=20):
+    """
+    Aggregate the captured profiles in a directory into a hot-function report.
+
+    Parameters:
+    - output_dir (str): Directory containing the captures.
+    - top (int): Number of functions to list.
+
+    Returns:
+    - str: The report.
+    """
+    captures = []
+    for path in sorted(glob.glob(os.path.join(output_dir, "*.json"))):
+        try:
+            with open(path) as capture_file:
+                captures.append(json.load(capture_file))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping unreadable capture '{path}': {e}")
+
+    lines = [f"{len(captures)} captures in {output_dir}", ""]
+    if not captures:
+        return "\n".join(lines)
+
+    # Stage breakdown
+    stage_totals = Counter()
+    stage_counts = Counter()
+    for capture in captures:
+        for entry in capture.get("stages", []):
+            stage_totals[entry["stage"]] += entry["duration_ms"]
+            stage_counts[entry["stage"]] += 1
+    lines.append("Stages (total ms / mean ms):")
+    for name, total in stage_totals.most_common():
+        mean = total / stage_counts[name]
+        lines.append(f"  {name:<20} {total:>12.1f} {mean:>10.1f}")
+    lines.append("")
+
+    # Sampled stacks: self samples are attributed to the leaf frame, inclusive
+    # samples to every distinct frame in the stack
+    self_samples = Counter()
+    inclusive_samples = Counter()
+    total_samples = 0
+    for capture in captures:
+        for stack, count in capture.get("stack_samples", {}).items():
+            frames = stack.split(";")
+            self_samples[frames[-1]] += count
+            for frame in set(frames):
+                inclusive_samples[frame] += count
+            total_samples += count
+
+    if total_samples:
+        lines.append(
+            f"Top {top} functions by sampled self time ({total_samples} samples):"
+        )
+        for frame, count in self_samples.most_common(top):
+            lines.append(f"  {100.0 * count / total_samples:6.2f}%  {frame}")
+        lines.append("")
+        lines.append(f"Top {top} functions by sampled inclusive time:")
+        for frame, count in inclusive_samples.most_common(top):
+            lines.append(f"  {100.0 * count / total_samples:6.2f}%  {frame}")
+        lines.append("")
+
+    prof_paths = sorted(glob.glob(os.path.join(output_dir, "*.prof")))
+    if prof_paths:
+        stats = pstats.Stats(*prof_paths)
+        rows = []
+        for function, timings in stats.stats.items():
+            filename, line, name = function
+            _, ncalls, tottime, cumtime, _ = timings
+            location = f"{os.path.basename(filename)}:{line}"
+            rows.append((tottime, cumtime, ncalls, f"{name} ({location})"))
+        rows.sort(reverse=True)
+        lines.append(
+            f"Top {top} functions by cProfile self time "
+            f"({len(prof_paths)} profiles):"
+        )
+        lines.append(f"  {'tottime':>10} {'cumtime':>10} {'calls':>10}  function")
+        for tottime, cumtime, ncalls, function in rows[:top]:
+            lines.append(
+                f"  {tottime:>10.4f} {cumtime:>10.4f} {ncalls:>10}  {function}"
+            )
+
+    return "\n".join(lines)
+
+
+def main():
+    """
+    Print a hot-function report for the captured inspection profiles.
+
+    Usage:
+    python profiling.py [--dir <output_dir>] [--top <n>]
+    """
+    parser = argparse.ArgumentParser(description="Inspection Profile Report")
+    parser.add_argument(
+        "--dir", default=PROFILE_OUTPUT_DIR, help="Directory containing captures"
+    )
+    parser.add_argument(
+        "--top", type=int, default=20, help="Number of functions to list"
+    )
+    args = parser.parse_args()
+
+    print(build_report(args.dir, args.top))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
 # src/publish_test_message.py
 import os
 import random
+import time
 import uuid
 
 import pika
+from opentelemetry import trace
 
 # RabbitMQ connection parameters
 from rabbitmq_config import (
@@ -14,6 +16,7 @@ from rabbitmq_config import (
     RABBITMQ_ROUTING_KEY,
     RABBITMQ_USER,
 )
+from tracing import configure_tracer_provider, inject_headers
 
 # List of possible file extensions
 FILE_EXTENSIONS = [".jpeg", ".jpg", ".ogg", ".mp4", ".mp3", ".wav", ".txt", ".pdf"]
@@ -39,14 +42,24 @@ channel.exchange_declare(exchange=RABBITMQ_EXCHANGE_NAME, exchange_type="fanout"
 # Get the queue name from the environment variable
 queue_name = os.environ.get("RABBITMQ_QUEUE_NAME", "uploads")
 
-# Publish the test message to the exchange with the specified routing key
-channel.basic_publish(
-    exchange=RABBITMQ_EXCHANGE_NAME,
-    routing_key=RABBITMQ_ROUTING_KEY,
-    body=random_file_name,
-)
+# Publish the test message to the exchange with the specified routing key,
+# carrying the trace context in the message headers
+configure_tracer_provider()
+with trace.get_tracer(__name__).start_as_current_span(
+    "publish_upload_event", kind=trace.SpanKind.PRODUCER
+):
+    channel.basic_publish(
+        exchange=RABBITMQ_EXCHANGE_NAME,
+        routing_key=RABBITMQ_ROUTING_KEY,
+        body=random_file_name,
+        # The timestamp lets the consumer measure how long messages wait
+        properties=pika.BasicProperties(
+            headers=inject_headers(), timestamp=int(time.time())
+        ),
+    )
 
-# Close the connection
+# Close the connection and flush any sampled spans
 connection.close()
+trace.get_tracer_provider().shutdown()
 
 print(f"Test message '{random_file_name}' published to RabbitMQ queue '{queue_name}'.")
@@ -0,0 +1,340 @@
+# src/result_writer.py
+"""
+Result Write-Back Module
+
+Writes a compact summary of each inspection (type, hashes, dimensions, duration)
+back to MinIO so that consumers can read it without inspecting the object
+again. Summaries are stored either as object tags or in sidecar index objects
+(JSON lines), are written in batches with several requests in flight over the
+shared connection pool, and are skipped when the same ETag was already
+written. Summaries of objects with too many tags of their own to fit the
+required fields go to the index. Object content is never uploaded again.
+"""
+import hashlib
+import io
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+from minio.commonconfig import Tags
+
+from config_utils import get_env_variable
+
+# 'off', 'tags' (object tags) or 'index' (sidecar index objects)
+RESULT_WRITEBACK_MODE = get_env_variable("RESULT_WRITEBACK_MODE", "off")
+RESULT_WRITEBACK_BATCH_SIZE = get_env_variable("RESULT_WRITEBACK_BATCH_SIZE", 50, int)
+RESULT_WRITEBACK_FLUSH_INTERVAL = get_env_variable(
+    "RESULT_WRITEBACK_FLUSH_INTERVAL", 2.0, float
+)
+RESULT_WRITEBACK_CONCURRENCY = get_env_variable("RESULT_WRITEBACK_CONCURRENCY", 8, int)
+RESULT_INDEX_BUCKET = get_env_variable("RESULT_INDEX_BUCKET", "inspector-index")
+RESULT_INDEX_PREFIX = get_env_variable("RESULT_INDEX_PREFIX", "results")
+
+# Prefix of the tags owned by the inspector; other tags are preserved
+TAG_PREFIX = "inspector-"
+# Maximum number of tags S3 and MinIO allow on an object
+MAX_OBJECT_TAGS = 10
+# Summary fields that must fit in the tags; otherwise the summary is written
+# to the index instead
+REQUIRED_TAG_FIELDS = ("type", "etag")
+# Number of (key, ETag) pairs remembered to skip repeated writes
+WRITTEN_CACHE_SIZE = 100000
+
+# Characters S3 allows in tag values
+_TAG_VALUE_INVALID = re.compile(r"[^A-Za-z0-9 +\-=._:/@]")
+
+
+def _tag_value(value):
+    return _TAG_VALUE_INVALID.sub("_", str(value))[:256]
+
+
+def build_summary(metadata, etag=None, duration_ms=None):
+    """
+    Build the compact summary written back for an inspection result.
+
+    The fields are ordered by importance, so that they can be trimmed from
+    the end when an object has no room for all of them as tags.
+
+    Parameters:
+    - metadata (dict): The inspection result.
+    - etag (str): ETag of the inspected object version.
+    - duration_ms (float): Time the inspection took.
+
+    Returns:
+    - dict: Summary fields (without the tag prefix).
+    """
+    summary = {
+        "type": metadata.get("file_type"),
+        "etag": etag.strip('"') if etag else None,
+    }
+    if metadata.get("content_hash"):
+        summary["sha256"] = metadata["content_hash"]
+    if metadata.get("image_width") and metadata.get("image_height"):
+        summary["dimensions"] = (
+            f"{metadata['image_width']}x{metadata['image_height']}"
+        )
+    elif metadata.get("resolution"):
+        summary["dimensions"] = "x".join(
+            str(value) for value in metadata["resolution"]
+        )
+    if metadata.get("perceptual_hashes"):
+        summary["phash"] = metadata["perceptual_hashes"]["phash"]
+    if metadata.get("duration") is not None:
+        summary["duration"] = round(float(metadata["duration"]), 3)
+    if metadata.get("page_count") is not None:
+        summary["pages"] = metadata["page_count"]
+    if duration_ms is not None:
+        summary["inspect-ms"] = int(duration_ms)
+    return {key: value for key, value in summary.items() if value is not None}
+
+
+class ResultWriter:
+    """
+    Batches inspection summaries and writes them back to MinIO.
+    """
+
+    def __init__(
+        self,
+        minio_client,
+        mode=RESULT_WRITEBACK_MODE,
+        batch_size=RESULT_WRITEBACK_BATCH_SIZE,
+        flush_interval=RESULT_WRITEBACK_FLUSH_INTERVAL,
+        concurrency=RESULT_WRITEBACK_CONCURRENCY,
+    ):
+        """
+        Create a ResultWriter instance.
+
+        Parameters:
+        - minio_client (Minio): The (shared) Minio client.
+        - mode (str): 'tags' or 'index'.
+        - batch_size (int): Number of summaries written per batch.
+        - flush_interval (float): Seconds after which a partial batch is written.
+        - concurrency (int): Number of requests in flight while writing tags.
+        """
+        if mode not in ("tags", "index"):
+            raise ValueError(f"Unsupported write-back mode: {mode}")
+        self.minio_client = minio_client
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._written = OrderedDict()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="result-writer"
+        )
+        self._index_bucket_ready = False
+        self._thread = threading.Thread(
+            target=self._run, name="result-writer", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, key, etag, metadata, duration_ms=None):
+        """
+        Queue the summary of an inspection for writing.
+
+        Only complete deep inspections are written back: summaries are skipped
+        per ETag, so a shallower or partial one would never be replaced.
+
+        Parameters:
+        - key (str): The object key ('bucket_name/object_name').
+        - etag (str): ETag of the inspected object version.
+        - metadata (dict): The inspection result.
+        - duration_ms (float): Time the inspection took.
+        """
+        inspection = metadata.get("inspection") or {}
+        if inspection.get("depth", "deep") != "deep" or inspection.get("partial"):
+            return
+        with self._condition:
+            if self._written.get(key) == etag:
+                return
+            self._pending.append(
+                (key, etag, build_summary(metadata, etag, duration_ms))
+            )
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify()
+
+    def flush(self):
+        """
+        Write all queued summaries now.
+        """
+        with self._condition:
+            batch, self._pending = self._pending, []
+        if batch:
+            self._write_batch(batch)
+
+    def close(self):
+        """
+        Write the remaining summaries and stop the writer.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        self.flush()
+        self._executor.shutdown()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._closed or len(self._pending) >= self.batch_size,
+                    timeout=self.flush_interval,
+                )
+                if self._closed:
+                    return
+                batch, self._pending = self._pending, []
+            if batch:
+                self._write_batch(batch)
+
+    def _remember(self, key, etag):
+        with self._condition:
+            self._written[key] = etag
+            self._written.move_to_end(key)
+            if len(self._written) > WRITTEN_CACHE_SIZE:
+                self._written.popitem(last=False)
+
+    def _write_batch(self, batch):
+        # Keep only the latest summary per key
+        latest = {}
+        for key, etag, summary in batch:
+            latest[key] = (etag, summary)
+
+        try:
+            if self.mode == "tags":
+                futures = {
+                    key: self._executor.submit(self._write_tags, key, etag, summary)
+                    for key, (etag, summary) in latest.items()
+                }
+                # Summaries of objects with too many tags of their own
+                overflow = {}
+                for key, future in futures.items():
+                    try:
+                        if future.result():
+                            self._remember(key, latest[key][0])
+                        else:
+                            overflow[key] = latest[key]
+                    except Exception as e:
+                        # One object failing does not hold back the others
+                        logger.bind(object_key=key).error(
+                            f"Failed to write inspection tags: {e}"
+                        )
+                if overflow:
+                    self._write_index(overflow)
+                    for key, (etag, _) in overflow.items():
+                        self._remember(key, etag)
+            else:
+                self._write_index(latest)
+                for key, (etag, _) in latest.items():
+                    self._remember(key, etag)
+        except Exception as e:
+            logger.error(
+                f"Failed to write back {len(latest)} inspection results: {e}"
+            )
+
+    def _write_tags(self, key, etag, summary):
+        """
+        Write a summary as tags, keeping the other tags of the object.
+
+        Summary fields that do not fit in the tag limit are dropped, least
+        important first. Nothing is written when the object was replaced since
+        it was inspected; the inspection of the new object writes its own tags.
+
+        Returns:
+        - bool: False when not even the required fields fit, in which case
+          nothing was written.
+        """
+        bucket_name, object_name = key.split("/", 1)
+        # Tags belong to the current version, so the summary is only written
+        # while that is still the inspected one
+        stat = self.minio_client.stat_object(bucket_name, object_name)
+        if stat.etag != etag:
+            logger.bind(object_key=key).info(
+                "Object changed since it was inspected, not writing its tags"
+            )
+            return True
+        existing = (
+            self.minio_client.get_object_tags(
+                bucket_name, object_name, version_id=stat.version_id
+            )
+            or {}
+        )
+
+        # Tags already written for this ETag are left alone
+        etag_tag = f"{TAG_PREFIX}etag"
+        if "etag" in summary and existing.get(etag_tag) == _tag_value(summary["etag"]):
+            return True
+
+        tags = Tags.new_object_tags()
+        for name, value in existing.items():
+            if not name.startswith(TAG_PREFIX):
+                tags[name] = value
+        available = MAX_OBJECT_TAGS - len(tags)
+        required = [name for name in REQUIRED_TAG_FIELDS if name in summary]
+        if available < len(required):
+            return False
+        if available < len(summary):
+            logger.bind(object_key=key).warning(
+                f"Only {available} of {len(summary)} inspection tags fit next "
+                "to the tags of the object"
+            )
+        for name, value in list(summary.items())[:available]:
+            tags[f"{TAG_PREFIX}{name}"] = _tag_value(value)
+        self.minio_client.set_object_tags(
+            bucket_name, object_name, tags, version_id=stat.version_id
+        )
+        return True
+
+    def _write_index(self, latest):
+        lines = [
+            json.dumps({"key": key, **summary}, sort_keys=True)
+            for key, (_, summary) in sorted(latest.items())
+        ]
+        content = ("\n".join(lines) + "\n").encode("utf-8")
+        # The name is derived from the content, so a retried batch overwrites
+        # the same index object instead of adding a duplicate
+        digest = hashlib.sha256(content).hexdigest()[:16]
+        object_name = (
+            f"{RESULT_INDEX_PREFIX}/{time.strftime('%Y/%m/%d')}/{digest}.jsonl"
+        )
+
+        if not self._index_bucket_ready:
+            if not self.minio_client.bucket_exists(RESULT_INDEX_BUCKET):
+                self.minio_client.make_bucket(RESULT_INDEX_BUCKET)
+            self._index_bucket_ready = True
+
+        self.minio_client.put_object(
+            RESULT_INDEX_BUCKET,
+            object_name,
+            io.BytesIO(content),
+            len(content),
+            content_type="application/x-ndjson",
+        )
+
+
+_result_writer = None
+_result_writer_lock = threading.Lock()
+
+
+def get_result_writer(minio_client):
+    """
+    Get the process-wide result writer.
+
+    Parameters:
+    - minio_client (Minio): The shared Minio client.
+
+    Returns:
+    - ResultWriter or None: The writer, or None when write-back is off.
+    """
+    global _result_writer
+    if RESULT_WRITEBACK_MODE == "off":
+        return None
+    with _result_writer_lock:
+        if _result_writer is None:
+            _result_writer = ResultWriter(minio_client)
+        return _result_writer
@@ -0,0 +1,413 @@
+# src/storage.py
+"""
+Storage Backend Module
+
+Backends giving the inspection pipeline access to object content, either from
+MinIO or from local and NFS-mounted filesystems. The local backend memory-maps
+files so that content is handed to magic, hashing and the parsers without
+being copied into Python bytes.
+"""
+import io
+import mmap
+import os
+from collections import OrderedDict, namedtuple
+from datetime import timedelta
+
+from minio.error import S3Error
+
+from config_utils import get_env_variable
+from latency_stats import MINIO_LATENCY
+
+# Validity of the presigned URLs handed to external tools such as ffmpeg
+PRESIGNED_URL_EXPIRY_SECONDS = get_env_variable(
+    "PRESIGNED_URL_EXPIRY_SECONDS", 900, int
+)
+
+# Metadata of a stored object
+ObjectStat = namedtuple("ObjectStat", ["size", "etag", "last_modified"])
+
+# Errors raised by backends when an object cannot be read
+STORAGE_ERRORS = (S3Error, OSError, ValueError)
+
+
+class StorageBackend:
+    """
+    Base class for the storage backends used by InspectObject.
+
+    Keys are backend specific: 'bucket_name/object_name' for MinIO, a path
+    relative to the root directory for the local filesystem.
+    """
+
+    def stat(self, key):
+        """
+        Get the size and version of an object.
+
+        Parameters:
+        - key (str): The object key.
+
+        Returns:
+        - ObjectStat: The object metadata.
+        """
+        raise NotImplementedError
+
+    def read(self, key):
+        """
+        Read the whole content of an object.
+
+        Parameters:
+        - key (str): The object key.
+
+        Returns:
+        - bytes-like: The content (bytes or a read-only mmap).
+        """
+        raise NotImplementedError
+
+    def read_range(self, key, offset, length):
+        """
+        Read part of an object.
+
+        Parameters:
+        - key (str): The object key.
+        - offset (int): Position of the first byte to read.
+        - length (int): Maximum number of bytes to read.
+
+        Returns:
+        - bytes: The content of the range.
+        """
+        raise NotImplementedError
+
+    def open_stream(self, key):
+        """
+        Open an object for sequential reading.
+
+        Parameters:
+        - key (str): The object key.
+
+        Returns:
+        - A file-like object with read() and close().
+        """
+        raise NotImplementedError
+
+    def local_path(self, key):
+        """
+        Get the path of an object on the local filesystem, if it has one.
+
+        Parameters:
+        - key (str): The object key.
+
+        Returns:
+        - str or None: The path, or None for remote objects.
+        """
+        return None
+
+    def url(self, key):
+        """
+        Get a URL external tools (e.g. ffmpeg) can read the object from with
+        ranged requests, if the backend has one.
+
+        Parameters:
+        - key (str): The object key.
+
+        Returns:
+        - str or None: The URL.
+        """
+        return None
+
+
+class MinioBackend(StorageBackend):
+    """
+    Storage backend reading objects from MinIO.
+
+    The time to the response headers of each request is recorded in a
+    LatencyTracker, independently of the size of the body.
+    """
+
+    def __init__(self, minio_client, latency=MINIO_LATENCY):
+        """
+        Create a MinioBackend instance.
+
+        Parameters:
+        - minio_client (Minio): The MinIO client.
+        - latency (LatencyTracker): Records the request latencies.
+        """
+        self.minio_client = minio_client
+        self.latency = latency
+
+    @staticmethod
+    def split_key(key):
+        bucket_name, object_name = key.split("/", 1)
+        return bucket_name, object_name
+
+    def stat(self, key):
+        with self.latency.measure():
+            stat = self.minio_client.stat_object(*self.split_key(key))
+        return ObjectStat(stat.size, stat.etag, stat.last_modified)
+
+    def read(self, key):
+        with self.latency.measure():
+            response = self.minio_client.get_object(*self.split_key(key))
+        try:
+            return response.read()
+        finally:
+            response.close()
+            response.release_conn()
+
+    def read_range(self, key, offset, length):
+        with self.latency.measure():
+            response = self.minio_client.get_object(
+                *self.split_key(key), offset=offset, length=length
+            )
+        try:
+            return response.read()
+        finally:
+            response.close()
+            response.release_conn()
+
+    def open_stream(self, key):
+        with self.latency.measure():
+            return self.minio_client.get_object(*self.split_key(key))
+
+    def url(self, key):
+        return self.minio_client.presigned_get_object(
+            *self.split_key(key),
+            expires=timedelta(seconds=PRESIGNED_URL_EXPIRY_SECONDS),
+        )
+
+
+class LocalFilesystemBackend(StorageBackend):
+    """
+    Storage backend reading files from a local or NFS-mounted directory.
+    """
+
+    def __init__(self, root="/"):
+        """
+        Create a LocalFilesystemBackend instance.
+
+        Parameters:
+        - root (str): Directory that keys are relative to.
+        """
+        self.root = os.path.realpath(root)
+
+    def local_path(self, key):
+        path = os.path.realpath(os.path.join(self.root, key))
+        if os.path.commonpath([self.root, path]) != self.root:
+            raise ValueError(f"Key '{key}' is outside of '{self.root}'")
+        return path
+
+    def stat(self, key):
+        stat = os.stat(self.local_path(key))
+        return ObjectStat(
+            stat.st_size, f"{stat.st_mtime_ns:x}-{stat.st_size:x}", stat.st_mtime
+        )
+
+    def read(self, key):
+        with open(self.local_path(key), "rb") as local_file:
+            if os.fstat(local_file.fileno()).st_size == 0:
+                # Empty files cannot be memory-mapped
+                return b""
+            return mmap.mmap(local_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read_range(self, key, offset, length):
+        with open(self.local_path(key), "rb") as local_file:
+            return os.pread(local_file.fileno(), length, offset)
+
+    def open_stream(self, key):
+        return open(self.local_path(key), "rb")
+
+
+class MemoryBackend(StorageBackend):
+    """
+    Storage backend serving objects held in memory, such as archive members.
+    """
+
+    def __init__(self, objects):
+        """
+        Create a MemoryBackend instance.
+
+        Parameters:
+        - objects (dict): Object keys mapped to their content.
+        """
+        self.objects = objects
+
+    def stat(self, key):
+        content = self.objects[key]
+        return ObjectStat(len(content), None, None)
+
+    def read(self, key):
+        return self.objects[key]
+
+    def read_range(self, key, offset, length):
+        return bytes(self.objects[key][offset : offset + length])
+
+    def open_stream(self, key):
+        return BufferReader(self.objects[key])
+
+
+class RangedFile(io.RawIOBase):
+    """
+    Seekable, read-only file object over a stored object that fetches only the
+    blocks that are actually read, using ranged reads.
+
+    Parsers that seek around (zipfile, mutagen, PIL) can then be used on large
+    remote objects while transferring only a few blocks.
+    """
+
+    def __init__(
+        self,
+        backend,
+        key,
+        size=None,
+        block_size=64 * 1024,
+        max_blocks=16,
+        head=None,
+    ):
+        """
+        Create a RangedFile instance.
+
+        Parameters:
+        - backend (StorageBackend): The backend holding the object.
+        - key (str): The object key.
+        - size (int): The object size, fetched from the backend when omitted.
+        - block_size (int): Size of the ranged reads in bytes.
+        - max_blocks (int): Number of blocks kept in the cache.
+        - head (bytes): Leading bytes already read, which are not fetched
+          again.
+        """
+        super().__init__()
+        self.backend = backend
+        self.key = key
+        self.size = backend.stat(key).size if size is None else size
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self.bytes_read = 0
+        self._blocks = OrderedDict()
+        self._position = 0
+        if head:
+            # Only whole blocks (or the whole object) are cached
+            for start in range(0, min(len(head), self.size), block_size):
+                end = min(start + block_size, self.size)
+                if end > len(head) or len(self._blocks) >= max_blocks:
+                    break
+                self._blocks[start // block_size] = head[start:end]
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def _block(self, index):
+        block = self._blocks.get(index)
+        if block is None:
+            start = index * self.block_size
+            # The last block is requested up to the end of the object only
+            block = self.backend.read_range(
+                self.key, start, min(self.block_size, max(self.size - start, 0))
+            )
+            self.bytes_read += len(block)
+            self._blocks[index] = block
+            if len(self._blocks) > self.max_blocks:
+                self._blocks.popitem(last=False)
+        else:
+            self._blocks.move_to_end(index)
+        return block
+
+    def readinto(self, b):
+        length = min(len(b), max(self.size - self._position, 0))
+        if length <= 0:
+            return 0
+
+        # Reads larger than the cache go straight to the backend
+        if length > self.block_size * 2:
+            chunk = self.backend.read_range(self.key, self._position, length)
+            self.bytes_read += len(chunk)
+            b[: len(chunk)] = chunk
+            self._position += len(chunk)
+            return len(chunk)
+
+        written = 0
+        while written < length:
+            index, offset = divmod(self._position, self.block_size)
+            chunk = self._block(index)[offset : offset + length - written]
+            if not chunk:
+                break
+            b[written : written + len(chunk)] = chunk
+            written += len(chunk)
+            self._position += len(chunk)
+        return written
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        elif whence == io.SEEK_END:
+            self._position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        self._position = max(self._position, 0)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+
+class BufferReader(io.RawIOBase):
+    """
+    Seekable, read-only file object over a bytes-like buffer (bytes or mmap)
+    that does not copy the buffer and never closes it.
+    """
+
+    def __init__(self, buffer):
+        """
+        Create a BufferReader instance.
+
+        Parameters:
+        - buffer (bytes-like): The buffer to read from.
+        """
+        super().__init__()
+        self._view = memoryview(buffer)
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        chunk = self._view[self._position : self._position + len(b)]
+        b[: len(chunk)] = chunk
+        self._position += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        elif whence == io.SEEK_END:
+            self._position = len(self._view) + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        self._position = max(self._position, 0)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        if not self.closed:
+            self._view.release()
+        super().close()
+
+
+def release_buffer(buffer):
+    """
+    Release a buffer returned by StorageBackend.read().
+
+    Parameters:
+    - buffer: The buffer to release.
+    """
+    if isinstance(buffer, mmap.mmap):
+        buffer.close()
@@ -0,0 +1,135 @@
+# src/structured_logging.py
+"""
+Structured Logging Module
+
+Helpers that keep logging off the inspection hot path: compact, size-capped
+log fields instead of interpolated result payloads, and a rate-limiting sink
+filter for repetitive messages.
+"""
+import threading
+import time
+
+from config_utils import get_env_variable
+
+LOG_FIELD_MAX_LENGTH = get_env_variable("LOG_FIELD_MAX_LENGTH", 256, int)
+
+# Records at this level (WARNING) and above are never rate limited
+WARNING_LEVEL = 30
+
+# Result fields that are never logged
+EXCLUDED_FIELDS = {"content_base64"}
+
+
+def cap_value(value, max_length=LOG_FIELD_MAX_LENGTH):
+    """
+    Reduce a value to something cheap to log.
+
+    Scalars are kept (strings truncated to max_length), containers are
+    replaced by a short description of their size.
+
+    Parameters:
+    - value: The value to reduce.
+    - max_length (int): Maximum length of string values.
+
+    Returns:
+    - A loggable value.
+    """
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, str):
+        if len(value) > max_length:
+            return f"{value[:max_length]}...(+{len(value) - max_length} chars)"
+        return value
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<{len(value)} bytes>"
+    if isinstance(value, dict):
+        return f"<dict of {len(value)} keys>"
+    if isinstance(value, (list, tuple, set)):
+        if len(value) <= 4 and all(isinstance(item, (int, float)) for item in value):
+            return list(value)
+        return f"<{type(value).__name__} of {len(value)} items>"
+    return cap_value(str(value), max_length)
+
+
+def summarize_fields(result, max_length=LOG_FIELD_MAX_LENGTH):
+    """
+    Build size-capped log fields from an inspection result.
+
+    Parameters:
+    - result (dict or None): The inspection result.
+    - max_length (int): Maximum length of string values.
+
+    Returns:
+    - dict: Fields suitable for logger.bind().
+    """
+    if not result:
+        return {}
+    return {
+        key: cap_value(value, max_length)
+        for key, value in result.items()
+        if key not in EXCLUDED_FIELDS
+    }
+
+
+class _FilteredExtra(dict):
+    """
+    Copy of the extra fields of a record with the fields added by a filter.
+    The fields bound by the caller are kept in 'original'.
+    """
+
+    def __init__(self, original, **fields):
+        super().__init__(original, **fields)
+        self.original = original
+
+
+class RateLimitFilter:
+    """
+    Loguru filter allowing at most a fixed number of records per call site and
+    level in each time window. Warnings and errors are never dropped.
+
+    The first record let through after a window in which records were dropped
+    carries the number of dropped records in its 'suppressed' extra field.
+    Loguru passes the same record to every sink, so the field is added to a
+    copy of the extra fields and only the sink of this filter sees it. Use one
+    instance per sink.
+    """
+
+    def __init__(self, max_per_window, window_seconds=60.0):
+        """
+        Create a RateLimitFilter instance.
+
+        Parameters:
+        - max_per_window (int): Records allowed per call site and window,
+          0 disables the limit.
+        - window_seconds (float): Length of the window in seconds.
+        """
+        self.max_per_window = max_per_window
+        self.window_seconds = window_seconds
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        # Undo the fields added by the filter of a previous sink
+        extra = record["extra"]
+        if isinstance(extra, _FilteredExtra):
+            record["extra"] = extra.original
+
+        if self.max_per_window <= 0 or record["level"].no >= WARNING_LEVEL:
+            return True
+
+        key = (record["name"], record["line"], record["level"].no)
+        now = time.monotonic()
+        with self._lock:
+            window_start, count, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - window_start >= self.window_seconds:
+                window_start, count = now, 0
+
+            if count >= self.max_per_window:
+                self._windows[key] = (window_start, count, suppressed + 1)
+                return False
+
+            self._windows[key] = (window_start, count + 1, 0)
+
+        if suppressed:
+            record["extra"] = _FilteredExtra(record["extra"], suppressed=suppressed)
+        return True
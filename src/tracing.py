@@ -0,0 +1,268 @@
+# src/tracing.py
+"""
+Tracing Module
+
+Per-stage inspection spans, trace-context propagation through AMQP headers and
+tail-based sampling: every slow or failed inspection is kept, only a small
+fraction of fast ones is exported.
+"""
+import os
+import random
+import threading
+from contextlib import contextmanager
+
+from loguru import logger
+from opentelemetry import propagate, trace
+from opentelemetry.sdk.trace import SpanProcessor, TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    SpanExporter,
+    SpanExportResult,
+)
+from opentelemetry.trace import Status, StatusCode
+
+import profiling
+from config_utils import get_env_variable
+
+TRACE_SLOW_THRESHOLD_MS = get_env_variable("TRACE_SLOW_THRESHOLD_MS", 1000, float)
+TRACE_FAST_SAMPLE_RATE = get_env_variable("TRACE_FAST_SAMPLE_RATE", 0.01, float)
+TRACE_EXPORT_FILE = get_env_variable("TRACE_EXPORT_FILE", "logs/traces.jsonl")
+TRACE_OTLP_ENDPOINT = get_env_variable("OTEL_EXPORTER_OTLP_ENDPOINT")
+
+# Upper bound on traces buffered while waiting for their spans to end
+TRACE_MAX_PENDING = 10000
+
+_tracer = trace.get_tracer(__name__)
+
+
+class JsonLinesSpanExporter(SpanExporter):
+    """
+    Span exporter writing one JSON document per span to a local file.
+
+    Stands in for an OTLP collector when none is configured.
+    """
+
+    def __init__(self, file_path):
+        """
+        Create a JsonLinesSpanExporter instance.
+
+        Parameters:
+        - file_path (str): The file to append spans to.
+        """
+        self.file_path = file_path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, spans):
+        try:
+            lines = "".join(span.to_json(indent=None) + "\n" for span in spans)
+            with self._lock, open(self.file_path, "a") as export_file:
+                export_file.write(lines)
+        except OSError as e:
+            logger.error(f"Failed to export spans to '{self.file_path}': {e}")
+            return SpanExportResult.FAILURE
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self):
+        pass
+
+
+class TailSamplingSpanProcessor(SpanProcessor):
+    """
+    Span processor that buffers the spans of a trace until the last of its
+    spans open in this process ends, then decides whether to keep the whole
+    trace.
+
+    Spans are grouped by trace id, so local roots of the same trace (e.g. the
+    Pika consumer span and a span started on a worker thread) are kept or
+    dropped together. A trace is kept when its longest span is slower than the
+    threshold, not counting the time a message waited for a worker
+    (inspector.queue_wait_ms), when any of its spans has an error status, or
+    for a random fraction of the rest.
+    """
+
+    def __init__(
+        self,
+        next_processor,
+        slow_threshold_ms=TRACE_SLOW_THRESHOLD_MS,
+        fast_sample_rate=TRACE_FAST_SAMPLE_RATE,
+        max_pending=TRACE_MAX_PENDING,
+    ):
+        """
+        Create a TailSamplingSpanProcessor instance.
+
+        Parameters:
+        - next_processor (SpanProcessor): Receives the spans of kept traces.
+        - slow_threshold_ms (float): Traces with a span at least this slow are
+          kept.
+        - fast_sample_rate (float): Fraction of fast, successful traces kept.
+        - max_pending (int): Maximum number of traces buffered at once.
+        """
+        self.next_processor = next_processor
+        self.slow_threshold_ms = slow_threshold_ms
+        self.fast_sample_rate = fast_sample_rate
+        self.max_pending = max_pending
+        # Trace id -> [number of open spans, ended spans]
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def on_start(self, span, parent_context=None):
+        with self._lock:
+            pending = self._pending.get(span.context.trace_id)
+            if pending is None:
+                if len(self._pending) >= self.max_pending:
+                    # Drop the oldest incomplete trace
+                    self._pending.pop(next(iter(self._pending)))
+                pending = self._pending[span.context.trace_id] = [0, []]
+            pending[0] += 1
+
+    def on_end(self, span):
+        trace_id = span.context.trace_id
+        with self._lock:
+            pending = self._pending.get(trace_id)
+            if pending is None:
+                # The trace was dropped while the span was open
+                return
+            pending[0] -= 1
+            pending[1].append(span)
+            if pending[0] > 0:
+                return
+            del self._pending[trace_id]
+
+        spans = pending[1]
+        if self._should_keep(spans):
+            for kept_span in spans:
+                self.next_processor.on_end(kept_span)
+
+    def _should_keep(self, spans):
+        duration_ms = max(
+            (span.end_time - span.start_time) / 1e6
+            - (span.attributes or {}).get("inspector.queue_wait_ms", 0)
+            for span in spans
+        )
+        if duration_ms >= self.slow_threshold_ms:
+            return True
+        if any(span.status.status_code is StatusCode.ERROR for span in spans):
+            return True
+        return random.random() < self.fast_sample_rate
+
+    def shutdown(self):
+        self.next_processor.shutdown()
+
+    def force_flush(self, timeout_millis=30000):
+        return self.next_processor.force_flush(timeout_millis)
+
+
+def create_span_exporter():
+    """
+    Create the span exporter: OTLP when OTEL_EXPORTER_OTLP_ENDPOINT is set and
+    the exporter package is installed, otherwise a local JSON lines file.
+
+    Returns:
+    - SpanExporter: The span exporter.
+    """
+    if TRACE_OTLP_ENDPOINT:
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+                OTLPSpanExporter,
+            )
+
+            return OTLPSpanExporter()
+        except ImportError:
+            logger.warning(
+                "OTLP exporter is not installed, exporting spans to "
+                f"'{TRACE_EXPORT_FILE}' instead."
+            )
+    return JsonLinesSpanExporter(TRACE_EXPORT_FILE)
+
+
+def configure_tracer_provider():
+    """
+    Register a tracer provider exporting tail-sampled traces.
+
+    Returns:
+    - TracerProvider: The registered tracer provider.
+    """
+    tracer_provider = TracerProvider()
+    tracer_provider.add_span_processor(
+        TailSamplingSpanProcessor(BatchSpanProcessor(create_span_exporter()))
+    )
+    trace.set_tracer_provider(tracer_provider)
+    return tracer_provider
+
+
+def inject_headers(headers=None):
+    """
+    Add the current trace context to a set of AMQP message headers.
+
+    Parameters:
+    - headers (dict): Existing headers, left unmodified.
+
+    Returns:
+    - dict: The headers including the trace context.
+    """
+    headers = dict(headers or {})
+    propagate.inject(headers)
+    return headers
+
+
+def extract_context(headers):
+    """
+    Extract the trace context from AMQP message headers.
+
+    Parameters:
+    - headers (dict or None): The message headers.
+
+    Returns:
+    - Context: The extracted context, empty when the headers carry none.
+    """
+    return propagate.extract(headers or {})
+
+
+def _set_attributes(span, attributes):
+    for name, value in attributes.items():
+        if value is not None:
+            span.set_attribute(f"inspector.{name}", value)
+
+
+@contextmanager
+def stage(name, **attributes):
+    """
+    Run a stage of an inspection in its own child span.
+
+    The stage is also timed for the profiler when profiling is enabled.
+
+    Parameters:
+    - name (str): The name of the stage (e.g. 'fetch', 'sniff', 'extract').
+    - attributes: Span attributes, prefixed with 'inspector.'.
+
+    Yields:
+    - Span: The stage span.
+    """
+    with _tracer.start_as_current_span(f"inspect.{name}") as span, profiling.stage(
+        name
+    ):
+        _set_attributes(span, attributes)
+        yield span
+
+
+def annotate(**attributes):
+    """
+    Record object details on the current span and the active profile.
+    """
+    _set_attributes(trace.get_current_span(), attributes)
+    profiling.annotate(**attributes)
+
+
+def mark_failed(description, span=None):
+    """
+    Set an error status on a span so that its trace is kept.
+
+    Parameters:
+    - description (str): Why the operation failed.
+    - span (Span): The span to mark, defaults to the current span.
+    """
+    span = span or trace.get_current_span()
+    span.set_status(Status(StatusCode.ERROR, description))
@@ -0,0 +1,316 @@
+# src/video_thumbnails.py
+"""
+Video Thumbnails Module
+
+Samples preview frames from a video by seeking rather than decoding it from
+the start. For each of N evenly spaced times ffmpeg seeks with the container
+index to the preceding keyframe, decodes that single keyframe and scales it
+down; over a presigned URL only the index and the keyframes are fetched with
+ranged requests. The cost therefore depends on the number of frames, not on
+the length of the video.
+
+The frames are encoded as compact WebP thumbnails, and their average color,
+brightness and the difference from the previous frame (a cheap scene change
+signal) are computed with NumPy.
+"""
+import base64
+import io
+import re
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from loguru import logger
+from PIL import Image
+
+from audio_analysis import ffmpeg_executable
+from config_utils import get_env_variable, parse_bool
+
+# Sample preview frames from videos
+VIDEO_THUMBNAILS = get_env_variable("VIDEO_THUMBNAILS", "false", parse_bool)
+# Number of frames sampled per video
+VIDEO_THUMBNAIL_COUNT = get_env_variable("VIDEO_THUMBNAIL_COUNT", 5, int)
+# Maximum width of the thumbnails (smaller videos are not upscaled)
+VIDEO_THUMBNAIL_WIDTH = get_env_variable("VIDEO_THUMBNAIL_WIDTH", 320, int)
+# WebP quality of the thumbnails (0-100)
+VIDEO_THUMBNAIL_QUALITY = get_env_variable("VIDEO_THUMBNAIL_QUALITY", 60, int)
+# Seconds allowed for probing and decoding all the frames of a video
+VIDEO_THUMBNAIL_BUDGET_SECONDS = get_env_variable(
+    "VIDEO_THUMBNAIL_BUDGET_SECONDS", 10.0, float
+)
+# Number of frames decoded concurrently
+VIDEO_THUMBNAIL_WORKERS = get_env_variable("VIDEO_THUMBNAIL_WORKERS", 2, int)
+
+# Side of the grayscale images the frame differences are computed on
+DIFFERENCE_SIZE = 32
+
+_DURATION = re.compile(r"Duration: (\d+):(\d{2}):(\d{2}(?:\.\d+)?)")
+_VIDEO_STREAM = re.compile(r"Stream #\d+:\d+.*?: Video: (\w+).*?, (\d+)x(\d+)")
+_AUDIO_STREAM = re.compile(r"Stream #\d+:\d+.*?: Audio: ")
+_FRAME_RATE = re.compile(r", ([\d.]+)(k?) (?:fps|tbr)")
+_PTS_TIME = re.compile(r"pts_time:\s*(-?[\d.]+)")
+
+
+def probe_video(source, timeout=VIDEO_THUMBNAIL_BUDGET_SECONDS):
+    """
+    Read the duration and the first video stream from the container headers.
+
+    Parameters:
+    - source (str): Path or URL of the video.
+    - timeout (float): Seconds allowed for ffmpeg.
+
+    Returns:
+    - dict or None: duration (None if unknown), video_codec, resolution,
+      frame_rate and has_audio, or None without a video stream.
+
+    Raises:
+    - RuntimeError: When ffmpeg is not available.
+    - subprocess.TimeoutExpired: When the probe takes too long.
+    """
+    executable = ffmpeg_executable()
+    if executable is None:
+        raise RuntimeError("ffmpeg is not available")
+    # Without an output ffmpeg only prints the input description
+    process = subprocess.run(
+        [executable, "-hide_banner", "-nostdin", "-i", source],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        timeout=timeout,
+    )
+    output = process.stderr.decode("utf-8", "replace")
+
+    lines = output.splitlines()
+    for line in lines:
+        stream = _VIDEO_STREAM.search(line)
+        # Cover art of audio files is not a video
+        if stream is not None and "attached pic" not in line:
+            break
+    else:
+        return None
+    has_audio = any(_AUDIO_STREAM.search(other) for other in lines)
+
+    duration = None
+    match = _DURATION.search(output)
+    if match is not None:
+        hours, minutes, seconds = match.groups()
+        duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+    frame_rate = None
+    match = _FRAME_RATE.search(line)
+    if match is not None:
+        frame_rate = float(match.group(1)) * (1000 if match.group(2) else 1)
+
+    return {
+        "duration": duration,
+        "video_codec": stream.group(1),
+        "resolution": [int(stream.group(2)), int(stream.group(3))],
+        "frame_rate": frame_rate,
+        "has_audio": has_audio,
+    }
+
+
+def sample_times(duration, count=VIDEO_THUMBNAIL_COUNT):
+    """
+    Spread the sampled times over the video, avoiding the very first and last
+    frames (often black).
+
+    Parameters:
+    - duration (float): Duration of the video in seconds.
+    - count (int): Number of times.
+
+    Returns:
+    - list: The times in seconds.
+    """
+    return [duration * (index + 0.5) / count for index in range(count)]
+
+
+def grab_frame(source, at, width=VIDEO_THUMBNAIL_WIDTH, timeout=None):
+    """
+    Decode the keyframe at or before a time, scaled down.
+
+    Parameters:
+    - source (str): Path or URL of the video.
+    - at (float): Time in seconds.
+    - width (int): Maximum width of the frame.
+    - timeout (float): Seconds allowed for ffmpeg.
+
+    Returns:
+    - tuple or None: The RGB PIL image and the time of the keyframe (None if
+      unknown), or None when no frame was decoded.
+
+    Raises:
+    - RuntimeError: When ffmpeg is not available.
+    - subprocess.TimeoutExpired: When decoding takes too long.
+    """
+    executable = ffmpeg_executable()
+    if executable is None:
+        raise RuntimeError("ffmpeg is not available")
+    command = [
+        executable,
+        "-hide_banner",
+        "-nostdin",
+        # Seek with the index to the preceding keyframe, and decode only
+        # keyframes instead of the frames up to the exact time
+        "-noaccurate_seek",
+        "-ss",
+        f"{at:.3f}",
+        "-skip_frame",
+        "nokey",
+        "-copyts",
+        "-i",
+        source,
+        "-map",
+        "0:v:0",
+        "-an",
+        "-sn",
+        "-dn",
+        "-frames:v",
+        "1",
+        "-vf",
+        f"showinfo,scale='min({width},iw)':-2:flags=bilinear",
+        "-f",
+        "image2pipe",
+        "-c:v",
+        "bmp",
+        "pipe:1",
+    ]
+    process = subprocess.run(
+        command,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        timeout=timeout,
+    )
+    if not process.stdout:
+        return None
+    match = _PTS_TIME.search(process.stderr.decode("utf-8", "replace"))
+    keyframe_time = float(match.group(1)) if match is not None else None
+    with Image.open(io.BytesIO(process.stdout)) as image:
+        return image.convert("RGB"), keyframe_time
+
+
+def frame_statistics(image):
+    """
+    Compute the average color and brightness of a frame.
+
+    Parameters:
+    - image (PIL.Image.Image): RGB frame.
+
+    Returns:
+    - tuple: The statistics (dict) and the small grayscale version of the
+      frame used for differences (ndarray).
+    """
+    pixels = np.asarray(image, dtype=np.float32)
+    average_color = pixels.reshape(-1, 3).mean(axis=0)
+    # Rec. 601 luma
+    brightness = float(average_color @ np.array([0.299, 0.587, 0.114])) / 255
+    small = np.asarray(
+        image.convert("L").resize((DIFFERENCE_SIZE, DIFFERENCE_SIZE)),
+        dtype=np.float32,
+    )
+    statistics = {
+        "average_color": [round(float(value)) for value in average_color],
+        "brightness": round(brightness, 4),
+    }
+    return statistics, small
+
+
+def encode_webp(image, quality=VIDEO_THUMBNAIL_QUALITY):
+    """
+    Encode a frame as WebP.
+
+    Parameters:
+    - image (PIL.Image.Image): The frame.
+    - quality (int): WebP quality (0-100).
+
+    Returns:
+    - bytes: The WebP image.
+    """
+    output = io.BytesIO()
+    image.save(output, format="WEBP", quality=quality, method=4)
+    return output.getvalue()
+
+
+def extract_thumbnails(
+    source,
+    duration=None,
+    count=VIDEO_THUMBNAIL_COUNT,
+    width=VIDEO_THUMBNAIL_WIDTH,
+    quality=VIDEO_THUMBNAIL_QUALITY,
+    budget=VIDEO_THUMBNAIL_BUDGET_SECONDS,
+    workers=VIDEO_THUMBNAIL_WORKERS,
+):
+    """
+    Sample thumbnails and per-frame statistics from a video.
+
+    Frames that cannot be decoded within the time budget are left out.
+
+    Parameters:
+    - source (str): Path or URL of the video (it must be seekable).
+    - duration (float): Duration of the video, probed when not given.
+    - count (int): Number of frames.
+    - width (int): Maximum width of the thumbnails.
+    - quality (int): WebP quality of the thumbnails.
+    - budget (float): Seconds allowed for the probe and all the frames.
+    - workers (int): Number of frames decoded concurrently.
+
+    Returns:
+    - dict or None: The thumbnails, or None without a video stream.
+    """
+    deadline = time.monotonic() + budget
+    try:
+        if duration is None:
+            probe = probe_video(source, timeout=budget)
+            if probe is None:
+                return None
+            duration = probe["duration"]
+    except (RuntimeError, subprocess.TimeoutExpired) as e:
+        logger.debug(f"Video probe failed: {e}")
+        return None
+    # Streams of unknown duration only get their first frame
+    times = sample_times(duration, count) if duration else [0.0]
+
+    def sample(at):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        try:
+            frame = grab_frame(source, at, width, timeout=remaining)
+        except (OSError, RuntimeError, subprocess.TimeoutExpired) as e:
+            logger.debug(f"Thumbnail at {at:.3f}s failed: {e}")
+            return None
+        if frame is None:
+            return None
+        image, keyframe_time = frame
+        statistics, small = frame_statistics(image)
+        thumbnail = {
+            "time": round(at, 3),
+            "keyframe_time": keyframe_time,
+            "width": image.width,
+            "height": image.height,
+            **statistics,
+            "webp_base64": base64.b64encode(encode_webp(image, quality)).decode(
+                "utf-8"
+            ),
+        }
+        return thumbnail, small
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        sampled = [result for result in executor.map(sample, times) if result]
+
+    thumbnails = []
+    previous = None
+    for thumbnail, small in sampled:
+        # Mean absolute difference from the previous thumbnail (0-1)
+        if previous is not None:
+            difference = float(np.abs(small - previous).mean()) / 255
+            thumbnail["difference"] = round(difference, 4)
+        previous = small
+        thumbnails.append(thumbnail)
+
+    return {
+        "thumbnails": thumbnails,
+        "complete": len(thumbnails) == len(times),
+    }